@@ -0,0 +1,79 @@
+import asyncio
+
+from app.emr_autoscaling.emr import METRIC_QUERIES
+from app.emr_autoscaling.scaler import EMR_API, LOCAL
+from app.emr_autoscaling.utils import get_logger
+
+
+class AsyncEmr:
+
+    def __init__(self, emr, semaphore):
+        self.emr = emr
+        self.job_flow_id = emr.job_flow_id
+        self.semaphore = semaphore
+        self.cluster_snapshot = None
+
+    async def _call(self, function, *args):
+        # boto3 clients block, so every AWS call runs on the loop's executor while the semaphore
+        # bounds how many calls are in flight across all clusters.
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def get_metric_snapshot(self, fields=tuple(METRIC_QUERIES)):
+        return await self._call(self.emr.get_metric_snapshot, fields)
+
+    async def get_cluster_snapshot(self):
+        self.cluster_snapshot = await self._call(lambda: self.emr.refresh_cluster_snapshot().load())
+        return self.cluster_snapshot
+
+    async def describe_cluster(self):
+        return await self._call(self.emr.describe_cluster)
+
+    async def is_termination_protected(self):
+        return await self._call(self.emr.is_termination_protected)
+
+    async def scale(self, direction, metrics=None, threshold=None):
+        if self.cluster_snapshot is None:
+            await self.get_cluster_snapshot()
+        scale_targets = self.emr.scale_targets(direction, metrics, threshold)
+        if scale_targets:
+            await self._call(self.emr.apply_scale_targets, scale_targets)
+        return scale_targets
+
+
+class AsyncEmrScaler:
+
+    def __init__(self, scaler, semaphore):
+        self.scaler = scaler
+        self.emr = AsyncEmr(scaler.emr, semaphore)
+        self.logger = get_logger('AsyncEMRScaler')
+
+    async def maybe_scale(self, threshold):
+        # Each cost tier runs against data fetched up front, so no predicate blocks the loop.
+        evaluation = self.scaler.evaluation(threshold)
+        evaluation.run(max_cost=LOCAL)
+        if not evaluation.is_decided():
+            await self.emr.get_cluster_snapshot()
+            if self.scaler.cooldown is not None:
+                await self.emr._call(lambda: self.scaler.cooldown.last_action)
+            evaluation.run(max_cost=EMR_API)
+        if not evaluation.is_decided():
+            evaluation.metrics = await self.emr.get_metric_snapshot(evaluation.metric_fields())
+            if self.scaler.forecast is not None:
+                await self.emr._call(lambda: self.scaler.forecast.profile)
+        direction = evaluation.run()
+        self.scaler.log_evaluation(evaluation)
+        if direction is None:
+            return None
+        scale_targets = await self.emr.scale(direction, self.scaler.scale_metrics(direction, evaluation.metrics),
+                                             threshold)
+        await self.emr._call(self.scaler.record_scaling, direction, scale_targets)
+        return direction if scale_targets else None
+
+    async def maybe_shutdown(self):
+        self.logger.info("Parent stack: %s" % self.scaler.parent_stack)
+        if self.scaler.parent_stack and self.scaler.is_after_shutdown_time() \
+                and not await self.emr.is_termination_protected():
+            await self.emr._call(self.scaler.shutdown)
+            return True
+        return False
@@ -0,0 +1,70 @@
+import boto3
+from botocore.config import Config
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+
+from app.emr_autoscaling.tracing import TRACER, TracedClient
+
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=3,
+    read_timeout=10,
+    retries={
+        "mode": "standard",
+        "max_attempts": 4
+    }
+)
+# Clients of an ApiBudget make a single attempt per call, the budget retries throttled and transient errors within
+# its limits.
+SINGLE_ATTEMPT_CONFIG = CLIENT_CONFIG.merge(Config(retries={"mode": "standard", "max_attempts": 1}))
+
+# Assumed role credentials are renewed this long before they expire.
+CREDENTIALS_REFRESH_MARGIN = timedelta(minutes=5)
+
+_clients = {}
+_lock = Lock()
+
+
+def get_client(service, region=None, role=None, retries=True):
+    key = (service, region, role, retries)
+    with _lock:
+        client, expiration = _clients.get(key, (None, None))
+        if client is None or (expiration and expiration - CREDENTIALS_REFRESH_MARGIN <= datetime.now(timezone.utc)):
+            client, expiration = _create_client(service, region, role,
+                                                CLIENT_CONFIG if retries else SINGLE_ATTEMPT_CONFIG)
+            client = TracedClient(service, client, TRACER)
+            _clients[key] = (client, expiration)
+        return client
+
+
+def register_client(service, client, region=None, role=None):
+    client = TracedClient(service, client, TRACER)
+    with _lock:
+        for retries in (True, False):
+            _clients[(service, region, role, retries)] = (client, None)
+
+
+def clear_clients():
+    with _lock:
+        _clients.clear()
+
+
+def _create_client(service, region, role, config=CLIENT_CONFIG):
+    if not role:
+        return boto3.client(service, region_name=region, config=config), None
+
+    credentials = boto3.client("sts", region_name=region, config=CLIENT_CONFIG).assume_role(
+        RoleArn=role,
+        RoleSessionName="emr-autoscaling"
+    )["Credentials"]
+    client = boto3.client(
+        service,
+        region_name=region,
+        config=config,
+        aws_access_key_id=credentials["AccessKeyId"],
+        aws_secret_access_key=credentials["SecretAccessKey"],
+        aws_session_token=credentials["SessionToken"]
+    )
+    return client, credentials["Expiration"]
@@ -1,2 +1,12 @@
 DOWN = -1
 UP = 1
+
+# Scale-up sizing modes
+STEP = "STEP"
+DEMAND = "DEMAND"
+
+# Instance collection types and fleet markets
+INSTANCE_GROUP = "INSTANCE_GROUP"
+INSTANCE_FLEET = "INSTANCE_FLEET"
+SPOT = "SPOT"
+ON_DEMAND = "ON_DEMAND"
@@ -1,82 +1,291 @@
-import boto3
+from collections import namedtuple
 from datetime import datetime, timedelta
-from app.emr_autoscaling.constants import UP
-from app.emr_autoscaling.utils import get_logger
+from app.emr_autoscaling.clients import get_client
+from app.emr_autoscaling.throttling import budgeted
+from app.emr_autoscaling.constants import DEMAND, DOWN, STEP, UP
+from app.emr_autoscaling.instance_types import containers_per_instance, get_instance_type
+from app.emr_autoscaling.utils import TtlCache, get_logger
 
 import math
 
 
+def aggregate(values, aggregation):
+    if aggregation == "mean":
+        return sum(values) / len(values)
+    if aggregation == "max":
+        return max(values)
+    if aggregation == "min":
+        return min(values)
+    if aggregation == "latest":
+        return values[0]
+    if aggregation.startswith("p"):
+        ordered = sorted(values)
+        return ordered[max(0, int(math.ceil(float(aggregation[1:]) / 100 * len(ordered))) - 1)]
+    raise ValueError("Unsupported aggregation %s." % aggregation)
+
+
+class MetricSnapshot(namedtuple("MetricSnapshot",
+                                ["container_pending", "memory_allocated_mb", "memory_total_mb", "memory_ratio"],
+                                defaults=(None, None, None, None))):
+    __slots__ = ()
+
+    @property
+    def memory_used_ratio(self):
+        # memory_ratio aggregates a window of several datapoints, otherwise the latest datapoint is used.
+        if self.memory_ratio is not None:
+            return self.memory_ratio
+        if self.memory_allocated_mb is None or not self.memory_total_mb:
+            return None
+        return self.memory_allocated_mb / self.memory_total_mb
+
+
+# Trailing window, datapoint period and aggregation of the memory used ratio read by the downscale rule.
+MemoryWindow = namedtuple("MemoryWindow", ["minutes", "period", "aggregation"])
+HOURLY_AVERAGE = MemoryWindow(minutes = 60, period = 3600, aggregation = "mean")
+
+
+# describe_cluster results are kept across warm invocations, termination protection and tags rarely change.
+CLUSTER_DESCRIPTIONS = TtlCache(ttl_seconds=15 * 60)
+
+# Metric name, period and statistic queried for each fetched MetricSnapshot field.
+METRIC_QUERIES = {
+    "container_pending": ("ContainerPending", 300, "Maximum"),
+    "memory_allocated_mb": ("MemoryAllocatedMB", 3600, "Average"),
+    "memory_total_mb": ("MemoryTotalMB", 3600, "Average")
+}
+MEMORY_FIELDS = ("memory_allocated_mb", "memory_total_mb")
+# Fields whose latest datapoint only counts within this age, the query window is at least an hour long.
+MAX_DATAPOINT_AGE = {"container_pending": timedelta(minutes = 5)}
+
+
+def bid_price(group):
+    try:
+        return float(group["BidPrice"])
+    except ValueError:
+        return None
+
+
+class ClusterSnapshot:
+
+    def __init__(self, task_groups):
+        # Groups are pulled from the source only as far as a caller iterates and are kept for later callers.
+        self._source = iter(task_groups)
+        self._task_groups = []
+        self._exhausted = False
+        # Scale targets computed from these groups, by direction and, in DEMAND mode, metrics and threshold.
+        self.scale_targets = {}
+
+    def __iter__(self):
+        index = 0
+        while True:
+            if index < len(self._task_groups):
+                yield self._task_groups[index]
+                index += 1
+            elif self._exhausted:
+                return
+            else:
+                try:
+                    self._task_groups.append(next(self._source))
+                except StopIteration:
+                    self._exhausted = True
+
+    @property
+    def task_groups(self):
+        return tuple(self)
+
+    def load(self):
+        for _ in self:
+            pass
+        return self
+
+    def scaling_in_progress(self):
+        for group in self:
+            if group["RequestedInstanceCount"] != group["RunningInstanceCount"]:
+                return True
+
+        return False
+
+    def groups_by_bid_price(self):
+        # Highest bid first, groups bidding the on-demand price have no numeric bid and come last.
+        return sorted(self, key=lambda g: (bid_price(g) is not None, bid_price(g) or 0), reverse=True)
+
+
+def allocate(groups, demand, capacity_of, min_instances, max_instances, max_change = None):
+    # Splits a capacity demand across the groups in the given order, filling each group up to (or draining it down
+    # to) its bound before moving on. Positive demand adds capacity, negative demand removes it. max_change caps the
+    # number of instances changed across all groups.
+    scale_targets = []
+    remaining = abs(demand)
+    for group in groups:
+        if remaining <= 0 or max_change is not None and max_change <= 0:
+            break
+        capacity = capacity_of(group)
+        current = group["RequestedInstanceCount"]
+        if demand > 0:
+            count = min(max_instances - current, int(math.ceil(remaining / capacity)))
+        else:
+            count = min(current - min_instances, int(remaining // capacity))
+        if max_change is not None:
+            count = min(count, max_change)
+            max_change -= max(count, 0)
+        if count > 0:
+            scale_targets.append((group, current + count if demand > 0 else current - count))
+            remaining -= count * capacity
+    return scale_targets
+
+
 class Emr:
 
-    def __init__(self, job_flow_id, min_instances = 0, max_instances = 20, region = None):
+    def __init__(self, job_flow_id, min_instances = 0, max_instances = 20, region = None, role = None,
+                 scale_up_mode = STEP, container_memory_mb = None, container_vcores = 1,
+                 memory_window = HOURLY_AVERAGE, scale_down_mode = STEP, max_removal_per_cycle = None, budget = None):
         self.min_instances = min_instances
         self.max_instances = max_instances
+        self.scale_up_mode = scale_up_mode
+        self.container_memory_mb = container_memory_mb
+        self.container_vcores = container_vcores
+        self.memory_window = memory_window
+        self.scale_down_mode = scale_down_mode
+        self.max_removal_per_cycle = max_removal_per_cycle
         self.job_flow_id = job_flow_id
+        self.region = region
+        self.role = role
+        self.budget = budget
         self.logger = get_logger('EMR')
-        if region:
-            self.emr = boto3.client("emr", region_name = region)
-            self.cloudwatch = boto3.client("cloudwatch", region_name = region)
-        else:
-            self.emr = boto3.client("emr")
-            self.cloudwatch = boto3.client("cloudwatch")
-
-    def get_average_of_last_hour(self, metric_name):
-        now = datetime.utcnow().replace(second = 0, microsecond = 0)
-        stats = self.cloudwatch.get_metric_statistics (
-            Namespace = "AWS/ElasticMapReduce",
-            MetricName = metric_name,
-            StartTime = now - timedelta(hours = 1),
-            EndTime = now,
-            Period = 3600,
-            Statistics = [
-                "Average",
-            ],
-            Unit = "Count",
-            Dimensions = [
-                {
-                    "Name": "JobFlowId",
-                    "Value": self.job_flow_id
-                }
+        # Called like datetime.utcnow, a simulation replaces it with its own clock.
+        self.clock = datetime.utcnow
+        self._cluster_snapshot = None
+        self._metric_data_queries = {}
+        # With a budget, throttled calls are retried by the budget only.
+        retries = budget is None
+        self.emr = budgeted(budget, "emr", get_client("emr", region, role, retries = retries))
+        self.cloudwatch = budgeted(budget, "cloudwatch", get_client("cloudwatch", region, role, retries = retries))
+
+    def _metric_data_query(self, query_id, metric_name, period, stat):
+        return {
+            "Id": query_id,
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": "AWS/ElasticMapReduce",
+                    "MetricName": metric_name,
+                    "Dimensions": [
+                        {
+                            "Name": "JobFlowId",
+                            "Value": self.job_flow_id
+                        }
+                    ]
+                },
+                "Period": period,
+                "Stat": stat,
+                "Unit": "Count"
+            }
+        }
+
+    def metric_query(self, field):
+        metric_name, period, stat = METRIC_QUERIES[field]
+        if field in MEMORY_FIELDS:
+            period = self.memory_window.period
+        return metric_name, period, stat
+
+    def metric_data_queries(self, fields):
+        # The queries of a set of fields never change, every snapshot of the cluster reuses them.
+        if fields not in self._metric_data_queries:
+            self._metric_data_queries[fields] = [
+                self._metric_data_query(field, *self.metric_query(field)) for field in fields
             ]
-        )
-        average = stats["Datapoints"][0]["Average"]
-        return average
-
-    def get_pending_containers(self):
-        now = datetime.utcnow().replace(second = 0, microsecond = 0)
-        stats = self.cloudwatch.get_metric_statistics (
-            Namespace = "AWS/ElasticMapReduce",
-            MetricName = "ContainerPending",
-            StartTime = now - timedelta(minutes = 5),
+        return self._metric_data_queries[fields]
+
+    def get_metric_snapshot(self, fields = tuple(METRIC_QUERIES)):
+        now = self.clock().replace(second = 0, microsecond = 0)
+        response = self.cloudwatch.get_metric_data(
+            MetricDataQueries = self.metric_data_queries(tuple(fields)),
+            StartTime = now - max(timedelta(hours = 1), timedelta(minutes = self.memory_window.minutes)),
             EndTime = now,
-            Period = 300,
-            Statistics = [
-                "Maximum",
-            ],
-            Unit = "Count",
-            Dimensions = [
-                {
-                    "Name": "JobFlowId",
-                    "Value": self.job_flow_id
-                }
-            ]
+            ScanBy = "TimestampDescending"
+        )
+        results = {result["Id"]: result for result in response["MetricDataResults"]}
+        snapshot = {field: self.latest_value(field, results[field], now) for field in fields}
+        if all(field in fields for field in MEMORY_FIELDS):
+            snapshot["memory_ratio"] = self.aggregate_memory_ratio(results["memory_allocated_mb"],
+                                                                   results["memory_total_mb"], now)
+        return MetricSnapshot(**snapshot)
+
+    def latest_value(self, field, result, now):
+        # Results are newest first, so the first value of each query is the latest datapoint. A missing or stale
+        # datapoint leaves the field None.
+        metric_name = METRIC_QUERIES[field][0]
+        if not result["Values"]:
+            self.logger.warning("No {} datapoint for cluster {}.".format(metric_name, self.job_flow_id))
+            return None
+        timestamp = result["Timestamps"][0]
+        if field in MAX_DATAPOINT_AGE and timestamp.replace(tzinfo = None) < now - MAX_DATAPOINT_AGE[field]:
+            self.logger.warning("Latest {} datapoint of cluster {} is from {}, ignoring it.".format(
+                metric_name, self.job_flow_id, timestamp
+            ))
+            return None
+        return result["Values"][0]
+
+    def aggregate_memory_ratio(self, allocated, total, now):
+        if self.memory_window.minutes * 60 <= self.memory_window.period:
+            return None
+        # CloudWatch omits periods without data, so the window is cut by timestamp rather than by count.
+        since = now - timedelta(minutes = self.memory_window.minutes)
+        totals = dict(zip(total["Timestamps"], total["Values"]))
+        ratios = [
+            value / totals[timestamp]
+            for timestamp, value in zip(allocated["Timestamps"], allocated["Values"])
+            if timestamp.replace(tzinfo = None) >= since and totals.get(timestamp)
+        ]
+        return aggregate(ratios, self.memory_window.aggregation) if ratios else None
+
+    def get_metric_history(self, metric_name, start_time, end_time, period, stat):
+        request = dict(
+            MetricDataQueries = [self._metric_data_query("history", metric_name, period, stat)],
+            StartTime = start_time,
+            EndTime = end_time,
+            ScanBy = "TimestampAscending"
         )
-        return stats["Datapoints"][0]["Maximum"]
+        history = []
+        while True:
+            response = self.cloudwatch.get_metric_data(**request)
+            for result in response["MetricDataResults"]:
+                history.extend(zip(result["Timestamps"], result["Values"]))
+            if not response.get("NextToken"):
+                return history
+            request["NextToken"] = response["NextToken"]
 
-    def get_task_instance_groups(self):
-        instance_groups = self.emr.list_instance_groups(ClusterId=self.job_flow_id)["InstanceGroups"]
-        return [g for g in instance_groups if "BidPrice" in g and g["InstanceGroupType"] == "TASK"]
+    def iter_task_instance_groups(self):
+        request = {"ClusterId": self.job_flow_id}
+        while True:
+            page = self.emr.list_instance_groups(**request)
+            for group in page["InstanceGroups"]:
+                if "BidPrice" in group and group["InstanceGroupType"] == "TASK":
+                    yield group
+            if not page.get("Marker"):
+                return
+            request["Marker"] = page["Marker"]
+
+    @property
+    def cluster_snapshot(self):
+        if self._cluster_snapshot is None:
+            self.refresh_cluster_snapshot()
+        return self._cluster_snapshot
+
+    def refresh_cluster_snapshot(self):
+        self._cluster_snapshot = ClusterSnapshot(self.iter_task_instance_groups())
+        return self._cluster_snapshot
 
     def scaling_in_progress(self):
-        groups = self.get_task_instance_groups()
-        for group in groups:
-            if group["RequestedInstanceCount"] != group["RunningInstanceCount"]:
-                return True
+        return self.cluster_snapshot.scaling_in_progress()
 
-        return False
+    def describe_cluster(self):
+        return CLUSTER_DESCRIPTIONS.get(
+            (self.region, self.role, self.job_flow_id),
+            lambda: self.emr.describe_cluster(ClusterId=self.job_flow_id)["Cluster"]
+        )
 
     def is_termination_protected(self):
-        termination_protected = self.emr.describe_cluster(ClusterId=self.job_flow_id)["Cluster"]["TerminationProtected"]
+        termination_protected = self.describe_cluster()["TerminationProtected"]
         self.logger.info("Is cluster %s termination protected? %s" % (self.job_flow_id, termination_protected))
         return termination_protected
 
@@ -88,45 +297,118 @@ class Emr:
         roundfunc = math.ceil if direction == UP else math.floor
         return int(current_instance_count + roundfunc(direction * 0.2 * current_instance_count))
 
+    def get_capacities(self, groups):
+        # YARN containers each instance type delivers, or None unless the catalogue knows every type.
+        capacities = {
+            g.get("InstanceType"): containers_per_instance(g.get("InstanceType"), self.container_memory_mb,
+                                                           self.container_vcores)
+            for g in groups
+        }
+        return capacities if all(capacities.values()) else None
+
     @staticmethod
-    def is_target_count_not_reached(current_requested_instances, target_requested_instances):
-        return current_requested_instances != target_requested_instances
-
-    def scale(self, direction):
-        groups = sorted (
-            self.get_task_instance_groups(),
-            key=lambda g: g["BidPrice"],
-            reverse=True
+    def rank_groups(snapshot, direction, capacities):
+        groups = snapshot.groups_by_bid_price()
+        if capacities is None or any(bid_price(g) is None for g in groups):
+            return groups
+        # Scale up into the groups delivering the most YARN capacity per dollar, scale down the least efficient first.
+        return sorted(groups, key=lambda g: capacities[g["InstanceType"]] / bid_price(g), reverse=direction == UP)
+
+    def get_removable_memory(self, groups, metrics, threshold):
+        memory = {g.get("InstanceType"): get_instance_type(g.get("InstanceType")) for g in groups}
+        if not all(memory.values()):
+            self.logger.info("No YARN memory known for some of the instance types {}, scaling in steps.".format(
+                sorted(memory)
+            ))
+            return None
+        # Removing instances must not push the memory used ratio above the threshold: the remaining YARN memory has
+        # to hold the allocated memory at no more than the threshold.
+        allocated_mb = metrics.memory_used_ratio * metrics.memory_total_mb
+        removable_mb = max(0, metrics.memory_total_mb - allocated_mb / threshold)
+        self.logger.info("{:.0f} MB of YARN memory can be removed staying below a memory used ratio of {}.".format(
+            removable_mb, threshold
+        ))
+        return -removable_mb, lambda g: memory[g["InstanceType"]].yarn_memory_mb
+
+    def get_scale_demand(self, groups, direction, metrics = None, capacities = None, threshold = None):
+        if direction == DOWN and self.scale_down_mode == DEMAND and metrics is not None and threshold:
+            removable_memory = self.get_removable_memory(groups, metrics, threshold)
+            if removable_memory is not None:
+                return removable_memory
+
+        capacity_of = (lambda g: capacities[g["InstanceType"]]) if capacities else (lambda g: 1)
+        if direction == UP and self.scale_up_mode == DEMAND and metrics is not None and metrics.container_pending:
+            if capacities:
+                return metrics.container_pending, capacity_of
+            self.logger.info("No capacity known for some of the instance types {}, scaling in steps.".format(
+                sorted(g.get("InstanceType") for g in groups)
+            ))
+
+        # Steps are taken in capacity units, so a step of a large instance group is worth more than a small one's.
+        demand = sum(
+            (self.calculate_new_instance_count(g["RequestedInstanceCount"], direction) - g["RequestedInstanceCount"])
+            * capacity_of(g)
+            for g in groups
         )
-        for group in groups:
-            current_requested_instances = group['RequestedInstanceCount']
-            target_requested_instances = self.calculate_new_instance_count(group['RequestedInstanceCount'], direction)
+        return demand, capacity_of
 
-            if self.is_target_count_not_reached(current_requested_instances, target_requested_instances) \
-                    and self.min_instances <= target_requested_instances <= self.max_instances:
-                self.emr.modify_instance_groups (
-                    InstanceGroups = [
-                        {
-                            "InstanceGroupId": group["Id"],
-                            "InstanceCount": target_requested_instances
-                        }
-                    ]
-                )
-                self.logger.info (
-                    "[{}   --   {}] New number of task instances is {}.".format (
-                        group["Name"],
-                        group["InstanceType"],
-                        target_requested_instances
+    def get_scale_targets(self, direction, metrics = None, threshold = None):
+        capacities = self.get_capacities(self.cluster_snapshot)
+        groups = self.rank_groups(self.cluster_snapshot, direction, capacities)
+        demand, capacity_of = self.get_scale_demand(groups, direction, metrics, capacities, threshold)
+        scale_targets = allocate(groups, demand, capacity_of, self.min_instances, self.max_instances,
+                                 self.max_removal_per_cycle if direction == DOWN else None)
+
+        # Groups that got no share of the demand are only worth a message when they are at their bound.
+        scaled_groups = [group["Id"] for group, _ in scale_targets]
+        for group in groups:
+            at_bound = group["RequestedInstanceCount"] >= self.max_instances if direction == UP \
+                else group["RequestedInstanceCount"] <= self.min_instances
+            if group.get("Id") not in scaled_groups and at_bound:
+                self.logger.info(
+                    "[{}   --   {}] Number of task instances {} can not move further within bounds of ({}-{})".format (
+                        group.get("Name", "dummy group name"),
+                        group.get("InstanceType", "dummy instance type"),
+                        group["RequestedInstanceCount"],
+                        self.min_instances,
+                        self.max_instances
                     )
                 )
-                break
-
-            self.logger.info(
-                "[{}   --   {}] New number of task instances is {}, out of bounds of ({}-{})".format (
-                    group.get("Name", "dummy group name"),
-                    group.get("InstanceType", "dummy instance type"),
-                    target_requested_instances,
-                    self.min_instances,
-                    self.max_instances
+        return scale_targets
+
+    def scale_targets(self, direction, metrics = None, threshold = None):
+        # can_scale and scale of one evaluation share the targets of the current cluster snapshot.
+        targets = self.cluster_snapshot.scale_targets
+        mode = self.scale_up_mode if direction == UP else self.scale_down_mode
+        key = (direction, metrics, threshold) if mode == DEMAND else direction
+        if key not in targets:
+            targets[key] = self.get_scale_targets(direction, metrics, threshold)
+        return targets[key]
+
+    def can_scale(self, direction):
+        return len(self.scale_targets(direction)) > 0
+
+    def scale(self, direction, metrics = None, threshold = None):
+        scale_targets = self.scale_targets(direction, metrics, threshold)
+        if scale_targets:
+            self.apply_scale_targets(scale_targets)
+        return scale_targets
+
+    def apply_scale_targets(self, scale_targets):
+        self.emr.modify_instance_groups (
+            InstanceGroups = [
+                {
+                    "InstanceGroupId": group["Id"],
+                    "InstanceCount": target_requested_instances
+                }
+                for group, target_requested_instances in scale_targets
+            ]
+        )
+        for group, target_requested_instances in scale_targets:
+            self.logger.info (
+                "[{}   --   {}] New number of task instances is {}.".format (
+                    group["Name"],
+                    group["InstanceType"],
+                    target_requested_instances
                 )
             )
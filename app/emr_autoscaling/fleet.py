@@ -0,0 +1,97 @@
+import math
+
+from app.emr_autoscaling.constants import DEMAND, ON_DEMAND, SPOT, UP
+from app.emr_autoscaling.emr import ClusterSnapshot, Emr
+from app.emr_autoscaling.instance_types import containers_per_instance
+
+TARGET_CAPACITY_KEYS = {
+    SPOT: ("TargetSpotCapacity", "ProvisionedSpotCapacity"),
+    ON_DEMAND: ("TargetOnDemandCapacity", "ProvisionedOnDemandCapacity")
+}
+
+
+def target_capacity(fleet):
+    return fleet.get("TargetOnDemandCapacity", 0) + fleet.get("TargetSpotCapacity", 0)
+
+
+class FleetSnapshot(ClusterSnapshot):
+
+    def scaling_in_progress(self):
+        for fleet in self:
+            # Weighted capacity may overshoot the target, so only missing capacity counts as in progress.
+            if fleet["Status"]["State"] == "RESIZING" or any(
+                fleet.get(provisioned, 0) < fleet.get(target, 0)
+                for target, provisioned in TARGET_CAPACITY_KEYS.values()
+            ):
+                return True
+
+        return False
+
+
+class EmrFleet(Emr):
+    # min_instances and max_instances bound the weighted target capacity (on-demand plus spot) of the task fleet.
+
+    def __init__(self, job_flow_id, market = SPOT, **kwargs):
+        super().__init__(job_flow_id, **kwargs)
+        self.market = market
+
+    def iter_task_instance_fleets(self):
+        request = {"ClusterId": self.job_flow_id}
+        while True:
+            page = self.emr.list_instance_fleets(**request)
+            for fleet in page["InstanceFleets"]:
+                if fleet["InstanceFleetType"] == "TASK":
+                    yield fleet
+            if not page.get("Marker"):
+                return
+            request["Marker"] = page["Marker"]
+
+    def refresh_cluster_snapshot(self):
+        self._cluster_snapshot = FleetSnapshot(self.iter_task_instance_fleets())
+        return self._cluster_snapshot
+
+    def get_capacity_demand(self, fleet, direction, metrics = None):
+        if direction == UP and self.scale_up_mode == DEMAND and metrics is not None and metrics.container_pending:
+            specifications = fleet.get("InstanceTypeSpecifications", [])
+            containers_per_unit = [
+                (containers_per_instance(spec["InstanceType"], self.container_memory_mb, self.container_vcores) or 0)
+                / spec.get("WeightedCapacity", 1)
+                for spec in specifications
+            ]
+            if containers_per_unit and all(containers_per_unit):
+                # The fleet may launch any of its instance types, so size for the one fitting the fewest containers.
+                return int(math.ceil(metrics.container_pending / min(containers_per_unit)))
+            self.logger.info("No capacity known for some instance types of fleet {}, scaling in steps.".format(
+                fleet["Id"]
+            ))
+
+        current_capacity = target_capacity(fleet)
+        return self.calculate_new_instance_count(current_capacity, direction) - current_capacity
+
+    def get_scale_targets(self, direction, metrics = None, threshold = None):
+        # Fleets always scale down in steps, their weighted units have no fixed YARN memory.
+        target_key = TARGET_CAPACITY_KEYS[self.market][0]
+        scale_targets = []
+        for fleet in self.cluster_snapshot:
+            current_capacity = target_capacity(fleet)
+            bounded_capacity = max(self.min_instances, min(self.max_instances,
+                                                           current_capacity + self.get_capacity_demand(fleet, direction,
+                                                                                                       metrics)))
+            market_capacity = max(0, fleet.get(target_key, 0) + bounded_capacity - current_capacity)
+            # A fleet already outside its bounds is left alone rather than moved against the requested direction.
+            if (market_capacity - fleet.get(target_key, 0)) * direction > 0:
+                scale_targets.append((fleet, {target_key: market_capacity}))
+            else:
+                self.logger.info(
+                    "[{}] Target capacity {} can not move further within bounds of ({}-{})".format(
+                        fleet.get("Name", fleet["Id"]), current_capacity, self.min_instances, self.max_instances
+                    )
+                )
+        return scale_targets
+
+    def apply_scale_targets(self, scale_targets):
+        for fleet, capacities in scale_targets:
+            instance_fleet = {"InstanceFleetId": fleet["Id"]}
+            instance_fleet.update(capacities)
+            self.emr.modify_instance_fleet(ClusterId=self.job_flow_id, InstanceFleet=instance_fleet)
+            self.logger.info("[{}] New target capacity is {}.".format(fleet.get("Name", fleet["Id"]), capacities))
@@ -0,0 +1,89 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from statistics import median
+
+from app.pytz import timezone, utc
+
+from app.emr_autoscaling.utils import get_logger
+
+HOURS_PER_WEEK = 7 * 24
+CACHE_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def hour_of_week(time):
+    return time.weekday() * 24 + time.hour
+
+
+class SeasonalForecast:
+
+    def __init__(self, emr, weeks=4, lead_minutes=30, min_containers=1, max_age_hours=24, cache_dir=None,
+                 time_zone=timezone('Europe/Berlin'), clock=datetime.utcnow):
+        self.emr = emr
+        self.weeks = weeks
+        # How far ahead a peak is anticipated, roughly the time new task instances need to join the cluster.
+        self.lead_minutes = lead_minutes
+        self.min_containers = min_containers
+        self.max_age_hours = max_age_hours
+        self.time_zone = time_zone
+        self.clock = clock
+        self.logger = get_logger('Forecast')
+        # /tmp survives warm Lambda invocations, so the profile is learned about once a day per cluster.
+        self.cache_path = os.path.join(
+            cache_dir or tempfile.gettempdir(), "emr-autoscaling-forecast-{}.json".format(emr.job_flow_id)
+        )
+        self._profile = None
+
+    def local_time(self, time):
+        if time.tzinfo is None:
+            time = utc.localize(time)
+        return time.astimezone(self.time_zone)
+
+    def learn(self):
+        end_time = self.clock().replace(minute=0, second=0, microsecond=0)
+        history = self.emr.get_metric_history(
+            "ContainerPending", end_time - timedelta(weeks=self.weeks), end_time, 3600, "Maximum"
+        )
+        samples = [[] for _ in range(HOURS_PER_WEEK)]
+        for timestamp, value in history:
+            samples[hour_of_week(self.local_time(timestamp))].append(value)
+        # The median over past weeks ignores one-off spikes, hours without data predict no demand.
+        return [median(values) if values else 0.0 for values in samples]
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            return None
+        learned_at = datetime.strptime(cache["LearnedAt"], CACHE_TIME_FORMAT)
+        if cache["Weeks"] != self.weeks or self.clock() - learned_at > timedelta(hours=self.max_age_hours):
+            return None
+        return cache["Profile"]
+
+    def save_cache(self, profile):
+        cache = {"LearnedAt": self.clock().strftime(CACHE_TIME_FORMAT), "Weeks": self.weeks, "Profile": profile}
+        try:
+            with open(self.cache_path + ".tmp", "w") as f:
+                json.dump(cache, f)
+            os.replace(self.cache_path + ".tmp", self.cache_path)
+        except IOError:
+            self.logger.warning("Could not cache the demand profile in %s." % self.cache_path)
+
+    @property
+    def profile(self):
+        if self._profile is None:
+            self._profile = self.load_cache()
+            if self._profile is None:
+                self._profile = self.learn()
+                self.save_cache(self._profile)
+        return self._profile
+
+    def predicted_pending(self, time=None):
+        time = (time or self.clock()) + timedelta(minutes=self.lead_minutes)
+        return self.profile[hour_of_week(self.local_time(time))]
+
+    def peak_ahead(self, time=None):
+        predicted = self.predicted_pending(time)
+        return predicted if predicted >= self.min_containers else 0
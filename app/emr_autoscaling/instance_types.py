@@ -0,0 +1,33 @@
+import json
+import os
+from collections import namedtuple
+
+InstanceType = namedtuple("InstanceType", ["name", "vcpu", "memory_gib", "yarn_memory_mb"])
+
+# YARN memory per node is EMR's default yarn.nodemanager.resource.memory-mb, YARN vcores default to the vCPU count.
+CATALOGUE_PATH = os.path.join(os.path.dirname(__file__), "instance_types.json")
+
+_catalogue = None
+
+
+def get_catalogue():
+    global _catalogue
+    if _catalogue is None:
+        with open(CATALOGUE_PATH) as f:
+            _catalogue = {name: InstanceType(name=name, **attributes) for name, attributes in json.load(f).items()}
+    return _catalogue
+
+
+def get_instance_type(name):
+    return get_catalogue().get(name)
+
+
+def containers_per_instance(name, container_memory_mb=None, container_vcores=1):
+    instance_type = get_instance_type(name)
+    if instance_type is None:
+        return None
+
+    limits = [instance_type.vcpu // container_vcores]
+    if container_memory_mb:
+        limits.append(instance_type.yarn_memory_mb // container_memory_mb)
+    return int(min(limits))
@@ -1,16 +1,83 @@
-import boto3
+from collections import namedtuple
 from datetime import datetime
+from logging import INFO
 
 from app.pytz import timezone
 
+from app.emr_autoscaling.clients import get_client
+from app.emr_autoscaling.throttling import budgeted
 from app.emr_autoscaling.utils import get_logger
 from app.emr_autoscaling.constants import UP, DOWN
 
 
+# I/O cost of a predicate. Cheaper predicates are evaluated first.
+LOCAL = 0
+EMR_API = 1
+STATE_STORE = 1
+CLOUDWATCH_API = 2
+
+Predicate = namedtuple("Predicate", ["name", "cost", "directions", "check"])
+
+# MetricSnapshot fields the remote predicates of each direction read.
+METRIC_FIELDS = {
+    UP: ("container_pending",),
+    DOWN: ("container_pending", "memory_allocated_mb", "memory_total_mb")
+}
+
+
+class Evaluation:
+
+    def __init__(self, scaler, threshold, predicates):
+        self.scaler = scaler
+        self.threshold = threshold
+        # Directions that are still possible, in order of precedence.
+        self.live = [UP, DOWN]
+        self.pending = sorted(predicates, key=lambda p: p.cost)
+        # How many predicates follow the last one deciding on each direction, once no more are pending it is decided.
+        self.after_last = dict.fromkeys(self.live, len(self.pending))
+        for i, predicate in enumerate(self.pending):
+            for direction in predicate.directions:
+                self.after_last[direction] = len(self.pending) - 1 - i
+        self.evaluated = []
+        self.skipped = []
+        self.metrics = None
+
+    def metric_fields(self):
+        fields = [field for direction in self.live for field in METRIC_FIELDS[direction]]
+        return tuple(field for i, field in enumerate(fields) if field not in fields[:i])
+
+    def get_metrics(self):
+        if self.metrics is None:
+            self.metrics = self.scaler.emr.get_metric_snapshot(self.metric_fields())
+        return self.metrics
+
+    def is_decided(self):
+        return not self.live or len(self.pending) <= self.after_last[self.live[0]]
+
+    def can_change_outcome(self, predicate):
+        return not self.is_decided() and not set(self.live).isdisjoint(predicate.directions)
+
+    def run(self, max_cost=None):
+        while self.pending and (max_cost is None or self.pending[0].cost <= max_cost):
+            if not self.can_change_outcome(self.pending[0]):
+                self.skipped.append(self.pending.pop(0).name)
+                continue
+            predicate = self.pending.pop(0)
+            self.evaluated.append(predicate.name)
+            if not predicate.check(self):
+                self.live = [direction for direction in self.live if direction not in predicate.directions]
+        return self.direction
+
+    @property
+    def direction(self):
+        return self.live[0] if self.live and self.is_decided() else None
+
+
 class EmrScaler:
 
     def __init__(self, emr, min_instances=0, max_instances=20, office_hours_start=7, office_hours_end=18,
-                 shutdown_time=23, parent_stack=None, stack_deletion_role=None):
+                 shutdown_time=23, parent_stack=None, stack_deletion_role=None, forecast=None,
+                 cooldown=None, clock=None):
         self.min_instances = min_instances
         self.max_instances = max_instances
         self.office_hours_start = office_hours_start
@@ -18,28 +85,44 @@ class EmrScaler:
         self.logger = get_logger('EMRScaler')
         self.emr = emr
         self.time_zone = timezone('Europe/Berlin')
-
-        #Calculating offset of timezone to subtract from the shutdown time
-        self.time_offset = int(
-            (datetime
-                .now(self.time_zone)
-                .utcoffset()
-                .total_seconds()) / (60 * 60)
-        )
-        self.shutdown_time = datetime\
-            .now(self.time_zone)\
-            .replace(hour=shutdown_time - self.time_offset, minute=0, second=0, microsecond=0)
-
+        self.shutdown_hour = shutdown_time
         self.parent_stack = parent_stack
-        self.cloud_formation = boto3.client('cloudformation')
         self.stack_deletion_role = stack_deletion_role
+        self.forecast = forecast
+        self.cooldown = cooldown
+        # Called like datetime.now, a simulation replaces it with its own clock.
+        self.clock = clock or datetime.now
+        self._shutdown_time = None
+        self._cloud_formation = None
+        self._predicates = None
+
+    @property
+    def shutdown_time(self):
+        if self._shutdown_time is None:
+            now = self.clock(self.time_zone)
+            #Calculating offset of timezone to subtract from the shutdown time
+            time_offset = int(now.utcoffset().total_seconds() / (60 * 60))
+            self._shutdown_time = now.replace(hour=self.shutdown_hour - time_offset, minute=0, second=0, microsecond=0)
+        return self._shutdown_time
+
+    @property
+    def cloud_formation(self):
+        if self._cloud_formation is None:
+            self._cloud_formation = budgeted(
+                self.emr.budget, 'cloudformation',
+                get_client('cloudformation', self.emr.region, self.emr.role, retries=self.emr.budget is None)
+            )
+        return self._cloud_formation
 
     def is_in_office_hours(self, curr_time):
-        self.logger.info("it is now {HOUR}:{MINUTE} on {WEEKDAY} ({DAY_NUMBER})"
-                         .format(HOUR=curr_time.hour, MINUTE=curr_time.minute,
-                                 WEEKDAY=curr_time.strftime("%A"), DAY_NUMBER=curr_time.weekday()))
-        self.logger.info("office hours are from {OFFICE_HOURS_START} until {OFFICE_HOURS_END}"
-                         .format(OFFICE_HOURS_START=self.office_hours_start, OFFICE_HOURS_END=self.office_hours_end))
+        # Every evaluation asks, formatting the weekday costs more than the check when nothing is logged.
+        if self.logger.isEnabledFor(INFO):
+            self.logger.info("it is now {HOUR}:{MINUTE} on {WEEKDAY} ({DAY_NUMBER})"
+                             .format(HOUR=curr_time.hour, MINUTE=curr_time.minute,
+                                     WEEKDAY=curr_time.strftime("%A"), DAY_NUMBER=curr_time.weekday()))
+            self.logger.info("office hours are from {OFFICE_HOURS_START} until {OFFICE_HOURS_END}"
+                             .format(OFFICE_HOURS_START=self.office_hours_start,
+                                     OFFICE_HOURS_END=self.office_hours_end))
         return (
             curr_time.hour >= self.office_hours_start and (
                 curr_time.hour < self.office_hours_end or
@@ -49,16 +132,32 @@ class EmrScaler:
             )
         )
 
-    def should_scale_down(self, threshold):
-        memory_used_ratio = self.emr.get_average_of_last_hour("MemoryAllocatedMB") / self.emr.get_average_of_last_hour("MemoryTotalMB")
+    def forecast_pending(self):
+        return self.forecast.peak_ahead() if self.forecast is not None else 0
+
+    def should_scale_down(self, threshold, metrics=None):
+        if metrics is None:
+            metrics = self.emr.get_metric_snapshot()
+        memory_used_ratio = metrics.memory_used_ratio
+        if memory_used_ratio is None:
+            self.logger.info("Memory used ratio is unknown, won't scale down.")
+            return False
         if memory_used_ratio <= threshold:
-            if self.is_in_office_hours(datetime.now(self.time_zone)):
+            if self.is_in_office_hours(self.clock(self.time_zone)):
                 self.logger.info (
                     "Memory used ratio {} is below threshold of {}, but won't scale down due to office hours.".format (
                         memory_used_ratio, threshold
                     )
                 )
                 return False
+            if self.forecast_pending():
+                self.logger.info (
+                    "Memory used ratio {} is below threshold of {}, "
+                    "but won't scale down ahead of a forecast peak.".format (
+                        memory_used_ratio, threshold
+                    )
+                )
+                return False
             self.logger.info (
                 "Memory used ratio {} is below threshold of {}, should scale down.".format (
                     memory_used_ratio, threshold
@@ -67,37 +166,111 @@ class EmrScaler:
             return True
         return False
 
-    def should_scale_up(self):
-        container_pending = self.emr.get_pending_containers()
-        if container_pending > 0:
+    def should_scale_up(self, metrics=None):
+        if metrics is None:
+            metrics = self.emr.get_metric_snapshot()
+        container_pending = metrics.container_pending
+        if container_pending is not None and container_pending > 0:
             self.logger.info("{} containers are waiting, should scale up.".format(container_pending))
             return True
-        else:
+        forecast_pending = self.forecast_pending()
+        if forecast_pending:
+            self.logger.info("{} containers are forecast within {} minutes, should scale up ahead of the peak.".format(
+                forecast_pending, self.forecast.lead_minutes
+            ))
+            return True
+        return False
+
+    def has_no_pending_containers(self, metrics):
+        # Pending containers rule out scaling down, also when scaling up is ruled out by max instances or a cooldown.
+        if metrics.container_pending is None:
+            self.logger.info("Pending containers are unknown, won't scale down.")
             return False
+        if metrics.container_pending:
+            self.logger.info("{} containers are waiting, won't scale down.".format(metrics.container_pending))
+            return False
+        return True
 
-    def maybe_scale(self, threshold):
+    def scale_metrics(self, direction, metrics):
+        # Pre-scaling sizes DEMAND mode scale-ups from the forecast while no containers are waiting yet.
+        if direction == UP and metrics is not None and self.forecast is not None:
+            return metrics._replace(container_pending=max(metrics.container_pending or 0, self.forecast_pending()))
+        return metrics
+
+    def is_scaling_idle(self):
         if self.emr.scaling_in_progress():
             self.logger.info("Scaling is already running, doing nothing.")
-        else:
-            scale_up_needed = self.should_scale_up()
-            scale_down_needed = self.should_scale_down(threshold)
-            if scale_up_needed:
-                self.emr.scale(UP)
-            elif scale_down_needed:
-                self.emr.scale(DOWN)
-            else:
-                self.logger.info("Nothing to do, going back to sleep.")
+            return False
+        return True
+
+    def predicates(self):
+        predicates = [
+            Predicate("outside office hours", LOCAL, (DOWN,),
+                      lambda e: not self.is_in_office_hours(self.clock(self.time_zone))),
+            Predicate("no scaling in progress", EMR_API, (UP, DOWN), lambda e: self.is_scaling_idle()),
+            Predicate("below max instances", EMR_API, (UP,), lambda e: self.emr.can_scale(UP)),
+            Predicate("above min instances", EMR_API, (DOWN,), lambda e: self.emr.can_scale(DOWN)),
+            Predicate("containers pending", CLOUDWATCH_API, (UP,), lambda e: self.should_scale_up(e.get_metrics())),
+            Predicate("no containers pending", CLOUDWATCH_API, (DOWN,),
+                      lambda e: self.has_no_pending_containers(e.get_metrics())),
+            Predicate("memory below threshold", CLOUDWATCH_API, (DOWN,),
+                      lambda e: self.should_scale_down(e.threshold, e.get_metrics()))
+        ]
+        if self.cooldown is not None:
+            # Ahead of the EMR predicates of the same cost, a cooling down cluster needs no instance group listing.
+            predicates[1:1] = [
+                Predicate("up cooldown elapsed", STATE_STORE, (UP,), lambda e: self.cooldown.has_elapsed(UP)),
+                Predicate("down cooldown elapsed", STATE_STORE, (DOWN,), lambda e: self.cooldown.has_elapsed(DOWN))
+            ]
+            predicates += [
+                Predicate("pending containers outside hysteresis band", CLOUDWATCH_API, (UP,),
+                          lambda e: self.cooldown.clears_band(UP, e.threshold,
+                                                              self.scale_metrics(UP, e.get_metrics()))),
+                Predicate("memory outside hysteresis band", CLOUDWATCH_API, (DOWN,),
+                          lambda e: self.cooldown.clears_band(DOWN, e.threshold, e.get_metrics()))
+            ]
+        return predicates
+
+    def evaluation(self, threshold):
+        # Predicates read the scaler's state when they run, so every evaluation of this scaler can share them.
+        if self._predicates is None:
+            self._predicates = self.predicates()
+        return Evaluation(self, threshold, self._predicates)
+
+    def log_evaluation(self, evaluation):
+        self.logger.info("Evaluated predicates: {}; skipped predicates: {}".format(
+            ", ".join(evaluation.evaluated) or "none", ", ".join(evaluation.skipped) or "none"
+        ))
+        if evaluation.direction is None:
+            self.logger.info("Nothing to do, going back to sleep.")
+
+    def record_scaling(self, direction, scale_targets):
+        if self.cooldown is not None and scale_targets:
+            self.cooldown.record(direction, scale_targets)
+
+    def maybe_scale(self, threshold):
+        evaluation = self.evaluation(threshold)
+        direction = evaluation.run()
+        self.log_evaluation(evaluation)
+        if direction is None:
+            return None
+        scale_targets = self.emr.scale(direction, self.scale_metrics(direction, evaluation.metrics), threshold)
+        self.record_scaling(direction, scale_targets)
+        # Demand can round down to no node at all, nothing was scaled then.
+        return direction if scale_targets else None
 
     def maybe_shutdown(self):
         self.logger.info("Parent stack: %s" % self.parent_stack)
-        if self.is_after_shutdown_time() and not self.emr.is_termination_protected() and self.parent_stack:
+        if self.parent_stack and self.is_after_shutdown_time() and not self.emr.is_termination_protected():
             self.shutdown()
+            return True
+        return False
 
     def shutdown(self):
         self.cloud_formation.delete_stack(StackName=self.parent_stack, RoleARN=self.stack_deletion_role)
 
     def is_after_shutdown_time(self, time=None):
-        time = time or datetime.now()
+        time = time or self.clock()
         time = self.time_zone.localize(time)
         self.logger.info("Current time: %s, shutdown time %s" % (time, self.shutdown_time))
         return self.shutdown_time.time() <= time.time()
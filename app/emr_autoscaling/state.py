@@ -0,0 +1,154 @@
+import json
+import os
+import tempfile
+import time
+from collections import namedtuple
+from threading import Lock
+
+from app.emr_autoscaling.clients import get_client
+from app.emr_autoscaling.constants import UP
+from app.emr_autoscaling.utils import get_logger
+
+ScalingAction = namedtuple("ScalingAction", ["direction", "timestamp"])
+
+# Group id under which the last action of the cluster as a whole is stored.
+CLUSTER = "*"
+
+# BatchWriteItem accepts at most 25 items per request.
+BATCH_SIZE = 25
+
+
+class DynamoDbStateStore:
+    # Expects a table with the string hash key ClusterId and the string range key GroupId. Each cluster has one item
+    # for its last action as a whole and one for the last action of each group it scaled.
+
+    def __init__(self, table_name, region=None, role=None):
+        self.table_name = table_name
+        self.dynamodb = get_client("dynamodb", region, role)
+
+    def get(self, job_flow_id, group_id=CLUSTER):
+        item = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key={"ClusterId": {"S": job_flow_id}, "GroupId": {"S": group_id}},
+            ConsistentRead=True
+        ).get("Item")
+        if item is None:
+            return None
+        return ScalingAction(direction=int(item["Direction"]["N"]), timestamp=float(item["Timestamp"]["N"]))
+
+    def record(self, job_flow_id, action, group_ids=()):
+        items = [
+            {
+                "ClusterId": {"S": job_flow_id},
+                "GroupId": {"S": group_id},
+                "Direction": {"N": str(action.direction)},
+                "Timestamp": {"N": repr(action.timestamp)}
+            }
+            for group_id in (CLUSTER,) + tuple(group_ids)
+        ]
+        for start in range(0, len(items), BATCH_SIZE):
+            request_items = {
+                self.table_name: [{"PutRequest": {"Item": item}} for item in items[start:start + BATCH_SIZE]]
+            }
+            while request_items:
+                request_items = self.dynamodb.batch_write_item(RequestItems=request_items).get("UnprocessedItems")
+
+
+_file_locks = {}
+_file_locks_lock = Lock()
+
+
+def get_file_lock(path):
+    # The clusters of a batch event each have a store for the same file, they share one lock per path.
+    with _file_locks_lock:
+        return _file_locks.setdefault(os.path.abspath(path), Lock())
+
+
+class FileStateStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = get_file_lock(path)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def get(self, job_flow_id, group_id=CLUSTER):
+        with self._lock:
+            action = self._load().get(job_flow_id, {}).get(group_id)
+        return ScalingAction(*action) if action is not None else None
+
+    def record(self, job_flow_id, action, group_ids=()):
+        with self._lock:
+            state = self._load()
+            actions = state.setdefault(job_flow_id, {})
+            for group_id in (CLUSTER,) + tuple(group_ids):
+                actions[group_id] = list(action)
+            # A temporary file of its own keeps other processes writing the same state file from clashing.
+            descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp")
+            try:
+                with os.fdopen(descriptor, "w") as f:
+                    json.dump(state, f)
+                os.replace(temp_path, self.path)
+            except Exception:
+                os.remove(temp_path)
+                raise
+
+
+class Cooldown:
+
+    def __init__(self, store, job_flow_id, up_seconds=300, down_seconds=900, up_band=0, down_band=0.0,
+                 clock=time.time):
+        self.store = store
+        self.job_flow_id = job_flow_id
+        # Seconds that have to pass after the last action of the cluster before scaling up or down.
+        self.up_seconds = up_seconds
+        self.down_seconds = down_seconds
+        # Reversing the last action needs a stronger signal: at least up_band pending containers to scale up
+        # after a scale-down, a memory used ratio down_band below the threshold to scale down after a scale-up.
+        self.up_band = up_band
+        self.down_band = down_band
+        self.clock = clock
+        self.logger = get_logger('Cooldown')
+        self._last_action = None
+        self._loaded = False
+
+    @property
+    def last_action(self):
+        if not self._loaded:
+            self._last_action = self.store.get(self.job_flow_id)
+            self._loaded = True
+        return self._last_action
+
+    def has_elapsed(self, direction):
+        if self.last_action is None:
+            return True
+        seconds = self.up_seconds if direction == UP else self.down_seconds
+        remaining = self.last_action.timestamp + seconds - self.clock()
+        if remaining > 0:
+            self.logger.info("Last scaling was {:.0f} seconds ago, cooling down for another {:.0f} seconds.".format(
+                self.clock() - self.last_action.timestamp, remaining
+            ))
+            return False
+        return True
+
+    def clears_band(self, direction, threshold, metrics):
+        if self.last_action is None or self.last_action.direction == direction:
+            return True
+        if direction == UP:
+            cleared = (metrics.container_pending or 0) >= self.up_band
+        else:
+            cleared = metrics.memory_used_ratio is not None and metrics.memory_used_ratio <= threshold - self.down_band
+        if not cleared:
+            self.logger.info("Signal is within the hysteresis band, not reversing the last scaling action.")
+        return cleared
+
+    def record(self, direction, scale_targets=()):
+        # Cooldowns apply to the cluster as a whole, the rows of the scaled groups tell when each one last changed.
+        self._last_action = ScalingAction(direction=direction, timestamp=self.clock())
+        self._loaded = True
+        self.store.record(self.job_flow_id, self._last_action, [target["Id"] for target, _ in scale_targets])
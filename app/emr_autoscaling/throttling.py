@@ -0,0 +1,206 @@
+import random
+import time
+from collections import Counter
+from threading import Lock
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+from app.emr_autoscaling.tracing import operation_name, retried
+from app.emr_autoscaling.utils import get_logger
+
+# Requests per second per service and process that a throttled service recovers to, a share of the account's API
+# limits that leaves room for other callers.
+RATES = {"emr": 10.0, "cloudwatch": 25.0, "cloudformation": 5.0, "dynamodb": 50.0}
+DEFAULT_RATE = 10.0
+MIN_RATE = 0.5
+THROTTLING_ERRORS = (
+    "Throttling", "ThrottlingException", "ThrottledException", "RequestThrottledException", "RequestLimitExceeded",
+    "TooManyRequestsException"
+)
+# Errors botocore's standard retry mode treats as transient, budgeted clients leave their retries to the budget.
+TRANSIENT_ERRORS = (
+    "RequestTimeout", "RequestTimeoutException", "PriorRequestNotComplete", "InternalError", "InternalFailure",
+    "ServiceUnavailable"
+)
+TRANSIENT_STATUS_CODES = (500, 502, 503, 504)
+
+
+class BudgetExhausted(Exception):
+    pass
+
+
+class TokenBucket:
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = rate
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        # Like botocore's adaptive retry mode, calls are only rate limited once the service has throttled them.
+        self.enabled = False
+        self.tokens = 0.0
+        self._updated = clock()
+        self._lock = Lock()
+
+    def _refill(self, now):
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout):
+        # Tokens may go negative: a caller reserves the next free token and sleeps until it is due.
+        with self._lock:
+            if not self.enabled:
+                return 0.0
+            self._refill(self.clock())
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if wait > timeout:
+                return None
+            self.tokens -= 1
+        if wait:
+            self.sleep(wait)
+        return wait
+
+    def throttled(self):
+        with self._lock:
+            if self.enabled:
+                self._refill(self.clock())
+            else:
+                self.enabled = True
+                self.tokens = 0.0
+                self._updated = self.clock()
+            self.rate = max(MIN_RATE, self.rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            if self.enabled:
+                self._refill(self.clock())
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+_buckets = {}
+_buckets_lock = Lock()
+
+
+def get_bucket(service):
+    # Buckets are shared by every cluster evaluated in the process.
+    with _buckets_lock:
+        if service not in _buckets:
+            _buckets[service] = TokenBucket(RATES.get(service, DEFAULT_RATE))
+        return _buckets[service]
+
+
+def clear_buckets():
+    with _buckets_lock:
+        _buckets.clear()
+
+
+def is_throttling(error):
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in THROTTLING_ERRORS
+
+
+def is_transient(error):
+    if isinstance(error, (ConnectionError, HTTPClientError)):
+        return True
+    return isinstance(error, ClientError) and (
+        error.response.get("Error", {}).get("Code") in TRANSIENT_ERRORS
+        or error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") in TRANSIENT_STATUS_CODES
+    )
+
+
+class ApiBudget:
+
+    def __init__(self, max_calls=None, max_wait_seconds=10.0, max_attempts=3, base_delay=0.2, max_delay=5.0,
+                 buckets=get_bucket, sleep=time.sleep, jitter=random.uniform):
+        # Per cluster evaluation: the calls it may make, and the seconds it may spend waiting for tokens or backoffs.
+        self.max_calls = max_calls
+        self.max_wait_seconds = max_wait_seconds
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buckets = buckets
+        self.sleep = sleep
+        self.jitter = jitter
+        self.calls = Counter()
+        self.waited = 0.0
+        self.logger = get_logger('ApiBudget')
+        self._lock = Lock()
+
+    def _remaining_wait(self, service, operation):
+        with self._lock:
+            if self.max_calls is not None and sum(self.calls.values()) >= self.max_calls:
+                raise BudgetExhausted("{} API calls made, not calling {} {}.".format(
+                    self.max_calls, service, operation
+                ))
+            return self.max_wait_seconds - self.waited
+
+    def _spend_call(self, service, wait):
+        with self._lock:
+            self.calls[service] += 1
+            self.waited += wait
+
+    def _spend_wait(self, seconds):
+        with self._lock:
+            self.waited += seconds
+
+    def call(self, service, operation, method, *args, **kwargs):
+        bucket = self.buckets(service)
+        for attempt in range(self.max_attempts):
+            wait = bucket.acquire(self._remaining_wait(service, operation))
+            if wait is None:
+                raise BudgetExhausted("Waited {:.1f} seconds for API calls, not calling {} {}.".format(
+                    self.waited, service, operation
+                ))
+            # Only a call the bucket let through is made, and counted.
+            self._spend_call(service, wait)
+            try:
+                with retried(attempt):
+                    response = method(*args, **kwargs)
+            except (ClientError, ConnectionError, HTTPClientError) as error:
+                throttled = is_throttling(error)
+                if not throttled and not is_transient(error):
+                    raise
+                if throttled:
+                    bucket.throttled()
+                elif attempt + 1 == self.max_attempts:
+                    raise
+                # Full jitter spreads the retries of clusters throttled at the same time.
+                delay = self.jitter(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                problem = "is throttled" if throttled else "failed"
+                if attempt + 1 == self.max_attempts or self.waited + delay > self.max_wait_seconds:
+                    raise BudgetExhausted("{} {} {}: {}".format(service, operation, problem, error))
+                self.logger.info("{} {} {}, retrying in {:.2f} seconds.".format(service, operation, problem, delay))
+                self.sleep(delay)
+                self._spend_wait(delay)
+                continue
+            bucket.succeeded()
+            return response
+
+    def wrap(self, service, client):
+        return BudgetedClient(service, client, self)
+
+
+class BudgetedClient:
+
+    def __init__(self, service, client, budget):
+        self._service = service
+        self._client = client
+        self._budget = budget
+        operations = getattr(getattr(client, "meta", None), "method_to_api_mapping", None)
+        self._operations = operations if isinstance(operations, dict) else None
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+        operation = self._operations.get(name) if self._operations is not None else operation_name(name)
+        if operation is None:
+            return attribute
+
+        def budgeted(*args, **kwargs):
+            return self._budget.call(self._service, operation, attribute, *args, **kwargs)
+
+        return budgeted
+
+
+def budgeted(budget, service, client):
+    return budget.wrap(service, client) if budget is not None else client
@@ -0,0 +1,148 @@
+import json
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from threading import Lock, local
+
+from botocore.client import BaseClient
+
+Span = namedtuple("Span", ["service", "operation", "seconds", "retries", "response_bytes", "failed"])
+
+NAMESPACE = "EmrAutoscaling"
+# CloudWatch accepts at most 100 values per metric in one Embedded Metric Format document.
+MAX_VALUES = 100
+
+_retried = local()
+
+
+def operation_name(method_name):
+    return "".join(part.capitalize() for part in method_name.split("_"))
+
+
+@contextmanager
+def retried(attempts):
+    # Retries made above the traced client, by an ApiBudget, count towards the retries of the call like botocore's.
+    _retried.attempts = attempts
+    try:
+        yield
+    finally:
+        _retried.attempts = 0
+
+
+def create_span(service, operation, seconds, response, failed):
+    metadata = response.get("ResponseMetadata", {}) if isinstance(response, dict) else {}
+    return Span(
+        service=service,
+        operation=operation,
+        seconds=seconds,
+        retries=metadata.get("RetryAttempts", 0) + getattr(_retried, "attempts", 0),
+        response_bytes=int(metadata.get("HTTPHeaders", {}).get("content-length", 0)),
+        failed=failed
+    )
+
+
+class Tracer:
+
+    def __init__(self, namespace=NAMESPACE, stream=None, clock=time.perf_counter):
+        self.namespace = namespace
+        self.stream = stream
+        self.clock = clock
+        # Spans are only kept during an invocation, outside of one the traced clients call straight through.
+        self._spans = None
+        self._lock = Lock()
+
+    @property
+    def active(self):
+        return self._spans is not None
+
+    def record(self, span):
+        with self._lock:
+            if self._spans is not None:
+                self._spans.append(span)
+
+    @contextmanager
+    def invocation(self):
+        with self._lock:
+            self._spans = []
+        try:
+            yield
+        finally:
+            with self._lock:
+                spans, self._spans = self._spans, None
+            self.emit(spans)
+
+    def documents(self, spans, timestamp=None):
+        # One metric per operation and measure, holding the value of every call, so CloudWatch derives percentiles.
+        metrics = {}
+        for span in spans:
+            prefix = "{}.{}.".format(span.service, span.operation)
+            for name, unit, value in (
+                ("Latency", "Milliseconds", span.seconds * 1000),
+                ("Retries", "Count", span.retries),
+                ("ResponseBytes", "Bytes", span.response_bytes),
+                ("Errors", "Count", int(span.failed))
+            ):
+                metrics.setdefault(prefix + name, (unit, []))[1].append(value)
+
+        timestamp = int((timestamp or time.time()) * 1000)
+        documents = []
+        longest = max((len(values) for _, values in metrics.values()), default=0)
+        for offset in range(0, longest, MAX_VALUES):
+            chunk = {name: (unit, values[offset:offset + MAX_VALUES]) for name, (unit, values) in metrics.items()}
+            chunk = {name: metric for name, metric in chunk.items() if metric[1]}
+            document = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [[]],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, (unit, _) in sorted(chunk.items())]
+                    }]
+                }
+            }
+            document.update({name: values for name, (_, values) in chunk.items()})
+            documents.append(document)
+        return documents
+
+    def emit(self, spans):
+        stream = self.stream or sys.stdout
+        for document in self.documents(spans):
+            stream.write(json.dumps(document) + "\n")
+        stream.flush()
+
+
+class TracedClient:
+
+    def __init__(self, service, client, tracer):
+        self._service = service
+        self._client = client
+        self._tracer = tracer
+        # boto3 clients name their operations, helpers like get_paginator are not traced. Stand-ins only offer
+        # operations.
+        self._operations = client.meta.method_to_api_mapping if isinstance(client, BaseClient) else None
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not self._tracer.active or name.startswith("_") or not callable(attribute):
+            return attribute
+        operation = self._operations.get(name) if self._operations is not None else operation_name(name)
+        if operation is None:
+            return attribute
+
+        def traced(*args, **kwargs):
+            started = self._tracer.clock()
+            try:
+                response = attribute(*args, **kwargs)
+            except Exception as error:
+                self._tracer.record(create_span(self._service, operation, self._tracer.clock() - started,
+                                                getattr(error, "response", None), True))
+                raise
+            self._tracer.record(create_span(self._service, operation, self._tracer.clock() - started, response,
+                                            False))
+            return response
+
+        return traced
+
+
+TRACER = Tracer()
@@ -0,0 +1,70 @@
+import json
+from threading import Lock
+from time import monotonic
+
+ALARM_STATE_CHANGE = "CloudWatch Alarm State Change"
+EMR_STATE_CHANGES = ("EMR Instance Group State Change", "EMR Instance Fleet State Change")
+
+
+def is_trigger_event(event):
+    return "detail-type" in event or "Records" in event
+
+
+def alarm_job_flow_ids(detail):
+    if detail["state"]["value"] != "ALARM":
+        return []
+    return [
+        metric["metricStat"]["metric"]["dimensions"]["JobFlowId"]
+        for metric in detail.get("configuration", {}).get("metrics", [])
+        if "JobFlowId" in metric.get("metricStat", {}).get("metric", {}).get("dimensions", {})
+    ]
+
+
+def emr_job_flow_ids(detail):
+    # A finished resize of a task group or fleet frees the cluster for the next scaling step.
+    if detail.get("state") != "RUNNING" or detail.get("instanceGroupType", "TASK") != "TASK" \
+            or detail.get("instanceFleetType", "TASK") != "TASK":
+        return []
+    return [detail["clusterId"]]
+
+
+def sns_alarm_job_flow_ids(message):
+    if message.get("NewStateValue") != "ALARM":
+        return []
+    return [
+        dimension["value"] for dimension in message.get("Trigger", {}).get("Dimensions", [])
+        if dimension["name"] == "JobFlowId"
+    ]
+
+
+def triggered_job_flow_ids(event):
+    # EventBridge delivers alarm and EMR state changes directly, SNS wraps alarm notifications in Records.
+    if event.get("detail-type") == ALARM_STATE_CHANGE:
+        job_flow_ids = alarm_job_flow_ids(event["detail"])
+    elif event.get("detail-type") in EMR_STATE_CHANGES:
+        job_flow_ids = emr_job_flow_ids(event["detail"])
+    else:
+        job_flow_ids = [
+            job_flow_id
+            for record in event.get("Records", []) if "Sns" in record
+            for job_flow_id in sns_alarm_job_flow_ids(json.loads(record["Sns"]["Message"]))
+        ]
+    return list(dict.fromkeys(job_flow_ids))
+
+
+class Deduplicator:
+
+    def __init__(self, window_seconds, clock=monotonic):
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self._last_claimed = {}
+        self._lock = Lock()
+
+    def claim(self, key):
+        with self._lock:
+            now = self.clock()
+            last_claimed = self._last_claimed.get(key)
+            if last_claimed is not None and now - last_claimed < self.window_seconds:
+                return False
+            self._last_claimed[key] = now
+            return True
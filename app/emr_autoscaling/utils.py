@@ -1,23 +1,27 @@
 from datetime import datetime
 from logging import getLogger, Formatter, StreamHandler
-
-from app.pytz import timezone
+from threading import Lock
+from time import monotonic
 
 
 def get_logger(name, log_level='INFO'):
     logger = getLogger(name)
     logger.setLevel(log_level)
 
-    handler = StreamHandler()
-    handler.setFormatter(Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-    handler.setLevel(log_level)
+    # Loggers are shared by every Emr/EmrScaler instance, so only the first call attaches a handler.
+    if not logger.handlers:
+        handler = StreamHandler()
+        handler.setFormatter(Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        handler.setLevel(log_level)
 
-    logger.addHandler(handler)
+        logger.addHandler(handler)
 
     return logger
 
 
 def create_berlin_time(input_time):
+    # Every module imports utils, only the callers of this function need pytz.
+    from app.pytz import timezone
     time_zone = timezone('Europe/Berlin')
 
     time_offset = int(
@@ -33,3 +37,26 @@ def create_berlin_time(input_time):
                  second=input_time.second,
                  microsecond=input_time.microsecond)
 
+
+class TtlCache:
+
+    def __init__(self, ttl_seconds, clock=monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries = {}
+        self._lock = Lock()
+
+    def get(self, key, load):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > self.clock():
+            return entry[1]
+
+        value = load()
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl_seconds, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,10 +1,33 @@
-from app.emr_autoscaling.emr import Emr
+import json
+import os
+
+# Instance fleets, forecasts, cooldown state and the batch executors are imported by the functions using them, so a
+# cold start only imports what evaluating a single instance group cluster needs.
+from app.emr_autoscaling.constants import UP, DOWN, STEP, INSTANCE_FLEET, SPOT
+from app.emr_autoscaling.emr import Emr, HOURLY_AVERAGE, MemoryWindow
 from app.emr_autoscaling.scaler import EmrScaler
+from app.emr_autoscaling.throttling import ApiBudget, BudgetExhausted
+from app.emr_autoscaling.tracing import TRACER
+from app.emr_autoscaling.triggers import Deduplicator, is_trigger_event, triggered_job_flow_ids
+from app.emr_autoscaling.utils import get_logger
 
+MAX_WORKERS = 16
+MAX_CONCURRENT_CALLS = 64
+# Seconds a cluster evaluation may spend waiting for rate limited or throttled API calls before it is deferred.
+MAX_API_WAIT_SECONDS = 10.0
+DIRECTIONS = {UP: "UP", DOWN: "DOWN"}
 
-def lambda_handler(event, context):
+# Settings of triggered evaluations, in the format of a batch event. Without Clusters every cluster is evaluated.
+CONFIG_VARIABLE = "SCALER_CONFIG"
+# Events for a cluster arriving within this many seconds of the last triggered evaluation are dropped.
+DEDUPLICATION_SECONDS = 60
+TRIGGERS = Deduplicator(DEDUPLICATION_SECONDS)
+
+logger = get_logger('ScalerLambda')
+
+
+def create_scaler(event):
     job_flow_id = event["JobFlowId"]
-    threshold = float(event["Threshold"])
     min_instances = int(event["MinInstances"])
     max_instances = int(event["MaxInstances"])
     office_hours_start = int(event["OfficeHoursStart"])
@@ -13,19 +36,216 @@ def lambda_handler(event, context):
 
     parent_stack_id = event["ParentStackId"] if "ParentStackId" in event else None
     stack_deletion_role = event["StackDeletionRole"] if "StackDeletionRole" in event else None
-    scaler = EmrScaler(
-        emr=Emr(
-            job_flow_id=job_flow_id,
-            min_instances=min_instances,
-            max_instances=max_instances
-        ),
+    assume_role = event["AssumeRoleArn"] if "AssumeRoleArn" in event else None
+    scale_up_mode = event["ScaleUpMode"].upper() if "ScaleUpMode" in event else STEP
+    scale_down_mode = event["ScaleDownMode"].upper() if "ScaleDownMode" in event else STEP
+    max_removal_per_cycle = int(event["MaxRemovalPerCycle"]) if "MaxRemovalPerCycle" in event else None
+    budget = ApiBudget(
+        max_calls=int(event["MaxApiCalls"]) if "MaxApiCalls" in event else None,
+        max_wait_seconds=float(event.get("MaxApiWaitSeconds", MAX_API_WAIT_SECONDS))
+    )
+    container_memory_mb = int(event["ContainerMemoryMb"]) if "ContainerMemoryMb" in event else None
+    container_vcores = int(event["ContainerVcores"]) if "ContainerVcores" in event else 1
+    memory_window = MemoryWindow(
+        minutes=int(event.get("MemoryWindowMinutes", HOURLY_AVERAGE.minutes)),
+        period=int(event.get("MemoryPeriodSeconds", HOURLY_AVERAGE.period)),
+        aggregation=event.get("MemoryAggregation", HOURLY_AVERAGE.aggregation).lower()
+    )
+    emr_settings = dict(
+        job_flow_id=job_flow_id,
+        min_instances=min_instances,
+        max_instances=max_instances,
+        role=assume_role,
+        scale_up_mode=scale_up_mode,
+        container_memory_mb=container_memory_mb,
+        container_vcores=container_vcores,
+        memory_window=memory_window,
+        scale_down_mode=scale_down_mode,
+        max_removal_per_cycle=max_removal_per_cycle,
+        budget=budget
+    )
+    if event.get("InstanceCollectionType", "").upper() == INSTANCE_FLEET:
+        from app.emr_autoscaling.fleet import EmrFleet
+        emr = EmrFleet(market=event["FleetMarket"].upper() if "FleetMarket" in event else SPOT, **emr_settings)
+    else:
+        emr = Emr(**emr_settings)
+    forecast = None
+    if "ForecastWeeks" in event:
+        from app.emr_autoscaling.forecast import SeasonalForecast
+        forecast = SeasonalForecast(
+            emr,
+            weeks=int(event["ForecastWeeks"]),
+            lead_minutes=int(event["ForecastLeadMinutes"]) if "ForecastLeadMinutes" in event else 30,
+            min_containers=float(event["ForecastMinContainers"]) if "ForecastMinContainers" in event else 1
+        )
+    return EmrScaler(
+        emr=emr,
         min_instances=min_instances,
         max_instances=max_instances,
         office_hours_start=office_hours_start,
         office_hours_end=office_hours_end,
         shutdown_time=shutdown_time,
         parent_stack=parent_stack_id,
-        stack_deletion_role=stack_deletion_role
+        stack_deletion_role=stack_deletion_role,
+        forecast=forecast,
+        cooldown=create_cooldown(event, emr)
     )
-    scaler.maybe_shutdown()
-    scaler.maybe_scale(threshold)
+
+
+def create_cooldown(event, emr):
+    if "StateTable" not in event and "StateFile" not in event:
+        return None
+    from app.emr_autoscaling.state import Cooldown, DynamoDbStateStore, FileStateStore
+    if "StateTable" in event:
+        # The table lives next to the cluster, in the account of its AssumeRoleArn.
+        store = DynamoDbStateStore(event["StateTable"], emr.region, emr.role)
+    else:
+        store = FileStateStore(event["StateFile"])
+    return Cooldown(
+        store,
+        emr.job_flow_id,
+        up_seconds=int(event["UpCooldownSeconds"]) if "UpCooldownSeconds" in event else 300,
+        down_seconds=int(event["DownCooldownSeconds"]) if "DownCooldownSeconds" in event else 900,
+        up_band=float(event["UpHysteresisContainers"]) if "UpHysteresisContainers" in event else 0,
+        down_band=float(event["DownHysteresisRatio"]) if "DownHysteresisRatio" in event else 0.0
+    )
+
+
+def cluster_result(job_flow_id, shut_down, direction):
+    return {
+        "JobFlowId": job_flow_id,
+        "Status": "OK",
+        "ShutDown": shut_down,
+        "Scaled": DIRECTIONS.get(direction)
+    }
+
+
+def cluster_failure(event, error):
+    logger.exception("Evaluating cluster %s failed." % event.get("JobFlowId"))
+    return {
+        "JobFlowId": event.get("JobFlowId"),
+        "Status": "FAILED",
+        "Error": "{}: {}".format(type(error).__name__, error)
+    }
+
+
+def cluster_deferral(event, error):
+    logger.warning("Deferring evaluation of cluster %s: %s" % (event.get("JobFlowId"), error))
+    return {
+        "JobFlowId": event.get("JobFlowId"),
+        "Status": "DEFERRED",
+        "Reason": str(error)
+    }
+
+
+def evaluate_cluster(event):
+    threshold = float(event["Threshold"])
+    scaler = create_scaler(event)
+    try:
+        shut_down = scaler.maybe_shutdown()
+        direction = scaler.maybe_scale(threshold)
+    except BudgetExhausted as e:
+        return cluster_deferral(event, e)
+    return cluster_result(event["JobFlowId"], shut_down, direction)
+
+
+def evaluate_cluster_safely(event):
+    try:
+        return evaluate_cluster(event)
+    except Exception as e:
+        return cluster_failure(event, e)
+
+
+async def evaluate_cluster_async(event, semaphore):
+    import asyncio
+    from app.emr_autoscaling.async_emr import AsyncEmrScaler
+    try:
+        threshold = float(event["Threshold"])
+        # Creating clients may assume a role through STS, which blocks like any other AWS call.
+        async with semaphore:
+            scaler = await asyncio.get_running_loop().run_in_executor(None, create_scaler, event)
+        scaler = AsyncEmrScaler(scaler, semaphore)
+        shut_down = await scaler.maybe_shutdown()
+        direction = await scaler.maybe_scale(threshold)
+        return cluster_result(event["JobFlowId"], shut_down, direction)
+    except BudgetExhausted as e:
+        return cluster_deferral(event, e)
+    except Exception as e:
+        return cluster_failure(event, e)
+
+
+async def evaluate_clusters_async(cluster_events, max_concurrent_calls):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    # asyncio.run shuts this executor down once every cluster has been evaluated.
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max_concurrent_calls))
+    semaphore = asyncio.Semaphore(max_concurrent_calls)
+    return await asyncio.gather(*(evaluate_cluster_async(event, semaphore) for event in cluster_events))
+
+
+def evaluate_clusters(event):
+    # Settings on the batch event are defaults for every cluster entry.
+    defaults = {
+        key: value for key, value in event.items() if key not in ("Clusters", "MaxWorkers", "Executor")
+    }
+    cluster_events = [dict(defaults, **cluster) for cluster in event["Clusters"]]
+
+    if event.get("Executor") == "asyncio":
+        import asyncio
+        max_concurrent_calls = int(event.get("MaxWorkers", MAX_CONCURRENT_CALLS))
+        results = asyncio.run(evaluate_clusters_async(cluster_events, max(1, max_concurrent_calls)))
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        max_workers = int(event.get("MaxWorkers", MAX_WORKERS))
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(cluster_events)))) as executor:
+            results = list(executor.map(evaluate_cluster_safely, cluster_events))
+
+    failed = sum(1 for result in results if result["Status"] == "FAILED")
+    deferred = sum(1 for result in results if result["Status"] == "DEFERRED")
+    logger.info("Evaluated %s clusters, %s failed, %s deferred." % (len(results), failed, deferred))
+    return {"Results": results}
+
+
+def cluster_settings(config, job_flow_id):
+    if not config:
+        return None
+    defaults = {key: value for key, value in config.items() if key != "Clusters"}
+    if "Clusters" not in config:
+        return dict(defaults, JobFlowId=job_flow_id)
+    for cluster in config["Clusters"]:
+        if cluster["JobFlowId"] == job_flow_id:
+            return dict(defaults, **cluster)
+    return None
+
+
+def skipped_result(job_flow_id, status):
+    return {"JobFlowId": job_flow_id, "Status": status}
+
+
+def evaluate_trigger(event):
+    config = json.loads(os.environ.get(CONFIG_VARIABLE, "{}"))
+    if not config:
+        logger.error("%s holds no scaling settings, triggered clusters are ignored." % CONFIG_VARIABLE)
+    results = []
+    for job_flow_id in triggered_job_flow_ids(event):
+        cluster_event = cluster_settings(config, job_flow_id)
+        if cluster_event is None:
+            results.append(skipped_result(job_flow_id, "IGNORED"))
+        elif not TRIGGERS.claim(job_flow_id):
+            results.append(skipped_result(job_flow_id, "DEDUPLICATED"))
+        else:
+            results.append(evaluate_cluster_safely(cluster_event))
+    logger.info("Triggered evaluation of %s clusters." % len(results))
+    return {"Results": results}
+
+
+def lambda_handler(event, context):
+    # The vendored pytz is complete, so it need not check that each of its zone files exists before the first lookup.
+    os.environ.setdefault("PYTZ_SKIPEXISTSCHECK", "1")
+    # Every AWS call of the invocation ends up in one Embedded Metric Format line on stdout.
+    with TRACER.invocation():
+        if is_trigger_event(event):
+            return evaluate_trigger(event)
+        if "Clusters" in event:
+            return evaluate_clusters(event)
+        return evaluate_cluster(event)
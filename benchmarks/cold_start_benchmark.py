@@ -0,0 +1,220 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+# Nothing of the Lambda, boto3 included, is imported at module level: the measuring process has to import it cold.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE = "app.scaler_lambda"
+SCENARIO = "scale_up"
+PHASES = ("total", "clients", "api_calls", "scaler")
+TOP_MODULES = 15
+IMPORT_STARTED = "cold-start: importing"
+IMPORT_FINISHED = "cold-start: imported"
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)")
+# Modules of code paths a single instance group cluster does not take, importing the Lambda has to leave them out.
+DEFERRED_MODULES = ("asyncio", "app.emr_autoscaling.async_emr", "app.emr_autoscaling.fleet",
+                    "app.emr_autoscaling.forecast", "app.emr_autoscaling.state")
+
+
+def serve_locally(client, stand_in):
+    # Calls are validated and serialised by botocore like real ones, then answered by the stand-in instead of being
+    # sent, the way botocore's Stubber answers them.
+    from botocore import xform_name
+    from botocore.awsrequest import AWSResponse
+
+    def capture(params, context, **kwargs):
+        context["local_params"] = dict(params)
+
+    def respond(model, context, **kwargs):
+        method = getattr(stand_in(), xform_name(model.name))
+        return AWSResponse(None, 200, {}, None), method(**context["local_params"])
+
+    client.meta.events.register("before-parameter-build.*.*", capture)
+    client.meta.events.register("before-call.*.*", respond)
+
+
+def measure(scenario_name, warm):
+    # Runs in a fresh interpreter, the first import and invocation pay what a Lambda cold start pays.
+    print(IMPORT_STARTED, file=sys.stderr, flush=True)
+    started = time.perf_counter()
+    scaler_lambda = importlib.import_module(MODULE)
+    import_seconds = time.perf_counter() - started
+    print(IMPORT_FINISHED, file=sys.stderr, flush=True)
+    eager_modules = [module for module in DEFERRED_MODULES if module in sys.modules]
+
+    from mock import patch
+
+    from app.emr_autoscaling import clients
+    from app.emr_autoscaling.tracing import TRACER
+    from benchmarks.invocation_benchmark import SCENARIOS, frozen_time
+    from tests.local import LocalAws
+
+    scenario = next(scenario for scenario in SCENARIOS if scenario.name == scenario_name)
+    backend = {}
+    created = []
+    create_client = clients._create_client
+
+    def create_local_client(service, region, role, config=clients.CLIENT_CONFIG):
+        started = time.perf_counter()
+        client, expiration = create_client(service, region, role, config)
+        created.append(time.perf_counter() - started)
+        serve_locally(client, lambda: getattr(backend["aws"], service))
+        return client, expiration
+
+    def invoke():
+        # Every invocation finds the cluster as the scenario describes it, clients stay cached like in a warm Lambda.
+        backend["aws"] = LocalAws()
+        scenario.setup(backend["aws"])
+        del created[:]
+        spans = []
+        with frozen_time(scenario.utc_time), patch.object(TRACER, "emit", spans.extend):
+            started = time.perf_counter()
+            result = scaler_lambda.lambda_handler(dict(scenario.event), None)
+            seconds = time.perf_counter() - started
+        phases = {
+            "total": seconds,
+            "clients": sum(created),
+            "api_calls": sum(span.seconds for span in spans)
+        }
+        phases["scaler"] = seconds - phases["clients"] - phases["api_calls"]
+        return result, {phase: phases[phase] * 1000 for phase in PHASES}
+
+    logging.disable(logging.INFO)
+    with patch.object(clients, "_create_client", create_local_client):
+        result, first = invoke()
+        warm_invocations = [invoke()[1] for _ in range(warm)]
+    return {"import_ms": import_seconds * 1000, "eager_modules": eager_modules, "result": result, "first": first,
+            "warm": warm_invocations}
+
+
+def run_child(scenario, warm, import_time=False):
+    command = [sys.executable] + (["-X", "importtime"] if import_time else []) + [
+        "-m", "benchmarks.cold_start_benchmark", "--child", "--scenario", scenario, "--warm", str(warm)
+    ]
+    # Like in Lambda, credentials come from the environment, so creating a client looks up no profile or metadata.
+    env = dict(os.environ, AWS_ACCESS_KEY_ID="benchmark", AWS_SECRET_ACCESS_KEY="benchmark")
+    env.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+    env.pop("AWS_PROFILE", None)
+    env.pop("AWS_SESSION_TOKEN", None)
+    completed = subprocess.run(command, cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True, check=True)
+    return json.loads(completed.stdout.splitlines()[-1]), completed.stderr
+
+
+def module_group(name):
+    parts = name.split(".")
+    if parts[0] != "app":
+        return parts[0]
+    return ".".join(parts[:3] if parts[1:2] == ["emr_autoscaling"] else parts[:2])
+
+
+def module_times(stderr):
+    # Milliseconds spent importing each module of the Lambda, other packages are summed up by top level package.
+    lines = stderr.splitlines()
+    times = Counter()
+    for line in lines[lines.index(IMPORT_STARTED) + 1:lines.index(IMPORT_FINISHED)]:
+        match = IMPORT_TIME.match(line)
+        if match:
+            times[module_group(match.group(2))] += int(match.group(1)) / 1000
+    return {module: round(ms, 3) for module, ms in times.most_common()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(scenario=SCENARIO, runs=5, warm=20):
+    # Each run is a fresh interpreter, -X importtime slows imports down, so the module breakdown gets its own run.
+    measurements = [run_child(scenario, warm)[0] for _ in range(runs)]
+    _, stderr = run_child(scenario, 0, import_time=True)
+    warm_invocations = [invocation for measurement in measurements for invocation in measurement["warm"]]
+
+    def medians(invocations):
+        return {phase: statistics.median(invocation[phase] for invocation in invocations) for phase in PHASES}
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "scenario": scenario,
+        "runs": runs,
+        "warm_invocations": warm,
+        "result": measurements[0]["result"],
+        "import_ms": statistics.median(measurement["import_ms"] for measurement in measurements),
+        "eager_modules": measurements[0]["eager_modules"],
+        "first_invocation_ms": medians([measurement["first"] for measurement in measurements]),
+        "warm_invocation_ms": medians(warm_invocations) if warm_invocations else None,
+        "modules_ms": module_times(stderr)
+    }
+    report["cold_start_ms"] = report["import_ms"] + report["first_invocation_ms"]["total"]
+    return report
+
+
+def rows(report):
+    yield "cold start", report["cold_start_ms"]
+    yield "import", report["import_ms"]
+    for phase in PHASES:
+        yield "first invocation " + phase, report["first_invocation_ms"][phase]
+    for phase in PHASES:
+        if report["warm_invocation_ms"]:
+            yield "warm invocation " + phase, report["warm_invocation_ms"][phase]
+    for module, ms in list(report["modules_ms"].items())[:TOP_MODULES]:
+        yield "import " + module, ms
+
+
+def print_report(report, baseline=None):
+    before = dict(rows(baseline)) if baseline else {}
+    print("{} at {}, Python {}, median of {} runs".format(
+        report["scenario"], report["commit"], report["python"], report["runs"]))
+    print("{:<40} {:>10} {:>10} {:>8}".format("phase", "ms", "before", "change"))
+    for name, ms in rows(report):
+        if before.get(name):
+            print("{:<40} {:>10.2f} {:>10.2f} {:>+7.0%}".format(name, ms, before[name], ms / before[name] - 1))
+        else:
+            print("{:<40} {:>10.2f}".format(name, ms))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import, first and warm invocation time of lambda_handler, each run in a fresh interpreter.")
+    parser.add_argument("--scenario", default=SCENARIO, help="scenario of the invocation benchmark to run")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to measure")
+    parser.add_argument("--warm", type=int, default=20, help="warm invocations per interpreter")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--compare", help="results of an earlier run, written with --json, to compare against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.scenario, args.warm), default=str))
+        return
+
+    report = benchmark(args.scenario, args.runs, args.warm)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    if report["eager_modules"]:
+        sys.exit("Importing {} imported {}, which it should leave to the code paths using them.".format(
+            MODULE, ", ".join(report["eager_modules"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import io
+import json
+import logging
+import statistics
+import time
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+
+from mock import patch
+
+from app import scaler_lambda
+from app.emr_autoscaling import clients, emr
+from app.emr_autoscaling.tracing import TRACER
+from app.pytz import utc
+from tests.local import LocalAws
+
+Scenario = namedtuple("Scenario", ["name", "utc_time", "event", "setup"])
+
+JOB_FLOW_ID = "j-BENCHMARK"
+PARENT_STACK = "benchmark-parent-stack"
+EVENT = {
+    "JobFlowId": JOB_FLOW_ID,
+    "Threshold": "0.7",
+    "MinInstances": "0",
+    "MaxInstances": "20",
+    "OfficeHoursStart": "7",
+    "OfficeHoursEnd": "18",
+    "ShutdownTime": "23"
+}
+
+
+def cluster(requested=5, running=5, pending=0.0, allocated=90.0, total=100.0):
+    def setup(aws):
+        aws.emr.add_cluster(JOB_FLOW_ID)
+        aws.emr.add_instance_group(JOB_FLOW_ID, instance_group_type="MASTER", bid_price=None, instance_count=1)
+        aws.emr.add_instance_group(JOB_FLOW_ID, instance_group_type="CORE", bid_price=None, instance_count=2)
+        aws.emr.add_instance_group(JOB_FLOW_ID, instance_count=requested, running_instance_count=running)
+        aws.cloudwatch.put_datapoint(JOB_FLOW_ID, "ContainerPending", pending)
+        aws.cloudwatch.put_datapoint(JOB_FLOW_ID, "MemoryAllocatedMB", allocated)
+        aws.cloudwatch.put_datapoint(JOB_FLOW_ID, "MemoryTotalMB", total)
+        aws.cloudformation.add_stack(PARENT_STACK)
+
+    return setup
+
+
+# Times are UTC on a Wednesday in summer, Berlin is two hours ahead.
+SCENARIOS = [
+    Scenario("scale_up", datetime(2021, 6, 16, 19, 0), EVENT, cluster(pending=4.0)),
+    Scenario("scale_down", datetime(2021, 6, 16, 19, 0), EVENT, cluster(allocated=30.0)),
+    Scenario("office_hours", datetime(2021, 6, 16, 10, 0), EVENT, cluster(allocated=30.0)),
+    Scenario("in_progress", datetime(2021, 6, 16, 19, 0), EVENT, cluster(requested=6, pending=4.0)),
+    Scenario("shutdown", datetime(2021, 6, 16, 21, 30), dict(EVENT, ParentStackId=PARENT_STACK), cluster())
+]
+
+
+@contextmanager
+def frozen_time(utc_time):
+    class FrozenDatetime(datetime):
+
+        @classmethod
+        def now(cls, tz=None):
+            if tz is None:
+                return utc_time
+            return utc.localize(utc_time).astimezone(tz)
+
+    with patch("app.emr_autoscaling.scaler.datetime", FrozenDatetime):
+        yield
+
+
+def run_scenario(scenario, latency=0.0):
+    aws = LocalAws(latency=latency)
+    scenario.setup(aws)
+    clients.clear_clients()
+    emr.CLUSTER_DESCRIPTIONS.clear()
+    aws.register()
+    aws.reset_calls()
+
+    # The Embedded Metric Format line of the invocation would break up the table.
+    with frozen_time(scenario.utc_time), patch.object(TRACER, "stream", io.StringIO()):
+        started = time.perf_counter()
+        result = scaler_lambda.lambda_handler(dict(scenario.event), None)
+        seconds = time.perf_counter() - started
+
+    calls = aws.calls
+    return {
+        "scenario": scenario.name,
+        "result": result,
+        "api_calls": len(calls),
+        "operations": dict(Counter(call.operation for call in calls)),
+        "request_bytes": sum(call.request_bytes for call in calls),
+        "response_bytes": sum(call.response_bytes for call in calls),
+        "api_seconds": sum(call.seconds for call in calls),
+        "seconds": seconds
+    }
+
+
+def benchmark(scenarios=SCENARIOS, latency=0.0, iterations=20):
+    reports = []
+    for scenario in scenarios:
+        runs = [run_scenario(scenario, latency) for _ in range(iterations)]
+        report = dict(runs[0])
+        durations = sorted(run["seconds"] for run in runs)
+        report.pop("seconds")
+        report["latency_ms"] = {
+            "mean": statistics.mean(durations) * 1000,
+            "p50": durations[len(durations) // 2] * 1000,
+            "max": durations[-1] * 1000
+        }
+        reports.append(report)
+    clients.clear_clients()
+    emr.CLUSTER_DESCRIPTIONS.clear()
+    return reports
+
+
+def print_table(reports):
+    print("{:<14} {:>6} {:>10} {:>10} {:>10} {:>10}  {}".format(
+        "scenario", "calls", "req bytes", "resp bytes", "mean ms", "p50 ms", "operations"))
+    for report in reports:
+        print("{:<14} {:>6} {:>10} {:>10} {:>10.2f} {:>10.2f}  {}".format(
+            report["scenario"], report["api_calls"], report["request_bytes"], report["response_bytes"],
+            report["latency_ms"]["mean"], report["latency_ms"]["p50"],
+            ", ".join("{}={}".format(op, n) for op, n in sorted(report["operations"].items()))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API calls, bytes and latency per lambda_handler invocation.")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latency injected into every API call")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    reports = benchmark(latency=args.latency_ms / 1000, iterations=args.iterations)
+    print_table(reports)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
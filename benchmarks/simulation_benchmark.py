@@ -0,0 +1,57 @@
+import argparse
+import logging
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from simulation.simulator import Trace, simulate
+
+DAYS = 30
+BUSY_HOURS = range(7, 10)
+
+
+def month_trace(days=DAYS):
+    # Quiet nights and a burst of pending containers every morning, on core nodes with 24 GB of YARN memory.
+    busy = [(minute // 60) % 24 in BUSY_HOURS for minute in range(days * 24 * 60)]
+    return Trace(
+        start=datetime(2021, 6, 1),
+        container_pending=[40.0 if b else 0.0 for b in busy],
+        memory_allocated_mb=[24576.0 if b else 2000.0 for b in busy],
+        memory_total_mb=[24576.0] * len(busy)
+    )
+
+
+def benchmark(days=DAYS, runs=5):
+    trace = month_trace(days)
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = simulate(trace)
+        durations.append(time.perf_counter() - started)
+    return {
+        "days": days,
+        "runs": runs,
+        "evaluations": result.evaluations,
+        "median_seconds": statistics.median(durations),
+        "max_seconds": max(durations)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time replaying a synthetic trace through the default policy.")
+    parser.add_argument("--days", type=int, default=DAYS, help="days of trace to replay")
+    parser.add_argument("--runs", type=int, default=5, help="replays to take the median of")
+    parser.add_argument("--max-seconds", type=float, help="fail if the median replay takes longer")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    report = benchmark(args.days, args.runs)
+    print("{days} days, {evaluations} evaluations: median {median_seconds:.3f} s, max {max_seconds:.3f} s "
+          "over {runs} runs".format(**report))
+    if args.max_seconds is not None and report["median_seconds"] > args.max_seconds:
+        sys.exit("Replay took {:.3f} s, more than {} s.".format(report["median_seconds"], args.max_seconds))
+
+
+if __name__ == "__main__":
+    main()
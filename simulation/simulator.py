@@ -0,0 +1,295 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from app import scaler_lambda
+from app.emr_autoscaling import clients
+from app.emr_autoscaling.constants import DOWN, UP
+from app.emr_autoscaling.forecast import SeasonalForecast
+from app.emr_autoscaling.instance_types import containers_per_instance, get_instance_type
+from app.pytz import utc
+
+# Metrics recorded once per minute, starting at a UTC timestamp.
+Trace = namedtuple("Trace", ["start", "container_pending", "memory_allocated_mb", "memory_total_mb"])
+
+# The simulated cluster: one spot task group next to core nodes offering core_memory_mb of YARN memory.
+# Instances join YARN up_minutes after they were requested and leave down_minutes after they were removed.
+ClusterModel = namedtuple("ClusterModel", [
+    "instance_type", "bid_price", "initial_instances", "core_memory_mb", "container_memory_mb", "up_minutes",
+    "down_minutes"
+], defaults=("m5.xlarge", "0.1", 0, None, None, 8, 2))
+
+SimulationResult = namedtuple("SimulationResult", [
+    "policy", "instance_hours", "backlog_container_minutes", "scale_ups", "scale_downs", "evaluations"
+])
+
+JOB_FLOW_ID = "j-SIMULATION"
+GROUP_ID = "ig-SIMULATION"
+EVALUATION_MINUTES = 5
+EPOCH = datetime(1970, 1, 1)
+METRICS = ("ContainerPending", "MemoryAllocatedMB", "MemoryTotalMB")
+
+POLICY = {
+    "JobFlowId": JOB_FLOW_ID,
+    "Threshold": "0.7",
+    "MinInstances": "0",
+    "MaxInstances": "20",
+    "OfficeHoursStart": "7",
+    "OfficeHoursEnd": "18",
+    "ShutdownTime": "23"
+}
+
+
+@lru_cache(maxsize=None)
+def minutes(count):
+    return timedelta(minutes=count)
+
+
+def load_trace(path):
+    # CSV with the columns Timestamp (ISO 8601, UTC), ContainerPending, MemoryAllocatedMB and MemoryTotalMB.
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    return Trace(
+        start=datetime.strptime(rows[0]["Timestamp"][:19], "%Y-%m-%dT%H:%M:%S"),
+        container_pending=[float(row["ContainerPending"]) for row in rows],
+        memory_allocated_mb=[float(row["MemoryAllocatedMB"]) for row in rows],
+        memory_total_mb=[float(row["MemoryTotalMB"]) for row in rows]
+    )
+
+
+class SimulatedCluster:
+
+    def __init__(self, trace, model):
+        instance_type = get_instance_type(model.instance_type)
+        self.model = model
+        self.start = trace.start
+        self.node_memory_mb = instance_type.yarn_memory_mb
+        self.container_memory_mb = model.container_memory_mb or \
+            self.node_memory_mb / containers_per_instance(model.instance_type)
+        self.core_memory_mb = model.core_memory_mb if model.core_memory_mb is not None else \
+            max(0.0, trace.memory_total_mb[0] - model.initial_instances * self.node_memory_mb)
+        # The memory the recorded workload asked for, whether it was granted or pending.
+        self.demand_mb = [
+            allocated + pending * self.container_memory_mb
+            for allocated, pending in zip(trace.memory_allocated_mb, trace.container_pending)
+        ]
+        self.timestamps = [trace.start + minutes(1) * minute for minute in range(len(self.demand_mb))]
+        self.requested = self.running = model.initial_instances
+        self.ready_at = 0
+        self.minute = 0
+        # Counts changes of the task group, the instance groups listed before are current as long as it is unchanged.
+        self.changes = 0
+        # Per metric the value of every minute and the running sums before each minute.
+        self.series = {name: [] for name in METRICS}
+        self.sums = {name: [0.0] for name in METRICS}
+        self.recorded = [(self.series[name], self.sums[name]) for name in METRICS]
+        # Minutes already recorded never change, neither do the aggregates of buckets that ended before this one.
+        self.aggregates = {}
+
+    def advance(self):
+        if self.running != self.requested and self.minute >= self.ready_at:
+            self.running = self.requested
+            self.changes += 1
+        total_mb = self.core_memory_mb + self.running * self.node_memory_mb
+        demand_mb = self.demand_mb[self.minute]
+        allocated_mb = demand_mb if demand_mb < total_mb else total_mb
+        pending = (demand_mb - allocated_mb) / self.container_memory_mb
+        for (series, sums), value in zip(self.recorded, (pending, allocated_mb, total_mb)):
+            series.append(value)
+            sums.append(sums[-1] + value)
+        self.minute += 1
+        # Instances are billed from their request until they are gone.
+        return max(self.requested, self.running), pending
+
+    def minute_of(self, time):
+        return int((time - self.start).total_seconds()) // 60
+
+    def _aggregate(self, name, buckets, period, end, stat):
+        # One value per bucket of period minutes, the last bucket is cut at the end of the window.
+        if stat in ("Average", "Sum"):
+            sums = self.sums[name]
+            totals = [sums[min(bucket + period, end)] - sums[bucket] for bucket in buckets]
+            if stat == "Sum":
+                return totals
+            return [total / (min(bucket + period, end) - bucket) for total, bucket in zip(totals, buckets)]
+        if stat in ("Maximum", "Minimum"):
+            series = self.series[name]
+            aggregate = max if stat == "Maximum" else min
+            aggregates = self.aggregates.setdefault((name, period, stat), {})
+            values = []
+            for bucket in buckets:
+                if bucket + period > end:
+                    values.append(aggregate(series[bucket:end]))
+                    continue
+                if bucket not in aggregates:
+                    aggregates[bucket] = aggregate(series[bucket:bucket + period])
+                values.append(aggregates[bucket])
+            return values
+        raise ValueError("Unsupported statistic %s." % stat)
+
+    # The EMR and CloudWatch calls the scaler makes, answered from the simulated cluster.
+
+    def list_instance_groups(self, ClusterId, Marker=None):
+        return {"InstanceGroups": [{
+            "Id": GROUP_ID,
+            "Name": GROUP_ID,
+            "InstanceGroupType": "TASK",
+            "Market": "SPOT",
+            "BidPrice": self.model.bid_price,
+            "InstanceType": self.model.instance_type,
+            "RequestedInstanceCount": self.requested,
+            "RunningInstanceCount": self.running,
+            "Status": {"State": "RUNNING" if self.requested == self.running else "RESIZING"}
+        }]}
+
+    def modify_instance_groups(self, ClusterId=None, InstanceGroups=()):
+        for modification in InstanceGroups:
+            count = modification["InstanceCount"]
+            delay = self.model.up_minutes if count > self.running else self.model.down_minutes
+            self.requested = count
+            self.ready_at = self.minute + delay
+            self.changes += 1
+        return {}
+
+    def describe_cluster(self, ClusterId):
+        return {"Cluster": {"Id": ClusterId, "TerminationProtected": True, "Status": {"State": "WAITING"}}}
+
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime, ScanBy="TimestampDescending", **kwargs):
+        # Only complete minutes are visible, so a window ends at the current simulated minute at the latest.
+        start = max(0, self.minute_of(StartTime))
+        end = min(self.minute, self.minute_of(EndTime))
+        results = []
+        for query in MetricDataQueries:
+            metric_stat = query["MetricStat"]
+            name = metric_stat["Metric"]["MetricName"]
+            period = metric_stat["Period"] // 60
+            buckets = range(start, end, period)
+            timestamps = self.timestamps[start:end:period]
+            if ScanBy == "TimestampDescending":
+                buckets = buckets[::-1]
+                timestamps.reverse()
+            results.append({
+                "Id": query["Id"],
+                "Timestamps": timestamps,
+                "Values": self._aggregate(name, buckets, period, end, metric_stat["Stat"]),
+                "StatusCode": "Complete"
+            })
+        return {"MetricDataResults": results}
+
+
+@contextmanager
+def simulated_clients(cluster):
+    previous_disable = logging.root.manager.disable
+    logging.disable(logging.INFO)
+    clients.clear_clients()
+    for service in ("emr", "cloudwatch"):
+        clients.register_client(service, cluster)
+    try:
+        yield
+    finally:
+        clients.clear_clients()
+        logging.disable(previous_disable)
+
+
+def simulated_forecast(forecast, clock, cache_dir):
+    return SeasonalForecast(
+        forecast.emr,
+        weeks=forecast.weeks,
+        lead_minutes=forecast.lead_minutes,
+        min_containers=forecast.min_containers,
+        max_age_hours=forecast.max_age_hours,
+        cache_dir=cache_dir,
+        time_zone=forecast.time_zone,
+        clock=clock
+    )
+
+
+def simulate(trace, policy=POLICY, model=ClusterModel(), name="policy"):
+    cluster = SimulatedCluster(trace, model)
+    event = dict(POLICY, **policy)
+    threshold = float(event["Threshold"])
+
+    def clock(tz=None):
+        now = trace.start + minutes(cluster.minute)
+        return utc.localize(now).astimezone(tz) if tz is not None else now
+
+    with simulated_clients(cluster), tempfile.TemporaryDirectory() as state_dir:
+        # Cooldowns and forecasts keep their state next to the simulation instead of in the configured store.
+        if "StateTable" in event or "StateFile" in event:
+            event.pop("StateTable", None)
+            event["StateFile"] = os.path.join(state_dir, "state.json")
+        scaler = scaler_lambda.create_scaler(event)
+        # The simulated cluster answers in-process, API rate limits and budgets do not apply.
+        scaler.emr.emr = scaler.emr.cloudwatch = cluster
+        scaler.clock = clock
+        scaler.emr.clock = clock
+        if scaler.cooldown:
+            scaler.cooldown.clock = lambda: (clock() - EPOCH).total_seconds()
+        forecast = scaler.forecast
+
+        billed_minutes = backlog = 0.0
+        directions = []
+        listed_changes = None
+        for minute in range(len(cluster.demand_mb)):
+            if minute and minute % EVALUATION_MINUTES == 0:
+                # Like a fresh Lambda instance every hour, the forecast reloads its cached profile or relearns it.
+                if forecast and minute % 60 == EVALUATION_MINUTES:
+                    scaler.forecast = simulated_forecast(forecast, clock, state_dir)
+                # An unchanged cluster lists the same groups, the snapshot and the scale targets memoised on it are kept.
+                if cluster.changes != listed_changes:
+                    scaler.emr.refresh_cluster_snapshot()
+                    listed_changes = cluster.changes
+                directions.append(scaler.maybe_scale(threshold))
+            instances, pending = cluster.advance()
+            billed_minutes += instances
+            backlog += pending
+
+    return SimulationResult(
+        policy=name,
+        instance_hours=billed_minutes / 60,
+        backlog_container_minutes=backlog,
+        scale_ups=directions.count(UP),
+        scale_downs=directions.count(DOWN),
+        evaluations=len(directions)
+    )
+
+
+def compare(trace, policies, model=ClusterModel()):
+    return [simulate(trace, policy, model, name) for name, policy in sorted(policies.items())]
+
+
+def print_table(results):
+    print("{:<20} {:>14} {:>16} {:>6} {:>6}".format("policy", "instance hours", "backlog min", "ups", "downs"))
+    for result in results:
+        print("{:<20} {:>14.1f} {:>16.1f} {:>6} {:>6}".format(
+            result.policy, result.instance_hours, result.backlog_container_minutes, result.scale_ups,
+            result.scale_downs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded metric trace through EmrScaler policies.")
+    parser.add_argument("trace", help="CSV of Timestamp, ContainerPending, MemoryAllocatedMB, MemoryTotalMB")
+    parser.add_argument("--policies", help="JSON object of policy name to event settings, e.g. Threshold")
+    parser.add_argument("--instance-type", default=ClusterModel().instance_type)
+    parser.add_argument("--initial-instances", type=int, default=0)
+    parser.add_argument("--up-minutes", type=int, default=ClusterModel().up_minutes)
+    args = parser.parse_args()
+
+    policies = {"default": {}}
+    if args.policies:
+        with open(args.policies) as f:
+            policies = json.load(f)
+    model = ClusterModel(instance_type=args.instance_type, initial_instances=args.initial_instances,
+                         up_minutes=args.up_minutes)
+    print_table(compare(load_trace(args.trace), policies, model))
+
+
+if __name__ == "__main__":
+    main()
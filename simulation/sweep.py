@@ -0,0 +1,191 @@
+import argparse
+import os
+import random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+
+from app.pytz import timezone, utc
+from simulation.simulator import EVALUATION_MINUTES, POLICY, ClusterModel, SimulatedCluster, load_trace, minutes, \
+    simulate
+
+Parameters = namedtuple("Parameters", [
+    "threshold", "min_instances", "max_instances", "office_hours_start", "office_hours_end"
+])
+
+Outcome = namedtuple("Outcome", ["parameters", "instance_hours", "backlog_container_minutes"])
+
+TIME_ZONE = timezone('Europe/Berlin')
+MEMORY_WINDOW_MINUTES = 60
+STEP_RATIO = 0.2
+
+
+def grid(thresholds, min_instances, max_instances, office_hours):
+    return [
+        Parameters(threshold, low, high, start, end)
+        for threshold, low, high, (start, end) in product(thresholds, min_instances, max_instances, office_hours)
+        if low <= high
+    ]
+
+
+def random_sample(parameters, count, seed=None):
+    return random.Random(seed).sample(parameters, min(count, len(parameters)))
+
+
+def event(parameters):
+    return dict(
+        POLICY,
+        Threshold=str(parameters.threshold),
+        MinInstances=str(parameters.min_instances),
+        MaxInstances=str(parameters.max_instances),
+        OfficeHoursStart=str(parameters.office_hours_start),
+        OfficeHoursEnd=str(parameters.office_hours_end)
+    )
+
+
+def in_office_hours(local_time, start, end):
+    # EmrScaler.is_in_office_hours for an array of office hours, at the full minutes the scaler is evaluated at.
+    if local_time.weekday() > 4:
+        return np.zeros(len(start), dtype=bool)
+    return (local_time.hour >= start) & (
+        (local_time.hour < end) | ((local_time.hour == end) & (local_time.minute == 0))
+    )
+
+
+def screen(trace, parameters, model=ClusterModel()):
+    # Replays the trace for all parameter sets at once, applying the scaler's default threshold rules and 20% steps
+    # to one array element per parameter set. Cooldowns, forecasts and DEMAND modes need the full simulation.
+    cluster = SimulatedCluster(trace, model)
+    threshold, min_instances, max_instances, office_hours_start, office_hours_end = np.array(parameters, dtype=float).T
+    requested = np.full(len(parameters), float(model.initial_instances))
+    running = requested.copy()
+    ready_at = np.zeros(len(parameters))
+    pending_max = np.zeros(len(parameters))
+    billed_minutes = np.zeros(len(parameters))
+    backlog = np.zeros(len(parameters))
+    # Running sums of the last hour of allocated and total memory, indexed by minute modulo the ring size.
+    ring_size = MEMORY_WINDOW_MINUTES + 1
+    allocated_sums = np.zeros((ring_size, len(parameters)))
+    total_sums = np.zeros((ring_size, len(parameters)))
+
+    for minute, demand_mb in enumerate(cluster.demand_mb):
+        if minute and minute % EVALUATION_MINUTES == 0:
+            now, since = minute % ring_size, max(0, minute - MEMORY_WINDOW_MINUTES) % ring_size
+            local_time = utc.localize(trace.start + minutes(minute)).astimezone(TIME_ZONE)
+            idle = requested == running
+            up = idle & (pending_max > 0) & (requested < max_instances)
+            down = idle & (pending_max == 0) & (requested > min_instances) \
+                & ~in_office_hours(local_time, office_hours_start, office_hours_end) \
+                & (allocated_sums[now] - allocated_sums[since] <= threshold * (total_sums[now] - total_sums[since]))
+            grown = np.minimum(np.where(requested == 0, 1, requested + np.ceil(STEP_RATIO * requested)), max_instances)
+            shrunk = np.maximum(requested + np.floor(-STEP_RATIO * requested), min_instances)
+            target = np.where(up, grown, np.where(down, shrunk, requested))
+            delay = np.where(target > running, model.up_minutes, model.down_minutes)
+            ready_at = np.where(target != requested, minute + delay, ready_at)
+            requested = target
+            pending_max[:] = 0
+
+        running = np.where((running != requested) & (minute >= ready_at), requested, running)
+        total_mb = cluster.core_memory_mb + running * cluster.node_memory_mb
+        allocated_mb = np.minimum(demand_mb, total_mb)
+        pending = (demand_mb - allocated_mb) / cluster.container_memory_mb
+        np.maximum(pending_max, pending, out=pending_max)
+        allocated_sums[(minute + 1) % ring_size] = allocated_sums[minute % ring_size] + allocated_mb
+        total_sums[(minute + 1) % ring_size] = total_sums[minute % ring_size] + total_mb
+        billed_minutes += np.maximum(requested, running)
+        backlog += pending
+
+    return billed_minutes / 60, backlog
+
+
+def pareto_front(parameters, instance_hours, backlog):
+    # Cheapest first, a parameter set is on the front if nothing cheaper has less backlog.
+    order = np.lexsort((backlog, instance_hours))
+    best_backlog = np.minimum.accumulate(backlog[order])
+    on_front = np.concatenate(([True], backlog[order][1:] < best_backlog[:-1]))
+    return [Outcome(parameters[i], float(instance_hours[i]), float(backlog[i])) for i in order[on_front]]
+
+
+def verify(trace, parameters, model):
+    result = simulate(trace, event(parameters), model)
+    return Outcome(parameters, result.instance_hours, result.backlog_container_minutes)
+
+
+def sweep(traces, parameters, model=ClusterModel(), workers=None, verified=False):
+    # Every cluster's trace is screened in one chunk of parameter sets per worker process.
+    if not parameters:
+        return {cluster: [] for cluster in traces}
+    workers = workers or os.cpu_count()
+    chunk_size = -(-len(parameters) // workers)
+    chunks = [parameters[i:i + chunk_size] for i in range(0, len(parameters), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        screened = {
+            cluster: [executor.submit(screen, trace, chunk, model) for chunk in chunks]
+            for cluster, trace in traces.items()
+        }
+        fronts = {}
+        for cluster, futures in screened.items():
+            instance_hours, backlog = (np.concatenate(columns) for columns in zip(*[f.result() for f in futures]))
+            fronts[cluster] = pareto_front(parameters, instance_hours, backlog)
+        if verified:
+            # The front is replayed through EmrScaler itself, the screening only approximates its evaluation.
+            fronts = {
+                cluster: [
+                    future.result() for future in
+                    [executor.submit(verify, traces[cluster], outcome.parameters, model) for outcome in front]
+                ]
+                for cluster, front in fronts.items()
+            }
+    return fronts
+
+
+def print_fronts(fronts):
+    for cluster, front in sorted(fronts.items()):
+        print(cluster)
+        print("{:>9} {:>5} {:>5} {:>12} {:>14} {:>16}".format(
+            "threshold", "min", "max", "office hours", "instance hours", "backlog min"
+        ))
+        for outcome in front:
+            p = outcome.parameters
+            print("{:>9} {:>5} {:>5} {:>12} {:>14.1f} {:>16.1f}".format(
+                p.threshold, p.min_instances, p.max_instances,
+                "{}-{}".format(p.office_hours_start, p.office_hours_end), outcome.instance_hours,
+                outcome.backlog_container_minutes
+            ))
+        print()
+
+
+def office_hours(value):
+    start, end = value.split("-")
+    return int(start), int(end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep EmrScaler parameters over recorded metric traces.")
+    parser.add_argument("traces", nargs="+", help="CSV traces, one per cluster, named after the file")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8])
+    parser.add_argument("--min-instances", type=int, nargs="+", default=[0])
+    parser.add_argument("--max-instances", type=int, nargs="+", default=[10, 20, 40])
+    parser.add_argument("--office-hours", type=office_hours, nargs="+", default=[(7, 18)], help="e.g. 7-18")
+    parser.add_argument("--samples", type=int, help="evaluate a random sample of the grid instead of all of it")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--verify", action="store_true", help="replay the Pareto front through EmrScaler")
+    parser.add_argument("--instance-type", default=ClusterModel().instance_type)
+    parser.add_argument("--initial-instances", type=int, default=0)
+    parser.add_argument("--up-minutes", type=int, default=ClusterModel().up_minutes)
+    args = parser.parse_args()
+
+    parameters = grid(args.thresholds, args.min_instances, args.max_instances, args.office_hours)
+    if args.samples:
+        parameters = random_sample(parameters, args.samples, args.seed)
+    traces = {os.path.splitext(os.path.basename(path))[0]: load_trace(path) for path in args.traces}
+    model = ClusterModel(instance_type=args.instance_type, initial_instances=args.initial_instances,
+                         up_minutes=args.up_minutes)
+    print_fronts(sweep(traces, parameters, model, args.workers, args.verify))
+
+
+if __name__ == "__main__":
+    main()
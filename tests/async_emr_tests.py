@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+from app import scaler_lambda
+from app.emr_autoscaling import clients
+from app.emr_autoscaling.async_emr import AsyncEmrScaler
+from app.emr_autoscaling.emr import Emr
+from app.emr_autoscaling.scaler import EmrScaler
+from app.pytz import utc
+from mock import patch
+from tests.local import LocalCloudWatch, LocalEmr
+from unittest import TestCase
+
+
+class SlowLocalEmr(LocalEmr):
+
+    def __init__(self):
+        super().__init__()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    def list_instance_groups(self, **request):
+        with self._in_flight_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self._in_flight_lock:
+            self.in_flight -= 1
+        return super().list_instance_groups(**request)
+
+
+class AsyncEmrTest(TestCase):
+
+    def setUp(self):
+        clients.clear_clients()
+        self.emr = SlowLocalEmr()
+        self.cloudwatch = LocalCloudWatch()
+        clients.register_client("emr", self.emr)
+        clients.register_client("cloudwatch", self.cloudwatch)
+        self.event = {
+            "Threshold": "0.7",
+            "MinInstances": "0",
+            "MaxInstances": "20",
+            "OfficeHoursStart": "7",
+            "OfficeHoursEnd": "18",
+            "ShutdownTime": "23"
+        }
+
+    def tearDown(self):
+        clients.clear_clients()
+
+    def add_cluster(self, cluster_id, requested=5, running=5, pending=0.0, allocated_mb=90.0, total_mb=100.0):
+        self.emr.add_cluster(cluster_id)
+        group_id = self.emr.add_instance_group(cluster_id, instance_count=requested, running_instance_count=running)
+        self.cloudwatch.put_datapoint(cluster_id, "ContainerPending", pending)
+        self.cloudwatch.put_datapoint(cluster_id, "MemoryAllocatedMB", allocated_mb)
+        self.cloudwatch.put_datapoint(cluster_id, "MemoryTotalMB", total_mb)
+        return group_id
+
+    def maybe_scale(self, cluster_id, clock=None, **settings):
+        async def run():
+            scaler = AsyncEmrScaler(EmrScaler(Emr(job_flow_id=cluster_id, **settings), clock=clock),
+                                    asyncio.Semaphore(4))
+            return await scaler.maybe_scale(0.7)
+
+        return asyncio.run(run())
+
+    def test_scales_up_with_pending_containers(self):
+        group_id = self.add_cluster("j-up", pending=3.0)
+        self.assertEqual(self.maybe_scale("j-up"), 1)
+        self.assertEqual(self.emr.instance_group(group_id)["RequestedInstanceCount"], 6)
+
+    def test_does_nothing_while_scaling_is_in_progress(self):
+        group_id = self.add_cluster("j-busy", requested=6, running=5, pending=3.0)
+        self.assertIsNone(self.maybe_scale("j-busy"))
+        self.assertEqual(self.emr.instance_group(group_id)["RequestedInstanceCount"], 6)
+
+    def test_no_removable_node_is_not_reported_as_scaled(self):
+        # 60% of the YARN memory of 4 m5.xlarge is allocated, less than a node fits below a ratio of 0.7.
+        group_id = self.add_cluster("j-demand", requested=4, running=4, allocated_mb=29491.0, total_mb=49152.0)
+        now = datetime(2021, 6, 16, 21, 0)
+        self.assertIsNone(self.maybe_scale("j-demand", scale_down_mode="DEMAND",
+                                           clock=lambda tz=None: utc.localize(now).astimezone(tz) if tz else now))
+        self.assertEqual(self.emr.instance_group(group_id)["RequestedInstanceCount"], 4)
+
+    def test_evaluates_many_clusters_on_one_loop_with_bounded_concurrency(self):
+        cluster_ids = ["j-{:03d}".format(i) for i in range(100)]
+        group_ids = [self.add_cluster(cluster_id, pending=1.0) for cluster_id in cluster_ids]
+        event = dict(self.event, Executor="asyncio", MaxWorkers=8,
+                     Clusters=[{"JobFlowId": cluster_id} for cluster_id in cluster_ids + ["j-missing"]])
+
+        results = {r["JobFlowId"]: r for r in scaler_lambda.lambda_handler(event, None)["Results"]}
+
+        self.assertTrue(all(results[cluster_id]["Scaled"] == "UP" for cluster_id in cluster_ids))
+        self.assertEqual(results["j-missing"]["Status"], "FAILED")
+        self.assertTrue(all(self.emr.instance_group(g)["RequestedInstanceCount"] == 6 for g in group_ids))
+        self.assertLessEqual(self.emr.max_in_flight, 8)
+        self.assertGreater(self.emr.max_in_flight, 1)
+
+    def test_creates_scalers_off_the_event_loop(self):
+        self.add_cluster("j-1", pending=1.0)
+        threads = []
+        create_scaler = scaler_lambda.create_scaler
+
+        def recording_create_scaler(event):
+            threads.append(threading.current_thread())
+            return create_scaler(event)
+
+        event = dict(self.event, Executor="asyncio", Clusters=[{"JobFlowId": "j-1"}])
+        with patch.object(scaler_lambda, "create_scaler", recording_create_scaler):
+            results = scaler_lambda.lambda_handler(event, None)["Results"]
+        self.assertEqual(results[0]["Scaled"], "UP")
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertEqual(len(threads), 1)
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta, timezone
+
+from app.emr_autoscaling import clients
+from mock import patch
+from unittest import TestCase
+
+
+MODULE_BASE = "app.emr_autoscaling"
+
+
+class ClientsTest(TestCase):
+
+    def setUp(self):
+        clients.clear_clients()
+
+    def tearDown(self):
+        clients.clear_clients()
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    def test_reuses_client_for_same_key(self, mock_client):
+        first = clients.get_client("emr", "eu-west-1")
+        second = clients.get_client("emr", "eu-west-1")
+        self.assertIs(first, second)
+        mock_client.assert_called_once_with("emr", region_name="eu-west-1", config=clients.CLIENT_CONFIG)
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    def test_creates_one_client_per_service_and_region(self, mock_client):
+        clients.get_client("emr", "eu-west-1")
+        clients.get_client("cloudwatch", "eu-west-1")
+        clients.get_client("emr", "eu-central-1")
+        self.assertEqual(mock_client.call_count, 3)
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    def test_clients_without_retries_make_a_single_attempt(self, mock_client):
+        clients.get_client("emr", "eu-west-1")
+        clients.get_client("emr", "eu-west-1", retries=False)
+        clients.get_client("emr", "eu-west-1", retries=False)
+        self.assertEqual(mock_client.call_count, 2)
+        mock_client.assert_called_with("emr", region_name="eu-west-1", config=clients.SINGLE_ATTEMPT_CONFIG)
+        self.assertEqual(clients.SINGLE_ATTEMPT_CONFIG.retries, {"mode": "standard", "max_attempts": 1})
+        self.assertEqual(clients.SINGLE_ATTEMPT_CONFIG.read_timeout, clients.CLIENT_CONFIG.read_timeout)
+
+    def test_registered_client_serves_every_lookup(self):
+        stand_in = object()
+        clients.register_client("emr", stand_in, "eu-west-1")
+        self.assertIs(clients.get_client("emr", "eu-west-1")._client, stand_in)
+        self.assertIs(clients.get_client("emr", "eu-west-1", retries=False)._client, stand_in)
+
+    def test_client_config_is_tuned(self):
+        self.assertEqual(clients.CLIENT_CONFIG.retries, {"mode": "standard", "max_attempts": 4})
+        self.assertTrue(clients.CLIENT_CONFIG.tcp_keepalive)
+        self.assertEqual(clients.CLIENT_CONFIG.max_pool_connections, 50)
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    def test_assumes_role_and_renews_expiring_credentials(self, mock_client):
+        mock_assume_role = mock_client.return_value.assume_role
+        mock_assume_role.return_value = {
+            "Credentials": {
+                "AccessKeyId": "key",
+                "SecretAccessKey": "secret",
+                "SessionToken": "token",
+                "Expiration": datetime.now(timezone.utc) + timedelta(hours=1)
+            }
+        }
+        clients.get_client("emr", "eu-west-1", "arn:aws:iam::123:role/scaler")
+        clients.get_client("emr", "eu-west-1", "arn:aws:iam::123:role/scaler")
+        mock_assume_role.assert_called_once_with(RoleArn="arn:aws:iam::123:role/scaler",
+                                                 RoleSessionName="emr-autoscaling")
+
+        mock_assume_role.return_value["Credentials"]["Expiration"] = datetime.now(timezone.utc)
+        clients.clear_clients()
+        clients.get_client("emr", "eu-west-1", "arn:aws:iam::123:role/scaler")
+        clients.get_client("emr", "eu-west-1", "arn:aws:iam::123:role/scaler")
+        self.assertEqual(mock_assume_role.call_count, 3)
@@ -0,0 +1,46 @@
+import io
+from contextlib import redirect_stdout
+
+from benchmarks import cold_start_benchmark
+from unittest import TestCase
+
+IMPORT_TIMES = "\n".join([
+    "import time: self [us] | cumulative | imported package",
+    "import time:       100 |        100 | json",
+    cold_start_benchmark.IMPORT_STARTED,
+    "import time:      1500 |       1500 |       botocore.client",
+    "import time:       500 |       2000 |     boto3",
+    "import time:      2000 |       2000 |     app.pytz.lazy",
+    "import time:       250 |       2250 |   app.pytz",
+    "import time:       750 |       4000 | app.emr_autoscaling.emr",
+    cold_start_benchmark.IMPORT_FINISHED,
+    "import time:       100 |        100 | mock"
+])
+
+
+class ColdStartBenchmarkTest(TestCase):
+
+    def test_import_time_per_module(self):
+        self.assertEqual(cold_start_benchmark.module_times(IMPORT_TIMES), {
+            "app.pytz": 2.25,
+            "botocore": 1.5,
+            "app.emr_autoscaling.emr": 0.75,
+            "boto3": 0.5
+        })
+
+    def test_report_compares_against_baseline(self):
+        report = {
+            "scenario": "scale_up", "commit": "abc1234", "python": "3.9.1", "runs": 5,
+            "cold_start_ms": 300.0, "import_ms": 200.0,
+            "first_invocation_ms": {"total": 100.0, "clients": 60.0, "api_calls": 30.0, "scaler": 10.0},
+            "warm_invocation_ms": None,
+            "modules_ms": {"boto3": 50.0}
+        }
+        baseline = dict(report, cold_start_ms=400.0, modules_ms={})
+        output = io.StringIO()
+        with redirect_stdout(output):
+            cold_start_benchmark.print_report(report, baseline)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0], "scale_up at abc1234, Python 3.9.1, median of 5 runs")
+        self.assertEqual(lines[2].split(), ["cold", "start", "300.00", "400.00", "-25%"])
+        self.assertEqual(lines[-1].split(), ["import", "boto3", "50.00"])
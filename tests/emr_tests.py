@@ -1,7 +1,9 @@
 from datetime import datetime, timedelta
 
-from app.emr_autoscaling.emr import Emr
+from app.emr_autoscaling import clients, emr
+from app.emr_autoscaling.emr import Emr, MemoryWindow, MetricSnapshot
 from mock import patch
+from tests.local import LocalCloudWatch
 from unittest import TestCase
 
 
@@ -11,76 +13,44 @@ MODULE_BASE = "app.emr_autoscaling"
 class EmrTest(TestCase):
 
     def setUp(self):
-        self.cw_metric_avg = "MyTestMetricAvg"
-        self.cw_metric_container_pending = "ContainerPending"
+        clients.clear_clients()
+        emr.CLUSTER_DESCRIPTIONS.clear()
         self.job_flow = "myJobFlow"
         self.emr_task_instance_group_id = "MyTaskInstanceGroupId"
         self.emr_task_instance_group_name = "MyTaskInstanceGroupName"
         self.emr_task_instance_group_instance_type = "MyTaskInstanceGroupInstanceType"
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
-    def test_returns_average_of_last_hour(self, mock_cw):
-        mock_stats = mock_cw.return_value.get_metric_statistics
-        mock_stats.return_value = {
-            "Datapoints": [
-                {
-                    "Average": 42.0
-                }
-            ]
-        }
-        avg = Emr(job_flow_id = self.job_flow, region = "eu-west-1").get_average_of_last_hour(self.cw_metric_avg)
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    def test_gets_metric_snapshot_in_one_call(self, mock_cw):
         now = datetime.utcnow().replace(second = 0, microsecond = 0)
-        self.assertEqual(avg, 42.0)
-        mock_stats.assert_called_with (
-            Namespace = "AWS/ElasticMapReduce",
-            MetricName = self.cw_metric_avg,
-            StartTime = now - timedelta(hours = 1),
-            EndTime = now,
-            Period = 3600,
-            Statistics = [
-                "Average",
-            ],
-            Unit = "Count",
-            Dimensions = [
-                {
-                    "Name": "JobFlowId",
-                    "Value": self.job_flow
-                }
-            ]
-        )
-
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
-    def test_gets_pending_containers(self, mock_cw):
-        mock_stats = mock_cw.return_value.get_metric_statistics
-        mock_stats.return_value = {
-            "Datapoints": [
-                {
-                    "Maximum": 42
-                }
+        mock_metric_data = mock_cw.return_value.get_metric_data
+        mock_metric_data.return_value = {
+            "MetricDataResults": [
+                {"Id": "container_pending", "Timestamps": [now - timedelta(minutes = 5), now - timedelta(minutes = 10)],
+                 "Values": [3.0, 0.0]},
+                {"Id": "memory_allocated_mb", "Timestamps": [now - timedelta(hours = 1)], "Values": [60.0]},
+                {"Id": "memory_total_mb", "Timestamps": [now - timedelta(hours = 1)], "Values": [100.0]}
             ]
         }
-        max = Emr(job_flow_id = self.job_flow, region = "eu-west-1").get_pending_containers()
-        now = datetime.utcnow().replace(second = 0, microsecond = 0)
-        self.assertEqual(max, 42)
-        mock_stats.assert_called_with (
-            Namespace = "AWS/ElasticMapReduce",
-            MetricName = self.cw_metric_container_pending,
-            StartTime = now - timedelta(minutes = 5),
-            EndTime = now,
-            Period = 300,
-            Statistics = [
-                "Maximum",
-            ],
-            Unit = "Count",
-            Dimensions = [
-                {
-                    "Name": "JobFlowId",
-                    "Value": self.job_flow
-                }
+        snapshot = Emr(job_flow_id = self.job_flow, region = "eu-west-1").get_metric_snapshot()
+        self.assertEqual(snapshot, MetricSnapshot(container_pending = 3.0, memory_allocated_mb = 60.0,
+                                                  memory_total_mb = 100.0))
+        self.assertEqual(snapshot.memory_used_ratio, 0.6)
+        mock_metric_data.assert_called_once()
+        kwargs = mock_metric_data.call_args.kwargs
+        self.assertEqual(kwargs["StartTime"], now - timedelta(hours = 1))
+        self.assertEqual(kwargs["EndTime"], now)
+        self.assertEqual(
+            [(q["Id"], q["MetricStat"]["Metric"]["MetricName"], q["MetricStat"]["Period"], q["MetricStat"]["Stat"])
+             for q in kwargs["MetricDataQueries"]],
+            [
+                ("container_pending", "ContainerPending", 300, "Maximum"),
+                ("memory_allocated_mb", "MemoryAllocatedMB", 3600, "Average"),
+                ("memory_total_mb", "MemoryTotalMB", 3600, "Average")
             ]
         )
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
     def test_get_one_task_instance_group(self, mock_emr):
         mock_instance_groups = mock_emr.return_value.list_instance_groups
         mock_instance_groups.return_value = {
@@ -100,7 +70,7 @@ class EmrTest(TestCase):
                 }
             ]
         }
-        groups = Emr(job_flow_id = self.job_flow, region = "eu-west-1").get_task_instance_groups()
+        groups = list(Emr(job_flow_id = self.job_flow, region = "eu-west-1").iter_task_instance_groups())
         self.assertListEqual (
             groups,
             [
@@ -109,7 +79,7 @@ class EmrTest(TestCase):
         )
         mock_instance_groups.assert_called_with(ClusterId = self.job_flow)
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
     def test_get_two_task_instance_groups(self, mock_emr):
         mock_instance_groups = mock_emr.return_value.list_instance_groups
         mock_instance_groups.return_value = {
@@ -134,13 +104,13 @@ class EmrTest(TestCase):
                 }
             ]
         }
-        groups = Emr(job_flow_id=self.job_flow, region="eu-west-1").get_task_instance_groups()
+        groups = list(Emr(job_flow_id=self.job_flow, region="eu-west-1").iter_task_instance_groups())
         self.assertListEqual(groups,
                              [{"InstanceGroupType": "TASK", "InstanceGroupName": "MyTaskGroup", "BidPrice": 1.2},
                               {"InstanceGroupType": "TASK", "InstanceGroupName": "MyOtherTaskGroup", "BidPrice": 1.2}])
         mock_instance_groups.assert_called_with(ClusterId=self.job_flow)
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
     def test_get_no_task_instance_group(self, mock_emr):
         mock_instance_groups = mock_emr.return_value.list_instance_groups
         mock_instance_groups.return_value = {
@@ -155,10 +125,10 @@ class EmrTest(TestCase):
                 }
             ]
         }
-        groups = Emr(job_flow_id=self.job_flow, region="eu-west-1").get_task_instance_groups()
+        groups = list(Emr(job_flow_id=self.job_flow, region="eu-west-1").iter_task_instance_groups())
         self.assertListEqual(groups, [])
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
     def test_dont_get_task_instance_group_without_bid_price(self, mock_emr):
         mock_instance_groups = mock_emr.return_value.list_instance_groups
         mock_instance_groups.return_value = {
@@ -177,10 +147,51 @@ class EmrTest(TestCase):
                 }
             ]
         }
-        groups = Emr(job_flow_id=self.job_flow, region="eu-west-1").get_task_instance_groups()
+        groups = list(Emr(job_flow_id=self.job_flow, region="eu-west-1").iter_task_instance_groups())
         self.assertListEqual(groups, [])
 
-    @patch(f"{MODULE_BASE}.emr.Emr.get_task_instance_groups")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    def test_follows_markers_across_pages(self, mock_emr):
+        mock_instance_groups = mock_emr.return_value.list_instance_groups
+        mock_instance_groups.side_effect = [
+            {
+                "InstanceGroups": [
+                    {"InstanceGroupType": "CORE", "InstanceGroupName": "MyCoreGroup"},
+                    {"InstanceGroupType": "TASK", "InstanceGroupName": "MyTaskGroup", "BidPrice": 1.2}
+                ],
+                "Marker": "page-2"
+            },
+            {
+                "InstanceGroups": [
+                    {"InstanceGroupType": "TASK", "InstanceGroupName": "MyOtherTaskGroup", "BidPrice": 1.5}
+                ]
+            }
+        ]
+        groups = list(Emr(job_flow_id=self.job_flow, region="eu-west-1").iter_task_instance_groups())
+        self.assertEqual([g["InstanceGroupName"] for g in groups], ["MyTaskGroup", "MyOtherTaskGroup"])
+        self.assertEqual(mock_instance_groups.call_args_list[1].kwargs, {"ClusterId": self.job_flow, "Marker": "page-2"})
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    def test_in_progress_check_stops_at_first_mismatch(self, mock_emr):
+        mock_instance_groups = mock_emr.return_value.list_instance_groups
+        mock_instance_groups.side_effect = [
+            {
+                "InstanceGroups": [
+                    {
+                        "InstanceGroupType": "TASK",
+                        "BidPrice": 1.2,
+                        "RequestedInstanceCount": 2,
+                        "RunningInstanceCount": 1
+                    }
+                ],
+                "Marker": "page-2"
+            },
+            AssertionError("second page must not be fetched")
+        ]
+        self.assertTrue(Emr(job_flow_id=self.job_flow, region="eu-west-1").scaling_in_progress())
+        mock_instance_groups.assert_called_once_with(ClusterId=self.job_flow)
+
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
     def test_upscaling_in_progress(self, mock_get_task_instance_group):
         mock_get_task_instance_group.return_value = [
             {
@@ -195,7 +206,7 @@ class EmrTest(TestCase):
             ).scaling_in_progress()
         )
 
-    @patch(f"{MODULE_BASE}.emr.Emr.get_task_instance_groups")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
     def test_downscaling_in_progress(self, mock_get_task_instance_group):
         mock_get_task_instance_group.return_value = [
             {
@@ -205,7 +216,7 @@ class EmrTest(TestCase):
         ]
         self.assertTrue(Emr(job_flow_id=self.job_flow, region="eu-west-1").scaling_in_progress())
 
-    @patch(f"{MODULE_BASE}.emr.Emr.get_task_instance_groups")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
     def test_no_scaling_in_progress(self, mock_get_task_instance_group):
         mock_get_task_instance_group.return_value = [
             {
@@ -215,8 +226,8 @@ class EmrTest(TestCase):
         ]
         self.assertFalse(Emr(job_flow_id=self.job_flow, region="eu-west-1").scaling_in_progress())
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
-    @patch(f"{MODULE_BASE}.emr.Emr.get_task_instance_groups")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
     def test_scaling_because_inner_bounds(self, mock_get_task_instance_group, mock_emr):
         mock_get_task_instance_group.return_value = [
             {
@@ -240,8 +251,8 @@ class EmrTest(TestCase):
             }
         ])
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
-    @patch(f"{MODULE_BASE}.emr.Emr.get_task_instance_groups")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
     def test_scaling_up_from_zero_instances(self, mock_get_task_instance_group, mock_emr):
         mock_get_task_instance_group.return_value = [
             {
@@ -270,8 +281,8 @@ class EmrTest(TestCase):
             ]
         )
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
-    @patch(f"{MODULE_BASE}.emr.Emr.get_task_instance_groups")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
     def test_scaling_down_from_one_instance(self, mock_get_task_instance_group, mock_emr):
         mock_get_task_instance_group.return_value = [
             {
@@ -300,8 +311,8 @@ class EmrTest(TestCase):
             ]
         )
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
-    @patch(f"{MODULE_BASE}.emr.Emr.get_task_instance_groups")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
     def test_no_scaling_because_above_upper_bound(self, mock_get_task_instance_group, mock_emr):
         mock_get_task_instance_group.return_value = [
             {
@@ -323,8 +334,8 @@ class EmrTest(TestCase):
         )
         mock_modify_instance_groups.assert_not_called()
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
-    @patch(f"{MODULE_BASE}.emr.Emr.get_task_instance_groups")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
     def test_no_scaling_because_below_lower_bound(self, mock_get_task_instance_group, mock_emr):
         mock_get_task_instance_group.return_value = [
             {
@@ -346,9 +357,9 @@ class EmrTest(TestCase):
         )
         mock_modify_instance_groups.assert_not_called()
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
-    @patch(f"{MODULE_BASE}.emr.Emr.get_task_instance_groups")
-    def test_scales_only_once(self, mock_get_task_instance_group, mock_emr):
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
+    def test_scales_up_the_steps_of_both_groups_in_the_highest_bid_group(self, mock_get_task_instance_group, mock_emr):
         mock_get_task_instance_group.return_value = [
             {
                 "Id": self.emr_task_instance_group_id,
@@ -378,11 +389,261 @@ class EmrTest(TestCase):
             InstanceGroups = [
                 {
                     "InstanceGroupId": self.emr_task_instance_group_id + "_expensive",
-                    "InstanceCount": 6
+                    "InstanceCount": 7
                 }
             ]
         )
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    def test_in_progress_check_and_scale_share_one_snapshot(self, mock_emr):
+        mock_instance_groups = mock_emr.return_value.list_instance_groups
+        mock_instance_groups.return_value = {
+            "InstanceGroups": [
+                {
+                    "Id": self.emr_task_instance_group_id,
+                    "InstanceGroupType": "TASK",
+                    "RequestedInstanceCount": 5,
+                    "RunningInstanceCount": 5,
+                    "BidPrice": 1.2,
+                    "Name": self.emr_task_instance_group_name,
+                    "InstanceType": self.emr_task_instance_group_instance_type
+                }
+            ]
+        }
+        emr = Emr(job_flow_id=self.job_flow, region="eu-west-1")
+        self.assertFalse(emr.scaling_in_progress())
+        emr.scale(direction=1)
+        mock_instance_groups.assert_called_once_with(ClusterId=self.job_flow)
+        mock_emr.return_value.modify_instance_groups.assert_called_once_with(InstanceGroups=[
+            {
+                "InstanceGroupId": self.emr_task_instance_group_id,
+                "InstanceCount": 6
+            }
+        ])
+
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
+    def test_snapshot_is_only_refreshed_explicitly(self, mock_get_task_instance_group):
+        mock_get_task_instance_group.side_effect = [
+            [{"RequestedInstanceCount": 2, "RunningInstanceCount": 1}],
+            [{"RequestedInstanceCount": 2, "RunningInstanceCount": 2}]
+        ]
+        emr = Emr(job_flow_id=self.job_flow, region="eu-west-1")
+        self.assertTrue(emr.scaling_in_progress())
+        self.assertTrue(emr.scaling_in_progress())
+        emr.refresh_cluster_snapshot()
+        self.assertFalse(emr.scaling_in_progress())
+        self.assertEqual(mock_get_task_instance_group.call_count, 2)
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
+    def test_demand_scaling_sizes_group_for_pending_containers(self, mock_get_task_instance_group, mock_emr):
+        mock_get_task_instance_group.return_value = [
+            {
+                "Id": self.emr_task_instance_group_id,
+                "RequestedInstanceCount": 2,
+                "BidPrice": 1.2,
+                "Name": self.emr_task_instance_group_name,
+                "InstanceType": "m5.xlarge"
+            }
+        ]
+        Emr(job_flow_id=self.job_flow,
+            max_instances=20,
+            region="eu-west-1",
+            scale_up_mode="DEMAND",
+            container_memory_mb=3072).scale(direction=1, metrics=MetricSnapshot(container_pending=30))
+
+        # m5.xlarge fits 4 containers of 3 GiB, 30 pending containers need 8 more instances.
+        mock_emr.return_value.modify_instance_groups.assert_called_with(InstanceGroups=[
+            {
+                "InstanceGroupId": self.emr_task_instance_group_id,
+                "InstanceCount": 10
+            }
+        ])
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
+    def test_demand_scaling_is_clamped_to_max_instances(self, mock_get_task_instance_group, mock_emr):
+        mock_get_task_instance_group.return_value = [
+            {
+                "Id": self.emr_task_instance_group_id,
+                "RequestedInstanceCount": 19,
+                "BidPrice": 1.2,
+                "Name": self.emr_task_instance_group_name,
+                "InstanceType": "m5.xlarge"
+            }
+        ]
+        Emr(job_flow_id=self.job_flow,
+            max_instances=20,
+            region="eu-west-1",
+            scale_up_mode="DEMAND").scale(direction=1, metrics=MetricSnapshot(container_pending=1000))
+
+        mock_emr.return_value.modify_instance_groups.assert_called_with(InstanceGroups=[
+            {
+                "InstanceGroupId": self.emr_task_instance_group_id,
+                "InstanceCount": 20
+            }
+        ])
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
+    def test_distributes_demand_across_groups_in_one_call(self, mock_get_task_instance_group, mock_emr):
+        mock_get_task_instance_group.return_value = [
+            {
+                "Id": "cheap",
+                "RequestedInstanceCount": 7,
+                "BidPrice": 1.2,
+                "Name": self.emr_task_instance_group_name,
+                "InstanceType": "m5.xlarge"
+            },
+            {
+                "Id": "expensive",
+                "RequestedInstanceCount": 2,
+                "BidPrice": 1.5,
+                "Name": self.emr_task_instance_group_name,
+                "InstanceType": "m5.xlarge"
+            }
+        ]
+        Emr(job_flow_id=self.job_flow,
+            max_instances=10,
+            region="eu-west-1",
+            scale_up_mode="DEMAND",
+            container_memory_mb=3072).scale(direction=1, metrics=MetricSnapshot(container_pending=20))
+
+        # 20 pending containers need 5 m5.xlarge, the cheap group delivers more per dollar but only fits 3.
+        mock_emr.return_value.modify_instance_groups.assert_called_once_with(InstanceGroups=[
+            {"InstanceGroupId": "cheap", "InstanceCount": 10},
+            {"InstanceGroupId": "expensive", "InstanceCount": 4}
+        ])
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
+    def test_only_groups_at_their_bound_are_logged(self, mock_get_task_instance_group, mock_emr):
+        mock_get_task_instance_group.return_value = [
+            {
+                "Id": group_id,
+                "RequestedInstanceCount": count,
+                "BidPrice": 1.2,
+                "Name": group_id,
+                "InstanceType": "m5.xlarge"
+            }
+            for group_id, count in [("a", 5), ("b", 5), ("full", 20)]
+        ]
+        with self.assertLogs("EMR", level="INFO") as logs:
+            Emr(job_flow_id=self.job_flow, max_instances=20, region="eu-west-1").get_scale_targets(1)
+
+        # The 20% step of 6 instances is taken by the first group, only the full group can not move.
+        bound_messages = [message for message in logs.output if "can not move further" in message]
+        self.assertEqual(len(bound_messages), 1)
+        self.assertIn("[full", bound_messages[0])
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
+    def test_scale_targets_are_computed_once_per_snapshot(self, mock_get_task_instance_group, mock_emr):
+        mock_get_task_instance_group.return_value = [
+            {
+                "Id": "a",
+                "RequestedInstanceCount": 5,
+                "BidPrice": 1.2,
+                "Name": "a",
+                "InstanceType": "m5.xlarge"
+            }
+        ]
+        emr = Emr(job_flow_id=self.job_flow, region="eu-west-1")
+        with patch.object(emr, "get_scale_targets", wraps=emr.get_scale_targets) as get_scale_targets:
+            self.assertTrue(emr.can_scale(1))
+            self.assertTrue(emr.can_scale(-1))
+            emr.scale(1)
+            self.assertEqual(get_scale_targets.call_count, 2)
+            emr.refresh_cluster_snapshot()
+            self.assertTrue(emr.can_scale(1))
+            self.assertEqual(get_scale_targets.call_count, 3)
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
+    def test_scales_down_every_group_within_bounds(self, mock_get_task_instance_group, mock_emr):
+        mock_get_task_instance_group.return_value = [
+            {
+                "Id": "cheap",
+                "RequestedInstanceCount": 10,
+                "BidPrice": 1.2,
+                "Name": self.emr_task_instance_group_name,
+                "InstanceType": "m5.xlarge"
+            },
+            {
+                "Id": "expensive",
+                "RequestedInstanceCount": 3,
+                "BidPrice": 1.5,
+                "Name": self.emr_task_instance_group_name,
+                "InstanceType": "m5.xlarge"
+            }
+        ]
+        Emr(job_flow_id=self.job_flow, min_instances=2, region="eu-west-1").scale(direction=-1)
+
+        # Both groups shrink by 20%, 3 instances in total, the expensive group can only give up 1.
+        mock_emr.return_value.modify_instance_groups.assert_called_once_with(InstanceGroups=[
+            {"InstanceGroupId": "expensive", "InstanceCount": 2},
+            {"InstanceGroupId": "cheap", "InstanceCount": 8}
+        ])
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
+    def test_ranks_groups_by_capacity_per_dollar(self, mock_get_task_instance_group, mock_emr):
+        mock_get_task_instance_group.return_value = [
+            {"Id": "big", "RequestedInstanceCount": 2, "BidPrice": "0.5", "Name": "big", "InstanceType": "m5.4xlarge"},
+            {"Id": "small", "RequestedInstanceCount": 10, "BidPrice": "0.1", "Name": "small",
+             "InstanceType": "m5.xlarge"}
+        ]
+        emr = Emr(job_flow_id=self.job_flow, max_instances=12, region="eu-west-1")
+        emr.scale(direction=1)
+
+        # An m5.xlarge delivers 4 containers for 0.1 (40 per dollar), an m5.4xlarge 16 for 0.5 (32 per dollar).
+        # The steps of both groups add up to 2 * 4 + 1 * 16 = 24 containers, the small group only fits 8 of them.
+        mock_emr.return_value.modify_instance_groups.assert_called_with(InstanceGroups=[
+            {"InstanceGroupId": "small", "InstanceCount": 12},
+            {"InstanceGroupId": "big", "InstanceCount": 3}
+        ])
+
+        emr.scale(direction=-1)
+        # Scaling down drains the least efficient group first: 2 * 4 + 1 * 16 = 24 containers, one big instance
+        # and two small ones.
+        mock_emr.return_value.modify_instance_groups.assert_called_with(InstanceGroups=[
+            {"InstanceGroupId": "big", "InstanceCount": 1},
+            {"InstanceGroupId": "small", "InstanceCount": 8}
+        ])
+
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
+    def test_orders_bid_prices_numerically(self, mock_get_task_instance_group):
+        mock_get_task_instance_group.return_value = [
+            {"Id": "on-demand-price", "BidPrice": "OnDemandPrice"},
+            {"Id": "nine", "BidPrice": "9.5"},
+            {"Id": "ten", "BidPrice": "10.0"}
+        ]
+        groups = Emr(job_flow_id=self.job_flow, region="eu-west-1").cluster_snapshot.groups_by_bid_price()
+        self.assertEqual([g["Id"] for g in groups], ["ten", "nine", "on-demand-price"])
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.iter_task_instance_groups")
+    def test_scales_down_unallocated_memory_in_one_step(self, mock_get_task_instance_group, mock_emr):
+        mock_get_task_instance_group.return_value = [
+            {"Id": "idle", "RequestedInstanceCount": 50, "BidPrice": "0.1", "Name": "idle", "InstanceType": "m5.xlarge"}
+        ]
+        # 50 m5.xlarge offer 50 * 12288 MB, of which 10% are allocated. At a threshold of 0.5 the allocated
+        # 61440 MB need 122880 MB, i.e. 10 instances.
+        metrics = MetricSnapshot(memory_allocated_mb=61440.0, memory_total_mb=614400.0)
+        Emr(job_flow_id=self.job_flow, region="eu-west-1", scale_down_mode="DEMAND").scale(
+            direction=-1, metrics=metrics, threshold=0.5
+        )
+        mock_emr.return_value.modify_instance_groups.assert_called_with(InstanceGroups=[
+            {"InstanceGroupId": "idle", "InstanceCount": 10}
+        ])
+
+        Emr(job_flow_id=self.job_flow, region="eu-west-1", scale_down_mode="DEMAND", max_removal_per_cycle=15).scale(
+            direction=-1, metrics=metrics, threshold=0.5
+        )
+        mock_emr.return_value.modify_instance_groups.assert_called_with(InstanceGroups=[
+            {"InstanceGroupId": "idle", "InstanceCount": 35}
+        ])
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
     def test_is_termination_protected_True(self, mock_emr):
         mock_describe_cluster = mock_emr.return_value.describe_cluster
         mock_describe_cluster.return_value = {
@@ -392,7 +653,7 @@ class EmrTest(TestCase):
         }
         self.assertTrue(Emr(job_flow_id=self.job_flow).is_termination_protected())
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
     def test_is_termination_protected_False(self, mock_emr):
         mock_describe_cluster = mock_emr.return_value.describe_cluster
         mock_describe_cluster.return_value = {
@@ -402,5 +663,53 @@ class EmrTest(TestCase):
         }
         self.assertFalse(Emr(job_flow_id=self.job_flow).is_termination_protected())
 
-def test_is_target_already_reached(self):
-    self.assertFalse(Emr.is_target_count_not_reached(0, 0))
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
+    def test_cluster_description_is_cached_across_instances(self, mock_emr):
+        mock_describe_cluster = mock_emr.return_value.describe_cluster
+        mock_describe_cluster.return_value = {
+            "Cluster": {
+                "TerminationProtected": True
+            }
+        }
+        self.assertTrue(Emr(job_flow_id=self.job_flow).is_termination_protected())
+        self.assertTrue(Emr(job_flow_id=self.job_flow).is_termination_protected())
+        mock_describe_cluster.assert_called_once_with(ClusterId=self.job_flow)
+
+
+class MemoryWindowTest(TestCase):
+
+    def setUp(self):
+        clients.clear_clients()
+        self.cloudwatch = LocalCloudWatch()
+        clients.register_client("cloudwatch", self.cloudwatch)
+        now = datetime.utcnow().replace(second = 0, microsecond = 0)
+        # Memory was released over the last 15 minutes, the busy hour before is outside the window.
+        for minutes_ago, allocated in [(2, 10.0), (7, 20.0), (12, 30.0), (40, 95.0)]:
+            self.cloudwatch.put_datapoint("j-1", "MemoryAllocatedMB", allocated, now - timedelta(minutes = minutes_ago))
+            self.cloudwatch.put_datapoint("j-1", "MemoryTotalMB", 100.0, now - timedelta(minutes = minutes_ago))
+        self.cloudwatch.put_datapoint("j-1", "ContainerPending", 0.0, now - timedelta(minutes = 2))
+
+    def memory_used_ratio(self, aggregation):
+        emr = Emr(job_flow_id = "j-1", memory_window = MemoryWindow(minutes = 15, period = 300,
+                                                                    aggregation = aggregation))
+        return emr.get_metric_snapshot().memory_used_ratio
+
+    def test_aggregates_datapoints_within_window(self):
+        self.assertAlmostEqual(self.memory_used_ratio("mean"), 0.2)
+        self.assertAlmostEqual(self.memory_used_ratio("max"), 0.3)
+        self.assertAlmostEqual(self.memory_used_ratio("p90"), 0.3)
+        self.assertAlmostEqual(self.memory_used_ratio("latest"), 0.1)
+
+    def test_ignores_container_pending_older_than_five_minutes(self):
+        self.cloudwatch.datapoints.clear()
+        now = datetime.utcnow().replace(second = 0, microsecond = 0)
+        self.cloudwatch.put_datapoint("j-1", "ContainerPending", 4.0, now - timedelta(minutes = 30))
+        snapshot = Emr(job_flow_id = "j-1").get_metric_snapshot()
+        self.assertIsNone(snapshot.container_pending)
+        self.assertIsNone(snapshot.memory_allocated_mb)
+        self.assertIsNone(snapshot.memory_used_ratio)
+
+    def test_hourly_average_uses_single_datapoint(self):
+        snapshot = Emr(job_flow_id = "j-1").get_metric_snapshot()
+        self.assertIsNone(snapshot.memory_ratio)
+        self.assertAlmostEqual(snapshot.memory_used_ratio, 38.75 / 100.0)
@@ -0,0 +1,95 @@
+from app import scaler_lambda
+from app.emr_autoscaling import clients
+from app.emr_autoscaling.constants import DEMAND, DOWN, ON_DEMAND, UP
+from app.emr_autoscaling.emr import MetricSnapshot
+from app.emr_autoscaling.fleet import EmrFleet
+from tests.local import LocalCloudWatch, LocalEmr
+from unittest import TestCase
+
+
+class EmrFleetTest(TestCase):
+
+    def setUp(self):
+        clients.clear_clients()
+        self.emr = LocalEmr()
+        self.cloudwatch = LocalCloudWatch()
+        clients.register_client("emr", self.emr)
+        clients.register_client("cloudwatch", self.cloudwatch)
+        self.emr.add_cluster("j-fleet")
+        self.emr.add_instance_fleet("j-fleet", target_on_demand_capacity=1, instance_fleet_type="MASTER")
+        self.fleet_id = self.emr.add_instance_fleet(
+            "j-fleet", target_spot_capacity=16, target_on_demand_capacity=4,
+            instance_type_weights={"m5.xlarge": 4, "m5.2xlarge": 8}
+        )
+
+    def tearDown(self):
+        clients.clear_clients()
+
+    def fleet(self):
+        return self.emr.instance_fleet(self.fleet_id)
+
+    def test_scales_up_spot_capacity_in_weighted_units(self):
+        EmrFleet(job_flow_id="j-fleet", max_instances=40).scale(UP)
+        self.assertEqual(self.fleet()["TargetSpotCapacity"], 20)
+        self.assertEqual(self.fleet()["TargetOnDemandCapacity"], 4)
+
+    def test_scales_down_on_demand_capacity_when_configured(self):
+        EmrFleet(job_flow_id="j-fleet", market=ON_DEMAND).scale(DOWN)
+        self.assertEqual(self.fleet()["TargetOnDemandCapacity"], 0)
+        self.assertEqual(self.fleet()["TargetSpotCapacity"], 16)
+
+    def test_keeps_total_capacity_within_bounds(self):
+        emr = EmrFleet(job_flow_id="j-fleet", min_instances=18, max_instances=22)
+        emr.scale(UP)
+        self.assertEqual(self.fleet()["TargetSpotCapacity"], 18)
+        self.emr.settle()
+        emr.refresh_cluster_snapshot()
+        self.assertFalse(emr.can_scale(UP))
+        emr.scale(DOWN)
+        self.assertEqual(self.fleet()["TargetSpotCapacity"], 14)
+
+    def test_does_not_scale_down_a_fleet_above_its_max_when_scaling_up(self):
+        emr = EmrFleet(job_flow_id="j-fleet", max_instances=10)
+        self.assertFalse(emr.can_scale(UP))
+        self.assertEqual(emr.scale(UP), [])
+        self.assertEqual(self.fleet()["TargetSpotCapacity"], 16)
+
+    def test_does_not_scale_up_a_fleet_below_its_min_when_scaling_down(self):
+        emr = EmrFleet(job_flow_id="j-fleet", min_instances=30, max_instances=40)
+        self.assertFalse(emr.can_scale(DOWN))
+        self.assertEqual(emr.scale(DOWN), [])
+        self.assertEqual(self.fleet()["TargetSpotCapacity"], 16)
+
+    def test_sizes_demand_for_the_smallest_containers_per_unit(self):
+        # m5.xlarge fits 4 one-vcore containers in 4 units, m5.2xlarge 8 in 8 units: one container per unit.
+        EmrFleet(job_flow_id="j-fleet", max_instances=40, scale_up_mode=DEMAND).scale(
+            UP, MetricSnapshot(container_pending=10.0)
+        )
+        self.assertEqual(self.fleet()["TargetSpotCapacity"], 26)
+
+    def test_reports_scaling_in_progress_until_capacity_is_provisioned(self):
+        emr = EmrFleet(job_flow_id="j-fleet", max_instances=40)
+        self.assertFalse(emr.scaling_in_progress())
+        emr.scale(UP)
+        self.assertTrue(emr.refresh_cluster_snapshot().scaling_in_progress())
+        self.emr.settle()
+        self.assertFalse(emr.refresh_cluster_snapshot().scaling_in_progress())
+
+    def test_ignores_provisioned_capacity_above_target(self):
+        fleet = self.fleet()
+        fleet["ProvisionedSpotCapacity"] = 24
+        self.assertFalse(EmrFleet(job_flow_id="j-fleet").scaling_in_progress())
+
+    def test_lambda_selects_fleet_backend(self):
+        scaler = scaler_lambda.create_scaler({
+            "JobFlowId": "j-fleet",
+            "MinInstances": "0",
+            "MaxInstances": "40",
+            "OfficeHoursStart": "7",
+            "OfficeHoursEnd": "18",
+            "ShutdownTime": "23",
+            "InstanceCollectionType": "INSTANCE_FLEET",
+            "FleetMarket": "on_demand"
+        })
+        self.assertIsInstance(scaler.emr, EmrFleet)
+        self.assertEqual(scaler.emr.market, ON_DEMAND)
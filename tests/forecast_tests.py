@@ -0,0 +1,76 @@
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+from app.emr_autoscaling import clients
+from app.emr_autoscaling.constants import DEMAND, UP
+from app.emr_autoscaling.emr import Emr, MetricSnapshot
+from app.emr_autoscaling.forecast import SeasonalForecast
+from app.emr_autoscaling.scaler import EmrScaler
+from mock import patch
+from tests.local import LocalCloudWatch, LocalEmr
+from unittest import TestCase
+
+
+# Monday 06:45 in Berlin (CEST).
+NOW = datetime(2026, 10, 19, 4, 45)
+
+
+class SeasonalForecastTest(TestCase):
+
+    def setUp(self):
+        clients.clear_clients()
+        self.cache_dir = tempfile.mkdtemp()
+        self.emr = LocalEmr()
+        self.cloudwatch = LocalCloudWatch()
+        clients.register_client("emr", self.emr)
+        clients.register_client("cloudwatch", self.cloudwatch)
+        self.emr.add_cluster("j-wave")
+        self.group_id = self.emr.add_instance_group("j-wave", instance_count=2)
+        # The 07:00 wave of the last four Mondays, one of them an outlier.
+        for weeks_ago, pending in enumerate([40.0, 50.0, 60.0, 1000.0], start=1):
+            self.cloudwatch.put_datapoint("j-wave", "ContainerPending", pending,
+                                          datetime(2026, 10, 19, 5, 10) - timedelta(weeks=weeks_ago))
+        self.cloudwatch.put_datapoint("j-wave", "ContainerPending", 0.0, datetime(2026, 10, 18, 12))
+
+    def tearDown(self):
+        clients.clear_clients()
+        shutil.rmtree(self.cache_dir)
+
+    def forecast(self, emr=None, now=NOW):
+        return SeasonalForecast(emr or Emr(job_flow_id="j-wave"), cache_dir=self.cache_dir, clock=lambda: now)
+
+    def test_predicts_median_demand_of_the_upcoming_local_hour(self):
+        forecast = self.forecast()
+        self.assertEqual(forecast.predicted_pending(), 55.0)
+        self.assertEqual(forecast.predicted_pending(NOW - timedelta(hours=1)), 0.0)
+        self.assertEqual(forecast.peak_ahead(datetime(2026, 10, 18, 11, 45)), 0)
+
+    def test_reuses_cached_profile(self):
+        self.forecast().predicted_pending()
+        self.cloudwatch.reset_calls()
+        self.assertEqual(self.forecast().predicted_pending(), 55.0)
+        self.assertEqual(self.cloudwatch.calls, [])
+
+    def test_relearns_stale_profile(self):
+        self.forecast().predicted_pending()
+        self.cloudwatch.reset_calls()
+        self.forecast(now=NOW + timedelta(hours=25)).profile
+        self.assertEqual([call.operation for call in self.cloudwatch.calls], ["GetMetricData"])
+
+    def test_scales_up_ahead_of_forecast_peak(self):
+        self.cloudwatch.put_datapoint("j-wave", "ContainerPending", 0.0)
+        self.cloudwatch.put_datapoint("j-wave", "MemoryAllocatedMB", 90.0)
+        self.cloudwatch.put_datapoint("j-wave", "MemoryTotalMB", 100.0)
+        emr = Emr(job_flow_id="j-wave", scale_up_mode=DEMAND)
+        scaler = EmrScaler(emr, forecast=self.forecast(emr))
+        self.assertEqual(scaler.maybe_scale(0.7), UP)
+        # m5.xlarge fits four containers, so 55 forecast containers need 14 more instances.
+        self.assertEqual(self.emr.instance_group(self.group_id)["RequestedInstanceCount"], 16)
+
+    def test_does_not_scale_down_ahead_of_forecast_peak(self):
+        emr = Emr(job_flow_id="j-wave")
+        scaler = EmrScaler(emr, forecast=self.forecast(emr))
+        with patch.object(scaler, "is_in_office_hours", return_value=False):
+            self.assertFalse(scaler.should_scale_down(0.7, MetricSnapshot(memory_allocated_mb=10.0,
+                                                                          memory_total_mb=100.0)))
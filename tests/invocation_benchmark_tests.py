@@ -0,0 +1,27 @@
+from benchmarks import invocation_benchmark
+from unittest import TestCase
+
+
+class InvocationBenchmarkTest(TestCase):
+
+    def setUp(self):
+        self.reports = {r["scenario"]: r for r in invocation_benchmark.benchmark(iterations=1)}
+
+    def test_scenario_outcomes(self):
+        self.assertEqual(self.reports["scale_up"]["result"]["Scaled"], "UP")
+        self.assertEqual(self.reports["scale_down"]["result"]["Scaled"], "DOWN")
+        self.assertIsNone(self.reports["office_hours"]["result"]["Scaled"])
+        self.assertIsNone(self.reports["in_progress"]["result"]["Scaled"])
+        self.assertTrue(self.reports["shutdown"]["result"]["ShutDown"])
+
+    def test_api_calls_per_invocation(self):
+        self.assertEqual(
+            {name: report["operations"] for name, report in self.reports.items()},
+            {
+                "scale_up": {"ListInstanceGroups": 1, "GetMetricData": 1, "ModifyInstanceGroups": 1},
+                "scale_down": {"ListInstanceGroups": 1, "GetMetricData": 1, "ModifyInstanceGroups": 1},
+                "office_hours": {"ListInstanceGroups": 1, "GetMetricData": 1},
+                "in_progress": {"ListInstanceGroups": 1},
+                "shutdown": {"DescribeCluster": 1, "DeleteStack": 1, "ListInstanceGroups": 1, "GetMetricData": 1}
+            }
+        )
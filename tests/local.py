@@ -0,0 +1,369 @@
+import copy
+import json
+import math
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from functools import wraps
+from itertools import count
+from threading import RLock
+
+from botocore.exceptions import ClientError
+
+from app.emr_autoscaling import clients
+from app.emr_autoscaling.tracing import operation_name
+
+ApiCall = namedtuple("ApiCall", ["service", "operation", "request_bytes", "response_bytes", "seconds"])
+
+
+def _payload_size(payload):
+    return len(json.dumps(payload, default=str))
+
+
+def api_call(method):
+    @wraps(method)
+    def wrapper(self, **request):
+        started = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        response = method(self, **request)
+        self.record(ApiCall(self.service, operation_name(method.__name__), _payload_size(request),
+                            _payload_size(response), time.perf_counter() - started))
+        return response
+
+    return wrapper
+
+
+class LocalService:
+    service = None
+
+    def __init__(self, latency=0.0):
+        # Seconds every API call is delayed by, to mimic the round trip to AWS.
+        self.latency = latency
+        self.calls = []
+        self._calls_lock = RLock()
+
+    def record(self, call):
+        with self._calls_lock:
+            self.calls.append(call)
+
+    def reset_calls(self):
+        with self._calls_lock:
+            self.calls = []
+
+
+def _client_error(code, message, operation_name):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation_name)
+
+
+def _utc_minute():
+    return datetime.utcnow().replace(second=0, microsecond=0)
+
+
+class LocalEmr(LocalService):
+    service = "emr"
+
+    def __init__(self, page_size=50, latency=0.0):
+        super().__init__(latency)
+        self.page_size = page_size
+        self.clusters = {}
+        self._group_ids = count(1)
+        self._lock = RLock()
+
+    def add_cluster(self, cluster_id, termination_protected=False, **attributes):
+        cluster = {
+            "Id": cluster_id,
+            "Name": cluster_id,
+            "Status": {"State": "WAITING"},
+            "TerminationProtected": termination_protected,
+            "InstanceCollectionType": "INSTANCE_GROUP"
+        }
+        cluster.update(attributes)
+        with self._lock:
+            self.clusters[cluster_id] = {"Cluster": cluster, "InstanceGroups": [], "InstanceFleets": []}
+        return cluster
+
+    def add_instance_group(self, cluster_id, instance_count=0, bid_price="0.5", instance_group_type="TASK",
+                           instance_type="m5.xlarge", name=None, running_instance_count=None):
+        group_id = "ig-{:013d}".format(next(self._group_ids))
+        group = {
+            "Id": group_id,
+            "Name": name or group_id,
+            "InstanceGroupType": instance_group_type,
+            "Market": "SPOT" if bid_price is not None else "ON_DEMAND",
+            "InstanceType": instance_type,
+            "RequestedInstanceCount": instance_count,
+            "RunningInstanceCount": instance_count if running_instance_count is None else running_instance_count,
+            "Status": {"State": "RUNNING"}
+        }
+        if bid_price is not None:
+            group["BidPrice"] = bid_price
+        with self._lock:
+            self._cluster(cluster_id, "AddInstanceGroups")["InstanceGroups"].append(group)
+        return group_id
+
+    def add_instance_fleet(self, cluster_id, target_spot_capacity=0, target_on_demand_capacity=0,
+                           instance_type_weights=None, instance_fleet_type="TASK", name=None,
+                           provisioned_spot_capacity=None, provisioned_on_demand_capacity=None):
+        fleet_id = "if-{:013d}".format(next(self._group_ids))
+        fleet = {
+            "Id": fleet_id,
+            "Name": name or fleet_id,
+            "InstanceFleetType": instance_fleet_type,
+            "TargetSpotCapacity": target_spot_capacity,
+            "TargetOnDemandCapacity": target_on_demand_capacity,
+            "ProvisionedSpotCapacity": target_spot_capacity if provisioned_spot_capacity is None
+            else provisioned_spot_capacity,
+            "ProvisionedOnDemandCapacity": target_on_demand_capacity if provisioned_on_demand_capacity is None
+            else provisioned_on_demand_capacity,
+            "InstanceTypeSpecifications": [
+                {"InstanceType": instance_type, "WeightedCapacity": weight}
+                for instance_type, weight in sorted((instance_type_weights or {"m5.xlarge": 1}).items())
+            ],
+            "Status": {"State": "RUNNING"}
+        }
+        with self._lock:
+            cluster = self._cluster(cluster_id, "AddInstanceFleet")
+            cluster["Cluster"]["InstanceCollectionType"] = "INSTANCE_FLEET"
+            cluster["InstanceFleets"].append(fleet)
+        return fleet_id
+
+    def instance_fleet(self, fleet_id):
+        with self._lock:
+            for cluster in self.clusters.values():
+                for fleet in cluster["InstanceFleets"]:
+                    if fleet["Id"] == fleet_id:
+                        return fleet
+        raise _client_error("InvalidRequestException", "Instance fleet %s not found." % fleet_id,
+                            "ModifyInstanceFleet")
+
+    def instance_group(self, group_id):
+        with self._lock:
+            for cluster in self.clusters.values():
+                for group in cluster["InstanceGroups"]:
+                    if group["Id"] == group_id:
+                        return group
+        raise _client_error("InvalidRequestException", "Instance group %s not found." % group_id,
+                            "ModifyInstanceGroups")
+
+    def settle(self, cluster_id=None):
+        with self._lock:
+            for key, cluster in self.clusters.items():
+                if cluster_id in (None, key):
+                    for group in cluster["InstanceGroups"]:
+                        group["RunningInstanceCount"] = group["RequestedInstanceCount"]
+                        group["Status"] = {"State": "RUNNING"}
+                    for fleet in cluster["InstanceFleets"]:
+                        fleet["ProvisionedSpotCapacity"] = fleet["TargetSpotCapacity"]
+                        fleet["ProvisionedOnDemandCapacity"] = fleet["TargetOnDemandCapacity"]
+                        fleet["Status"] = {"State": "RUNNING"}
+
+    def _cluster(self, cluster_id, operation_name):
+        if cluster_id not in self.clusters:
+            raise _client_error("InvalidRequestException", "Cluster id '%s' is not valid." % cluster_id,
+                                operation_name)
+        return self.clusters[cluster_id]
+
+    @api_call
+    def list_instance_groups(self, ClusterId, Marker=None):
+        with self._lock:
+            groups = self._cluster(ClusterId, "ListInstanceGroups")["InstanceGroups"]
+            start = int(Marker or 0)
+            response = {"InstanceGroups": copy.deepcopy(groups[start:start + self.page_size])}
+            if start + self.page_size < len(groups):
+                response["Marker"] = str(start + self.page_size)
+            return response
+
+    @api_call
+    def list_instance_fleets(self, ClusterId, Marker=None):
+        with self._lock:
+            fleets = self._cluster(ClusterId, "ListInstanceFleets")["InstanceFleets"]
+            start = int(Marker or 0)
+            response = {"InstanceFleets": copy.deepcopy(fleets[start:start + self.page_size])}
+            if start + self.page_size < len(fleets):
+                response["Marker"] = str(start + self.page_size)
+            return response
+
+    @api_call
+    def describe_cluster(self, ClusterId):
+        with self._lock:
+            return {"Cluster": copy.deepcopy(self._cluster(ClusterId, "DescribeCluster")["Cluster"])}
+
+    @api_call
+    def modify_instance_groups(self, ClusterId=None, InstanceGroups=()):
+        with self._lock:
+            for modification in InstanceGroups:
+                group = self.instance_group(modification["InstanceGroupId"])
+                group["RequestedInstanceCount"] = modification["InstanceCount"]
+                if group["RequestedInstanceCount"] != group["RunningInstanceCount"]:
+                    group["Status"] = {"State": "RESIZING"}
+        return {}
+
+    @api_call
+    def modify_instance_fleet(self, ClusterId, InstanceFleet):
+        with self._lock:
+            self._cluster(ClusterId, "ModifyInstanceFleet")
+            fleet = self.instance_fleet(InstanceFleet["InstanceFleetId"])
+            for key in ("TargetSpotCapacity", "TargetOnDemandCapacity"):
+                if key in InstanceFleet:
+                    fleet[key] = InstanceFleet[key]
+            fleet["Status"] = {"State": "RESIZING"}
+        return {}
+
+
+class LocalCloudWatch(LocalService):
+    service = "cloudwatch"
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.datapoints = defaultdict(list)
+        self._lock = RLock()
+
+    def put_datapoint(self, job_flow_id, metric_name, value, timestamp=None):
+        # CloudWatch only reports a minute once it is over, so the default is the last complete minute.
+        timestamp = timestamp or _utc_minute() - timedelta(minutes=1)
+        with self._lock:
+            self.datapoints[(job_flow_id, metric_name)].append((timestamp, value))
+
+    def _values(self, metric, start_time, end_time):
+        job_flow_id = next(
+            (d["Value"] for d in metric.get("Dimensions", []) if d["Name"] == "JobFlowId"), None
+        )
+        with self._lock:
+            return [
+                (timestamp, value) for timestamp, value in self.datapoints[(job_flow_id, metric["MetricName"])]
+                if start_time <= timestamp < end_time
+            ]
+
+    @staticmethod
+    def _aggregate(values, stat):
+        if stat == "Average":
+            return sum(values) / len(values)
+        if stat == "Maximum":
+            return max(values)
+        if stat == "Minimum":
+            return min(values)
+        if stat == "Sum":
+            return sum(values)
+        if stat == "SampleCount":
+            return float(len(values))
+        if stat.startswith("p"):
+            ordered = sorted(values)
+            return ordered[max(0, int(math.ceil(float(stat[1:]) / 100 * len(ordered))) - 1)]
+        raise _client_error("InvalidParameterValue", "Unsupported statistic %s." % stat, "GetMetricData")
+
+    def _buckets(self, metric, start_time, end_time, period, stat):
+        buckets = defaultdict(list)
+        for timestamp, value in self._values(metric, start_time, end_time):
+            offset = int((timestamp - start_time).total_seconds()) // period * period
+            buckets[start_time + timedelta(seconds=offset)].append(value)
+        return [(timestamp, self._aggregate(values, stat)) for timestamp, values in sorted(buckets.items())]
+
+    @api_call
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime, ScanBy="TimestampDescending", **kwargs):
+        results = []
+        for query in MetricDataQueries:
+            metric_stat = query["MetricStat"]
+            buckets = self._buckets(metric_stat["Metric"], StartTime, EndTime, metric_stat["Period"],
+                                    metric_stat["Stat"])
+            if ScanBy == "TimestampDescending":
+                buckets.reverse()
+            results.append({
+                "Id": query["Id"],
+                "Label": metric_stat["Metric"]["MetricName"],
+                "Timestamps": [timestamp for timestamp, _ in buckets],
+                "Values": [value for _, value in buckets],
+                "StatusCode": "Complete"
+            })
+        return {"MetricDataResults": results}
+
+
+class LocalCloudFormation(LocalService):
+    service = "cloudformation"
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.stacks = {}
+        self._lock = RLock()
+
+    def add_stack(self, stack_name):
+        with self._lock:
+            self.stacks[stack_name] = {"StackName": stack_name, "StackStatus": "CREATE_COMPLETE"}
+
+    @api_call
+    def delete_stack(self, StackName, RoleARN=None):
+        with self._lock:
+            if StackName in self.stacks:
+                self.stacks[StackName]["StackStatus"] = "DELETE_IN_PROGRESS"
+        return {}
+
+
+class LocalDynamoDb(LocalService):
+    service = "dynamodb"
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.tables = {}
+        self._lock = RLock()
+
+    def add_table(self, table_name, key_names=("ClusterId", "GroupId")):
+        with self._lock:
+            self.tables[table_name] = {"KeyNames": key_names, "Items": {}}
+
+    def _table(self, table_name, operation_name):
+        if table_name not in self.tables:
+            raise _client_error("ResourceNotFoundException", "Requested resource not found", operation_name)
+        return self.tables[table_name]
+
+    @staticmethod
+    def _key(table, item):
+        return tuple(json.dumps(item[name], sort_keys=True) for name in table["KeyNames"])
+
+    @api_call
+    def get_item(self, TableName, Key, ConsistentRead=False, **kwargs):
+        with self._lock:
+            table = self._table(TableName, "GetItem")
+            item = table["Items"].get(self._key(table, Key))
+            return {"Item": copy.deepcopy(item)} if item is not None else {}
+
+    @api_call
+    def put_item(self, TableName, Item, **kwargs):
+        with self._lock:
+            table = self._table(TableName, "PutItem")
+            table["Items"][self._key(table, Item)] = copy.deepcopy(Item)
+        return {}
+
+    @api_call
+    def batch_write_item(self, RequestItems, **kwargs):
+        with self._lock:
+            for table_name, requests in RequestItems.items():
+                table = self._table(table_name, "BatchWriteItem")
+                for request in requests:
+                    if "PutRequest" in request:
+                        item = request["PutRequest"]["Item"]
+                        table["Items"][self._key(table, item)] = copy.deepcopy(item)
+                    else:
+                        table["Items"].pop(self._key(table, request["DeleteRequest"]["Key"]), None)
+        return {"UnprocessedItems": {}}
+
+
+class LocalAws:
+
+    def __init__(self, latency=0.0, page_size=50):
+        self.emr = LocalEmr(page_size=page_size, latency=latency)
+        self.cloudwatch = LocalCloudWatch(latency=latency)
+        self.cloudformation = LocalCloudFormation(latency=latency)
+        self.dynamodb = LocalDynamoDb(latency=latency)
+        self.services = (self.emr, self.cloudwatch, self.cloudformation, self.dynamodb)
+
+    def register(self, region=None, role=None):
+        for service in self.services:
+            clients.register_client(service.service, service, region, role)
+
+    @property
+    def calls(self):
+        return [call for service in self.services for call in service.calls]
+
+    def reset_calls(self):
+        for service in self.services:
+            service.reset_calls()
@@ -0,0 +1,113 @@
+import json
+import os
+
+from app import scaler_lambda
+from app.emr_autoscaling import clients
+from app.emr_autoscaling.triggers import Deduplicator
+from mock import patch
+from unittest import TestCase
+
+
+MODULE_BASE = "app.emr_autoscaling"
+
+
+class ScalerLambdaTest(TestCase):
+
+    def setUp(self):
+        clients.clear_clients()
+        self.event = {
+            "JobFlowId": "myJobFlow",
+            "Threshold": "0.7",
+            "MinInstances": "0",
+            "MaxInstances": "20",
+            "OfficeHoursStart": "7",
+            "OfficeHoursEnd": "18",
+            "ShutdownTime": "23"
+        }
+
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.maybe_scale")
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.maybe_shutdown")
+    def test_single_cluster_event(self, mock_maybe_shutdown, mock_maybe_scale):
+        mock_maybe_shutdown.return_value = False
+        mock_maybe_scale.return_value = 1
+        result = scaler_lambda.lambda_handler(self.event, None)
+        self.assertEqual(result, {"JobFlowId": "myJobFlow", "Status": "OK", "ShutDown": False, "Scaled": "UP"})
+        mock_maybe_scale.assert_called_once_with(0.7)
+
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.maybe_scale")
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.maybe_shutdown")
+    def test_batch_event_evaluates_every_cluster_with_defaults(self, mock_maybe_shutdown, mock_maybe_scale):
+        mock_maybe_shutdown.return_value = False
+        mock_maybe_scale.return_value = None
+        event = dict(self.event, Clusters=[
+            {"JobFlowId": "j-1"},
+            {"JobFlowId": "j-2", "Threshold": "0.5"}
+        ])
+        del event["JobFlowId"]
+        result = scaler_lambda.lambda_handler(event, None)
+        self.assertEqual(
+            sorted((r["JobFlowId"], r["Status"]) for r in result["Results"]),
+            [("j-1", "OK"), ("j-2", "OK")]
+        )
+        self.assertEqual(sorted(call.args[0] for call in mock_maybe_scale.call_args_list), [0.5, 0.7])
+
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.maybe_scale")
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.maybe_shutdown")
+    def test_batch_event_isolates_failing_clusters(self, mock_maybe_shutdown, mock_maybe_scale):
+        mock_maybe_shutdown.return_value = False
+        mock_maybe_scale.return_value = -1
+        event = {
+            "MaxWorkers": 2,
+            "Clusters": [
+                self.event,
+                {"JobFlowId": "j-broken"}
+            ]
+        }
+        results = {r["JobFlowId"]: r for r in scaler_lambda.lambda_handler(event, None)["Results"]}
+        self.assertEqual(results["myJobFlow"]["Scaled"], "DOWN")
+        self.assertEqual(results["j-broken"]["Status"], "FAILED")
+        self.assertEqual(results["j-broken"]["Error"], "KeyError: 'Threshold'")
+
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.maybe_scale")
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.maybe_shutdown")
+    def test_alarm_triggers_deduplicated_evaluation_of_configured_cluster(self, mock_maybe_shutdown,
+                                                                          mock_maybe_scale):
+        mock_maybe_shutdown.return_value = False
+        mock_maybe_scale.return_value = 1
+        config = dict(self.event, Clusters=[{"JobFlowId": "j-1", "Threshold": "0.5"}])
+        del config["JobFlowId"]
+        alarm = {
+            "detail-type": "CloudWatch Alarm State Change",
+            "detail": {
+                "state": {"value": "ALARM"},
+                "configuration": {"metrics": [
+                    {"metricStat": {"metric": {"dimensions": {"JobFlowId": "j-1"}}}},
+                    {"metricStat": {"metric": {"dimensions": {"JobFlowId": "j-unknown"}}}}
+                ]}
+            }
+        }
+        with patch.dict("os.environ", {scaler_lambda.CONFIG_VARIABLE: json.dumps(config)}), \
+                patch.object(scaler_lambda, "TRIGGERS", Deduplicator(60)):
+            first = scaler_lambda.lambda_handler(alarm, None)["Results"]
+            second = scaler_lambda.lambda_handler(alarm, None)["Results"]
+
+        self.assertEqual([(r["JobFlowId"], r["Status"]) for r in first], [("j-1", "OK"), ("j-unknown", "IGNORED")])
+        self.assertEqual(first[0]["Scaled"], "UP")
+        self.assertEqual([r["Status"] for r in second], ["DEDUPLICATED", "IGNORED"])
+        mock_maybe_scale.assert_called_once_with(0.5)
+
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.maybe_scale")
+    def test_alarm_without_config_is_ignored(self, mock_maybe_scale):
+        alarm = {
+            "detail-type": "CloudWatch Alarm State Change",
+            "detail": {
+                "state": {"value": "ALARM"},
+                "configuration": {"metrics": [{"metricStat": {"metric": {"dimensions": {"JobFlowId": "j-1"}}}}]}
+            }
+        }
+        with patch.dict("os.environ"), patch.object(scaler_lambda, "TRIGGERS", Deduplicator(60)):
+            os.environ.pop(scaler_lambda.CONFIG_VARIABLE, None)
+            results = scaler_lambda.lambda_handler(alarm, None)["Results"]
+
+        self.assertEqual(results, [{"JobFlowId": "j-1", "Status": "IGNORED"}])
+        mock_maybe_scale.assert_not_called()
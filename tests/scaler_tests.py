@@ -1,9 +1,11 @@
 from datetime import datetime
 
-from app.emr_autoscaling import utils
-from app.emr_autoscaling.emr import Emr
+from app.emr_autoscaling import clients, emr, utils
+from app.emr_autoscaling.emr import Emr, MetricSnapshot
 from app.emr_autoscaling.scaler import EmrScaler
+from app.pytz import utc
 from mock import patch
+from tests.local import LocalAws
 from unittest import TestCase
 
 
@@ -13,6 +15,7 @@ MODULE_BASE = "app.emr_autoscaling"
 class EmrScalerTest(TestCase):
 
     def setUp(self):
+        clients.clear_clients()
         self.threshold = 0.7
         self.emr = Emr(job_flow_id="myJobFlow", region="eu-west-1")
 
@@ -93,36 +96,45 @@ class EmrScalerTest(TestCase):
         self.assertFalse(EmrScaler(self.emr).is_in_office_hours(datetime(2016, 5, 1, 18)))
         self.assertFalse(EmrScaler(self.emr).is_in_office_hours(datetime(2016, 5, 1, 19)))
 
-    @patch(f"{MODULE_BASE}.emr.Emr.get_pending_containers")
-    def test_should_scale_up_with_pending_containers(self, mock_get_containers):
-        mock_get_containers.return_value = 1
+    def test_should_scale_up_with_pending_containers(self):
+        metrics = MetricSnapshot(container_pending=1, memory_allocated_mb=60.0, memory_total_mb=100.0)
+        self.assertTrue(EmrScaler(self.emr).should_scale_up(metrics))
+
+    def test_should_not_scale_up_without_pending_containers(self):
+        metrics = MetricSnapshot(container_pending=0, memory_allocated_mb=60.0, memory_total_mb=100.0)
+        self.assertFalse(EmrScaler(self.emr).should_scale_up(metrics))
+
+    def test_missing_metrics_neither_scale_up_nor_down(self):
+        metrics = MetricSnapshot(container_pending=None, memory_allocated_mb=10.0, memory_total_mb=100.0)
+        scaler = EmrScaler(self.emr)
+        self.assertFalse(scaler.should_scale_up(metrics))
+        self.assertFalse(scaler.has_no_pending_containers(metrics))
+        self.assertFalse(scaler.should_scale_down(self.threshold, MetricSnapshot(container_pending=0)))
+
+    @patch(f"{MODULE_BASE}.emr.Emr.get_metric_snapshot")
+    def test_should_scale_up_fetches_snapshot_if_none_given(self, mock_get_metric_snapshot):
+        mock_get_metric_snapshot.return_value = MetricSnapshot(container_pending=3, memory_allocated_mb=60.0,
+                                                               memory_total_mb=100.0)
         self.assertTrue(EmrScaler(self.emr).should_scale_up())
+        mock_get_metric_snapshot.assert_called_once_with()
 
-    @patch(f"{MODULE_BASE}.emr.Emr.get_pending_containers")
-    def test_should_not_scale_up_without_pending_containers(self, mock_get_containers):
-        mock_get_containers.return_value = 0
-        self.assertFalse(EmrScaler(self.emr).should_scale_up())
-
-    @patch(f"{MODULE_BASE}.emr.Emr.get_average_of_last_hour")
     @patch(f"{MODULE_BASE}.scaler.EmrScaler.is_in_office_hours")
-    def test_should_scale_down_out_of_office_hours(self, mock_office_hours, mock_get_average):
-        mock_get_average.side_effect = [60.0, 100.0]
+    def test_should_scale_down_out_of_office_hours(self, mock_office_hours):
+        metrics = MetricSnapshot(container_pending=0, memory_allocated_mb=60.0, memory_total_mb=100.0)
         mock_office_hours.return_value = False
-        self.assertTrue(EmrScaler(self.emr).should_scale_down(self.threshold))
+        self.assertTrue(EmrScaler(self.emr).should_scale_down(self.threshold, metrics))
 
-    @patch(f"{MODULE_BASE}.emr.Emr.get_average_of_last_hour")
     @patch(f"{MODULE_BASE}.scaler.EmrScaler.is_in_office_hours")
-    def test_should_not_scale_down_in_office_hours(self, mock_office_hours, mock_get_average):
-        mock_get_average.side_effect = [60.0, 100.0]
+    def test_should_not_scale_down_in_office_hours(self, mock_office_hours):
+        metrics = MetricSnapshot(container_pending=0, memory_allocated_mb=60.0, memory_total_mb=100.0)
         mock_office_hours.return_value = True
-        self.assertFalse(EmrScaler(self.emr).should_scale_down(self.threshold))
+        self.assertFalse(EmrScaler(self.emr).should_scale_down(self.threshold, metrics))
 
-    @patch(f"{MODULE_BASE}.emr.Emr.get_average_of_last_hour")
     @patch(f"{MODULE_BASE}.scaler.EmrScaler.is_in_office_hours")
-    def test_should_not_scale_down_when_memory_ratio_above_threshold(self, mock_office_hours, mock_get_average):
-        mock_get_average.side_effect = [80.0, 100.0]
+    def test_should_not_scale_down_when_memory_ratio_above_threshold(self, mock_office_hours):
+        metrics = MetricSnapshot(container_pending=0, memory_allocated_mb=80.0, memory_total_mb=100.0)
         mock_office_hours.return_value = False
-        self.assertFalse(EmrScaler(self.emr).should_scale_down(self.threshold))
+        self.assertFalse(EmrScaler(self.emr).should_scale_down(self.threshold, metrics))
 
     @patch(f"{MODULE_BASE}.emr.Emr.scale")
     @patch(f"{MODULE_BASE}.emr.Emr.scaling_in_progress")
@@ -131,40 +143,87 @@ class EmrScalerTest(TestCase):
         EmrScaler(self.emr).maybe_scale(0.7)
         mock_scale.assert_not_called
 
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.is_in_office_hours", return_value=False)
+    @patch(f"{MODULE_BASE}.emr.Emr.can_scale", return_value=True)
+    @patch(f"{MODULE_BASE}.emr.Emr.get_metric_snapshot")
     @patch(f"{MODULE_BASE}.scaler.EmrScaler.should_scale_up")
     @patch(f"{MODULE_BASE}.scaler.EmrScaler.should_scale_down")
     @patch(f"{MODULE_BASE}.emr.Emr.scale")
     @patch(f"{MODULE_BASE}.emr.Emr.scaling_in_progress")
-    def test_maybe_scale_up(self, mock_scaling_in_progress, mock_scale, mock_should_scale_down, mock_should_scale_up):
+    def test_maybe_scale_up(self, mock_scaling_in_progress, mock_scale, mock_should_scale_down, mock_should_scale_up,
+                            mock_get_metric_snapshot, mock_can_scale, mock_office_hours):
         mock_scaling_in_progress.return_value = False
         mock_should_scale_down.return_value = False
         mock_should_scale_up.return_value = True
         EmrScaler(self.emr).maybe_scale(0.7)
-        mock_scale.assert_called_with(1)
+        mock_get_metric_snapshot.assert_called_once_with(("container_pending", "memory_allocated_mb", "memory_total_mb"))
+        mock_should_scale_down.assert_not_called()
+        mock_scale.assert_called_with(1, mock_get_metric_snapshot.return_value, self.threshold)
 
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.is_in_office_hours", return_value=False)
+    @patch(f"{MODULE_BASE}.emr.Emr.can_scale", return_value=True)
+    @patch(f"{MODULE_BASE}.emr.Emr.get_metric_snapshot")
     @patch(f"{MODULE_BASE}.scaler.EmrScaler.should_scale_up")
     @patch(f"{MODULE_BASE}.scaler.EmrScaler.should_scale_down")
     @patch(f"{MODULE_BASE}.emr.Emr.scale")
     @patch(f"{MODULE_BASE}.emr.Emr.scaling_in_progress")
-    def test_maybe_scale_down(self, mock_scaling_in_progress, mock_scale, mock_should_scale_down, mock_should_scale_up):
+    def test_maybe_scale_down(self, mock_scaling_in_progress, mock_scale, mock_should_scale_down, mock_should_scale_up,
+                              mock_get_metric_snapshot, mock_can_scale, mock_office_hours):
         mock_scaling_in_progress.return_value = False
         mock_should_scale_down.return_value = True
         mock_should_scale_up.return_value = False
+        mock_get_metric_snapshot.return_value = MetricSnapshot(container_pending=0, memory_allocated_mb=30.0,
+                                                               memory_total_mb=100.0)
         EmrScaler(self.emr).maybe_scale(0.7)
-        mock_scale.assert_called_with(-1)
+        mock_scale.assert_called_with(-1, mock_get_metric_snapshot.return_value, self.threshold)
 
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.is_in_office_hours", return_value=False)
+    @patch(f"{MODULE_BASE}.emr.Emr.can_scale", return_value=True)
+    @patch(f"{MODULE_BASE}.emr.Emr.get_metric_snapshot")
     @patch(f"{MODULE_BASE}.scaler.EmrScaler.should_scale_up")
     @patch(f"{MODULE_BASE}.scaler.EmrScaler.should_scale_down")
     @patch(f"{MODULE_BASE}.emr.Emr.scale")
     @patch(f"{MODULE_BASE}.emr.Emr.scaling_in_progress")
     def test_maybe_dont_scale_because_nothing_to_do(self, mock_scaling_in_progress, mock_scale, mock_should_scale_down,
-                                                    mock_should_scale_up):
+                                                    mock_should_scale_up, mock_get_metric_snapshot, mock_can_scale,
+                                                    mock_office_hours):
         mock_scaling_in_progress.return_value = False
         mock_should_scale_down.return_value = False
         mock_should_scale_up.return_value = False
         EmrScaler(self.emr).maybe_scale(0.7)
         mock_scale.assert_not_called
 
+    @patch(f"{MODULE_BASE}.emr.Emr.get_metric_snapshot")
+    @patch(f"{MODULE_BASE}.emr.Emr.scale")
+    @patch(f"{MODULE_BASE}.emr.Emr.can_scale")
+    @patch(f"{MODULE_BASE}.emr.Emr.scaling_in_progress", return_value=False)
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.is_in_office_hours", return_value=True)
+    def test_maybe_scale_only_fetches_pending_containers_in_office_hours(self, mock_office_hours,
+                                                                          mock_scaling_in_progress, mock_can_scale,
+                                                                          mock_scale, mock_get_metric_snapshot):
+        mock_can_scale.return_value = True
+        mock_get_metric_snapshot.return_value = MetricSnapshot(container_pending=0)
+        self.assertIsNone(EmrScaler(self.emr).maybe_scale(0.7))
+        mock_can_scale.assert_called_once_with(1)
+        mock_get_metric_snapshot.assert_called_once_with(("container_pending",))
+        mock_scale.assert_not_called()
+
+    @patch(f"{MODULE_BASE}.emr.Emr.get_metric_snapshot")
+    @patch(f"{MODULE_BASE}.emr.Emr.scale")
+    @patch(f"{MODULE_BASE}.emr.Emr.can_scale", return_value=False)
+    @patch(f"{MODULE_BASE}.emr.Emr.scaling_in_progress", return_value=False)
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.is_in_office_hours", return_value=True)
+    def test_maybe_scale_skips_metrics_when_no_outcome_is_possible(self, mock_office_hours, mock_scaling_in_progress,
+                                                                    mock_can_scale, mock_scale,
+                                                                    mock_get_metric_snapshot):
+        scaler = EmrScaler(self.emr)
+        evaluation = scaler.evaluation(0.7)
+        self.assertIsNone(evaluation.run())
+        self.assertEqual(evaluation.skipped, ["above min instances", "containers pending", "no containers pending",
+                                               "memory below threshold"])
+        mock_get_metric_snapshot.assert_not_called()
+        mock_scale.assert_not_called()
+
     @patch(f"{MODULE_BASE}.scaler.EmrScaler.shutdown")
     @patch(f"{MODULE_BASE}.scaler.EmrScaler.is_after_shutdown_time")
     def test_do_not_shutdown_if_too_early(self, mock_is_after_shutdown_time, mock_shutdown):
@@ -215,10 +274,76 @@ class EmrScalerTest(TestCase):
         EmrScaler(self.emr, parent_stack="parent").maybe_shutdown()
         mock_shutdown.assert_called()
 
-    @patch(f"{MODULE_BASE}.emr.boto3.client")
+    @patch(f"{MODULE_BASE}.emr.Emr.is_termination_protected")
+    @patch(f"{MODULE_BASE}.scaler.EmrScaler.is_after_shutdown_time")
+    def test_shutdown_path_is_not_evaluated_without_parent_stack(self, mock_is_after_shutdown_time,
+                                                                 mock_is_termination_protected):
+        EmrScaler(self.emr, parent_stack=None).maybe_shutdown()
+        mock_is_after_shutdown_time.assert_not_called()
+        mock_is_termination_protected.assert_not_called()
+
+    @patch(f"{MODULE_BASE}.scaler.get_client")
+    def test_cloud_formation_client_is_created_lazily(self, mock_get_client):
+        scaler = EmrScaler(self.emr, parent_stack="parent")
+        mock_get_client.assert_not_called()
+        scaler.shutdown()
+        scaler.shutdown()
+        mock_get_client.assert_called_once_with('cloudformation', "eu-west-1", None, retries=True)
+
+    @patch(f"{MODULE_BASE}.clients.boto3.client")
     def test_shutdown_deletes_stack(self, mock_client):
         parent_stack = "parent"
         stack_deletion_role = "aws:iam:foo:bar"
         mock_cf = mock_client.return_value.delete_stack
         EmrScaler(self.emr, parent_stack=parent_stack, stack_deletion_role=stack_deletion_role).shutdown()
         mock_cf.assert_called_with(StackName=parent_stack, RoleARN=stack_deletion_role)
+
+
+class PendingContainersTest(TestCase):
+
+    def setUp(self):
+        clients.clear_clients()
+        emr.CLUSTER_DESCRIPTIONS.clear()
+        self.aws = LocalAws()
+        self.aws.emr.add_cluster("j-1")
+        self.group_id = self.aws.emr.add_instance_group("j-1", instance_count=20)
+        self.aws.cloudwatch.put_datapoint("j-1", "ContainerPending", 500.0)
+        self.aws.cloudwatch.put_datapoint("j-1", "MemoryAllocatedMB", 30.0)
+        self.aws.cloudwatch.put_datapoint("j-1", "MemoryTotalMB", 100.0)
+        self.aws.register()
+
+    def tearDown(self):
+        clients.clear_clients()
+
+    def test_pending_containers_block_scale_down_at_max_instances(self):
+        # 23:00 in Berlin on a Wednesday, outside of office hours.
+        now = datetime(2021, 6, 16, 21, 0)
+        scaler = EmrScaler(Emr(job_flow_id="j-1", max_instances=20), max_instances=20,
+                           clock=lambda tz=None: utc.localize(now).astimezone(tz) if tz else now)
+        self.assertIsNone(scaler.maybe_scale(0.7))
+        self.assertEqual(self.aws.emr.instance_group(self.group_id)["RequestedInstanceCount"], 20)
+
+
+class DemandScaleDownTest(TestCase):
+
+    def setUp(self):
+        clients.clear_clients()
+        emr.CLUSTER_DESCRIPTIONS.clear()
+        self.aws = LocalAws()
+        self.aws.emr.add_cluster("j-1")
+        self.group_id = self.aws.emr.add_instance_group("j-1", instance_count=4)
+        # 60% of the YARN memory of 4 m5.xlarge is allocated, less than a node fits below a ratio of 0.7.
+        self.aws.cloudwatch.put_datapoint("j-1", "ContainerPending", 0.0)
+        self.aws.cloudwatch.put_datapoint("j-1", "MemoryAllocatedMB", 29491.0)
+        self.aws.cloudwatch.put_datapoint("j-1", "MemoryTotalMB", 49152.0)
+        self.aws.register()
+
+    def tearDown(self):
+        clients.clear_clients()
+
+    def test_no_removable_node_is_not_reported_as_scaled(self):
+        now = datetime(2021, 6, 16, 21, 0)
+        scaler = EmrScaler(Emr(job_flow_id="j-1", scale_down_mode="DEMAND"),
+                           clock=lambda tz=None: utc.localize(now).astimezone(tz) if tz else now)
+        self.assertIsNone(scaler.maybe_scale(0.7))
+        self.assertEqual(self.aws.emr.instance_group(self.group_id)["RequestedInstanceCount"], 4)
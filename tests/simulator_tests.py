@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+from simulation.simulator import ClusterModel, SimulatedCluster, Trace, compare, load_trace, simulate
+from unittest import TestCase
+
+
+def daily_trace(days, busy_hours=range(7, 10), pending=40.0):
+    # Quiet nights and a burst of pending containers every morning, on core nodes with 24 GB of YARN memory.
+    minutes = range(days * 24 * 60)
+    busy = [(minute // 60) % 24 in busy_hours for minute in minutes]
+    return Trace(
+        start=datetime(2021, 6, 1),
+        container_pending=[pending if b else 0.0 for b in busy],
+        memory_allocated_mb=[24576.0 if b else 2000.0 for b in busy],
+        memory_total_mb=[24576.0 for _ in minutes]
+    )
+
+
+class SimulatedClusterTest(TestCase):
+
+    def test_instances_join_after_provisioning_delay(self):
+        cluster = SimulatedCluster(daily_trace(1, busy_hours=[0]), ClusterModel(up_minutes=3))
+        self.assertEqual(cluster.advance(), (0, 40.0))
+        cluster.modify_instance_groups(InstanceGroups=[{"InstanceGroupId": "ig-SIMULATION", "InstanceCount": 10}])
+        for _ in range(3):
+            self.assertEqual(cluster.advance(), (10, 40.0))
+        self.assertEqual(cluster.advance(), (10, 0.0))
+        self.assertEqual(cluster.series["MemoryTotalMB"][-1], 24576.0 + 10 * cluster.node_memory_mb)
+
+    def test_metric_data_per_bucket(self):
+        trace = daily_trace(1, busy_hours=[0])
+        cluster = SimulatedCluster(trace, ClusterModel(up_minutes=3))
+        query = {"Id": "pending", "MetricStat": {
+            "Metric": {"MetricName": "ContainerPending"}, "Period": 300, "Stat": "Maximum"
+        }}
+
+        def pending_until(minute):
+            # Instances requested in minute 3 take the pending containers from minute 6 on.
+            while cluster.minute < minute:
+                if cluster.minute == 3:
+                    cluster.modify_instance_groups(InstanceGroups=[{"InstanceCount": 10}])
+                cluster.advance()
+            result = cluster.get_metric_data([query], trace.start, trace.start + timedelta(hours=1))
+            return result["MetricDataResults"][0]
+
+        self.assertEqual(pending_until(7)["Values"], [40.0, 40.0])
+        result = pending_until(12)
+        self.assertEqual(result["Values"], [0.0, 40.0, 40.0])
+        self.assertEqual(result["Timestamps"], [trace.start + timedelta(minutes=m) for m in (10, 5, 0)])
+
+
+class SimulatorTest(TestCase):
+
+    def setUp(self):
+        self.trace_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.trace_dir)
+
+    def test_scales_up_for_bursts_and_down_at_night(self):
+        result = simulate(daily_trace(2))
+        self.assertEqual(result.evaluations, 2 * 24 * 12 - 1)
+        self.assertGreater(result.scale_ups, 0)
+        self.assertGreater(result.scale_downs, 0)
+        self.assertGreater(result.instance_hours, 0)
+        self.assertLess(result.backlog_container_minutes, 2 * 3 * 60 * 40.0)
+
+    def test_compares_policies_by_cost_and_backlog(self):
+        demand, step = compare(daily_trace(2), {
+            "step": {},
+            "demand": {"ScaleUpMode": "DEMAND", "MaxInstances": "40"}
+        })
+        self.assertEqual((demand.policy, step.policy), ("demand", "step"))
+        self.assertLess(demand.backlog_container_minutes, step.backlog_container_minutes)
+
+    def test_cooldown_and_forecast_run_on_simulated_time(self):
+        # The profile learns each hour of the week, so it only pays off from the second week on.
+        trace = daily_trace(9)
+        plain = simulate(trace)
+        cooled = simulate(trace, {"StateTable": "scaling-state", "UpCooldownSeconds": "1800"})
+        self.assertLess(cooled.scale_ups, plain.scale_ups)
+        forecast = simulate(trace, {"ForecastWeeks": "1", "ForecastLeadMinutes": "60"})
+        self.assertLess(forecast.backlog_container_minutes, plain.backlog_container_minutes)
+
+    def test_replays_a_month(self):
+        result = simulate(daily_trace(30))
+        self.assertEqual(result.evaluations, 30 * 24 * 12 - 1)
+        self.assertEqual(result.scale_ups, simulate(daily_trace(1)).scale_ups * 30)
+
+    def test_loads_csv_trace(self):
+        path = os.path.join(self.trace_dir, "trace.csv")
+        with open(path, "w") as f:
+            f.write("Timestamp,ContainerPending,MemoryAllocatedMB,MemoryTotalMB\n")
+            f.write("2021-06-01T07:00:00Z,3,1000,2000\n")
+            f.write("2021-06-01T07:01:00Z,0,500,2000\n")
+        self.assertEqual(
+            load_trace(path), Trace(datetime(2021, 6, 1, 7), [3.0, 0.0], [1000.0, 500.0], [2000.0, 2000.0])
+        )
@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from app import scaler_lambda
+from app.emr_autoscaling import clients
+from app.emr_autoscaling.constants import DOWN, UP
+from app.emr_autoscaling.emr import Emr, MetricSnapshot
+from app.emr_autoscaling.scaler import EmrScaler
+from app.emr_autoscaling.state import Cooldown, DynamoDbStateStore, FileStateStore, ScalingAction
+from mock import patch
+from tests.local import LocalCloudWatch, LocalDynamoDb, LocalEmr
+from unittest import TestCase
+
+
+class StateStoreTest(TestCase):
+
+    def setUp(self):
+        clients.clear_clients()
+        self.dynamodb = LocalDynamoDb()
+        self.dynamodb.add_table("scaling-state")
+        clients.register_client("dynamodb", self.dynamodb)
+        self.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        clients.clear_clients()
+        shutil.rmtree(self.state_dir)
+
+    def assert_round_trip(self, store):
+        self.assertIsNone(store.get("j-1"))
+        store.record("j-1", ScalingAction(UP, 100.5), ["ig-1", "ig-2"])
+        store.record("j-2", ScalingAction(DOWN, 200.0))
+        store.record("j-1", ScalingAction(DOWN, 300.0), ["ig-2"])
+        self.assertEqual(store.get("j-1"), ScalingAction(DOWN, 300.0))
+        self.assertEqual(store.get("j-1", "ig-1"), ScalingAction(UP, 100.5))
+        self.assertEqual(store.get("j-1", "ig-2"), ScalingAction(DOWN, 300.0))
+        self.assertEqual(store.get("j-2"), ScalingAction(DOWN, 200.0))
+        self.assertIsNone(store.get("j-2", "ig-1"))
+
+    def test_dynamodb_store_round_trip(self):
+        self.assert_round_trip(DynamoDbStateStore("scaling-state"))
+
+    def test_dynamodb_store_writes_in_batches(self):
+        DynamoDbStateStore("scaling-state").record("j-1", ScalingAction(UP, 1.0), ["ig-%s" % i for i in range(30)])
+        self.assertEqual([call.operation for call in self.dynamodb.calls], ["BatchWriteItem", "BatchWriteItem"])
+        self.assertEqual(len(self.dynamodb.tables["scaling-state"]["Items"]), 31)
+
+    def test_dynamodb_store_uses_region_and_role_of_the_cluster(self):
+        with patch("app.emr_autoscaling.state.get_client") as mock_get_client:
+            DynamoDbStateStore("scaling-state", "eu-central-1", "arn:aws:iam::123456789012:role/scaler")
+        mock_get_client.assert_called_once_with("dynamodb", "eu-central-1", "arn:aws:iam::123456789012:role/scaler")
+
+    @patch("app.emr_autoscaling.emr.get_client")
+    @patch("app.emr_autoscaling.state.DynamoDbStateStore")
+    def test_lambda_creates_store_for_the_role_of_the_cluster(self, mock_store, mock_get_client):
+        scaler_lambda.create_scaler({
+            "JobFlowId": "j-1", "MinInstances": "0", "MaxInstances": "20", "OfficeHoursStart": "7",
+            "OfficeHoursEnd": "18", "ShutdownTime": "23", "StateTable": "scaling-state",
+            "AssumeRoleArn": "arn:aws:iam::123456789012:role/scaler"
+        })
+        mock_store.assert_called_once_with("scaling-state", None, "arn:aws:iam::123456789012:role/scaler")
+
+    def test_file_store_round_trip(self):
+        path = os.path.join(self.state_dir, "state.json")
+        self.assert_round_trip(FileStateStore(path))
+        self.assertEqual(FileStateStore(path).get("j-2"), ScalingAction(DOWN, 200.0))
+
+    def test_file_stores_of_a_batch_share_the_file(self):
+        path = os.path.join(self.state_dir, "state.json")
+        job_flow_ids = ["j-%s" % i for i in range(16)]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(lambda job_flow_id: FileStateStore(path).record(job_flow_id, ScalingAction(UP, 1.0)),
+                              job_flow_ids))
+        self.assertEqual([FileStateStore(path).get(job_flow_id) for job_flow_id in job_flow_ids],
+                         [ScalingAction(UP, 1.0)] * 16)
+        self.assertEqual(os.listdir(self.state_dir), ["state.json"])
+
+
+class CooldownTest(TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.store = FileStateStore(os.path.join(self.state_dir, "state.json"))
+        self.now = 1000.0
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def cooldown(self, **kwargs):
+        return Cooldown(self.store, "j-1", clock=lambda: self.now, **kwargs)
+
+    def test_elapses_separately_per_direction(self):
+        self.store.record("j-1", ScalingAction(UP, 800.0))
+        cooldown = self.cooldown(up_seconds=120, down_seconds=600)
+        self.assertTrue(cooldown.has_elapsed(UP))
+        self.assertFalse(cooldown.has_elapsed(DOWN))
+        self.now = 1400.0
+        self.assertTrue(cooldown.has_elapsed(DOWN))
+
+    def test_reversal_has_to_clear_hysteresis_band(self):
+        self.store.record("j-1", ScalingAction(UP, 0.0))
+        cooldown = self.cooldown(up_band=5, down_band=0.2)
+        self.assertTrue(cooldown.clears_band(UP, 0.7, MetricSnapshot(container_pending=1.0)))
+        self.assertFalse(cooldown.clears_band(DOWN, 0.7, MetricSnapshot(memory_allocated_mb=6, memory_total_mb=10)))
+        self.assertTrue(cooldown.clears_band(DOWN, 0.7, MetricSnapshot(memory_allocated_mb=4, memory_total_mb=10)))
+        cooldown.record(DOWN)
+        self.assertFalse(cooldown.clears_band(UP, 0.7, MetricSnapshot(container_pending=1.0)))
+        self.assertTrue(cooldown.clears_band(UP, 0.7, MetricSnapshot(container_pending=5.0)))
+
+
+class EmrScalerCooldownTest(TestCase):
+
+    def setUp(self):
+        clients.clear_clients()
+        self.state_dir = tempfile.mkdtemp()
+        self.emr = LocalEmr()
+        self.cloudwatch = LocalCloudWatch()
+        clients.register_client("emr", self.emr)
+        clients.register_client("cloudwatch", self.cloudwatch)
+        self.emr.add_cluster("j-1")
+        self.group_id = self.emr.add_instance_group("j-1", instance_count=5)
+        self.now = 1000.0
+
+    def tearDown(self):
+        clients.clear_clients()
+        shutil.rmtree(self.state_dir)
+
+    def maybe_scale(self, pending, memory_allocated_mb):
+        self.cloudwatch.datapoints.clear()
+        self.cloudwatch.put_datapoint("j-1", "ContainerPending", pending)
+        self.cloudwatch.put_datapoint("j-1", "MemoryAllocatedMB", memory_allocated_mb)
+        self.cloudwatch.put_datapoint("j-1", "MemoryTotalMB", 100.0)
+        store = FileStateStore(os.path.join(self.state_dir, "state.json"))
+        scaler = EmrScaler(Emr(job_flow_id="j-1"), cooldown=Cooldown(store, "j-1", clock=lambda: self.now))
+        with patch.object(scaler, "is_in_office_hours", return_value=False):
+            return scaler.maybe_scale(0.7)
+
+    def test_does_not_scale_down_right_after_scaling_up(self):
+        self.assertEqual(self.maybe_scale(3.0, 90.0), UP)
+        self.emr.settle()
+        self.emr.reset_calls()
+        self.now += 60
+        self.assertIsNone(self.maybe_scale(0.0, 10.0))
+        self.assertEqual(self.emr.calls, [])
+        self.now += 900
+        self.assertEqual(self.maybe_scale(0.0, 10.0), DOWN)
+        self.assertEqual(self.emr.instance_group(self.group_id)["RequestedInstanceCount"], 4)
+        store = FileStateStore(os.path.join(self.state_dir, "state.json"))
+        self.assertEqual(store.get("j-1", self.group_id), ScalingAction(DOWN, self.now))
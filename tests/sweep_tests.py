@@ -0,0 +1,43 @@
+import numpy as np
+
+from simulation.simulator import ClusterModel, simulate
+from simulation.sweep import Outcome, Parameters, event, grid, pareto_front, random_sample, screen, sweep
+from tests.simulator_tests import daily_trace
+from unittest import TestCase
+
+
+class SweepTest(TestCase):
+
+    def test_grid_skips_inverted_bounds(self):
+        parameters = grid([0.6, 0.7], [0, 10], [5, 20], [(7, 18)])
+        self.assertEqual(len(parameters), 6)
+        self.assertNotIn(Parameters(0.6, 10, 5, 7, 18), parameters)
+        self.assertEqual(random_sample(parameters, 3, seed=1), random_sample(parameters, 3, seed=1))
+
+    def test_screening_matches_scaler(self):
+        trace = daily_trace(4)
+        model = ClusterModel(initial_instances=2)
+        parameters = grid([0.3, 0.9], [0, 2], [4, 20], [(7, 18), (0, 0)])
+        instance_hours, backlog = screen(trace, parameters, model)
+        # 9 and 13 are at max instances with containers pending outside of office hours.
+        for i in (0, 5, 9, 13):
+            result = simulate(trace, event(parameters[i]), model)
+            self.assertAlmostEqual(instance_hours[i], result.instance_hours)
+            self.assertAlmostEqual(backlog[i], result.backlog_container_minutes)
+
+    def test_pareto_front_keeps_undominated_parameter_sets(self):
+        parameters = ["a", "b", "c", "d", "e"]
+        front = pareto_front(parameters, np.array([10.0, 20.0, 20.0, 30.0, 15.0]), np.array([9.0, 4.0, 3.0, 5.0, 9.0]))
+        self.assertEqual(front, [Outcome("a", 10.0, 9.0), Outcome("c", 20.0, 3.0)])
+
+    def test_sweeps_each_cluster_in_worker_processes(self):
+        parameters = grid([0.5, 0.9], [0], [5, 20], [(7, 18)])
+        fronts = sweep({"quiet": daily_trace(1, busy_hours=[]), "busy": daily_trace(1)}, parameters, workers=2,
+                       verified=True)
+        self.assertEqual(fronts["quiet"], [Outcome(parameters[0], 0.0, 0.0)])
+        self.assertEqual(fronts["busy"][-1].parameters.max_instances, 20)
+        costs = [outcome.instance_hours for outcome in fronts["busy"]]
+        self.assertEqual(costs, sorted(costs))
+
+    def test_sweeps_no_parameter_sets(self):
+        self.assertEqual(sweep({"busy": daily_trace(1)}, grid([0.7], [10], [5], [(7, 18)])), {"busy": []})
@@ -0,0 +1,161 @@
+from app import scaler_lambda
+from app.emr_autoscaling import clients, emr
+from app.emr_autoscaling.throttling import ApiBudget, BudgetExhausted, TokenBucket, clear_buckets
+from botocore.exceptions import ClientError, EndpointConnectionError
+from mock import patch
+from tests.local import LocalAws
+from unittest import TestCase
+
+
+def throttling_error():
+    return ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "ListInstanceGroups")
+
+
+class FakeTime:
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(TestCase):
+
+    def setUp(self):
+        self.time = FakeTime()
+        self.bucket = TokenBucket(4.0, clock=self.time.clock, sleep=self.time.sleep)
+
+    def test_limits_only_after_throttling(self):
+        self.assertEqual([self.bucket.acquire(0) for _ in range(10)], [0.0] * 10)
+        self.bucket.throttled()
+        self.assertEqual(self.bucket.rate, 2.0)
+        self.assertEqual(self.bucket.acquire(1.0), 0.5)
+        self.assertEqual(self.bucket.acquire(1.0), 0.5)
+        self.assertIsNone(self.bucket.acquire(0.1))
+        self.assertEqual(self.time.sleeps, [0.5, 0.5])
+
+    def test_recovers_rate_additively(self):
+        self.bucket.throttled()
+        self.bucket.throttled()
+        self.assertEqual(self.bucket.rate, 1.0)
+        for _ in range(40):
+            self.bucket.succeeded()
+        self.assertEqual(self.bucket.rate, 4.0)
+
+
+class ApiBudgetTest(TestCase):
+
+    def setUp(self):
+        self.time = FakeTime()
+        self.bucket = TokenBucket(4.0, clock=self.time.clock, sleep=self.time.sleep)
+        self.responses = []
+
+    def budget(self, **kwargs):
+        return ApiBudget(buckets=lambda service: self.bucket, sleep=self.time.sleep, jitter=lambda low, high: high,
+                         **kwargs)
+
+    def list_instance_groups(self, ClusterId):
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def test_retries_throttled_calls_with_backoff(self):
+        self.responses = [throttling_error(), throttling_error(), {"InstanceGroups": []}]
+        budget = self.budget(base_delay=0.2)
+        client = budget.wrap("emr", self)
+        self.assertEqual(client.list_instance_groups(ClusterId="j-1"), {"InstanceGroups": []})
+        self.assertEqual(budget.calls["emr"], 3)
+        self.assertEqual(self.bucket.rate, 1.0 + 0.2)
+        # Backoffs of 0.2 and 0.4 seconds, each followed by the wait for a token at the halved rate.
+        self.assertEqual([round(seconds, 6) for seconds in self.time.sleeps], [0.2, 0.3, 0.4, 0.6])
+
+    def test_retries_transient_errors_without_slowing_down(self):
+        server_error = ClientError(
+            {"Error": {"Code": "InternalServerError"}, "ResponseMetadata": {"HTTPStatusCode": 500}}, "ListInstanceGroups"
+        )
+        self.responses = [server_error, {"InstanceGroups": []}]
+        budget = self.budget(base_delay=0.2)
+        self.assertEqual(budget.wrap("emr", self).list_instance_groups(ClusterId="j-1"), {"InstanceGroups": []})
+        self.assertEqual(budget.calls["emr"], 2)
+        self.assertFalse(self.bucket.enabled)
+        self.assertEqual(self.time.sleeps, [0.2])
+
+    def test_raises_transient_errors_once_attempts_are_used_up(self):
+        self.responses = [EndpointConnectionError(endpoint_url="https://elasticmapreduce")] * 3
+        with self.assertRaises(EndpointConnectionError):
+            self.budget(max_attempts=3).wrap("emr", self).list_instance_groups(ClusterId="j-1")
+        self.assertEqual(self.responses, [])
+
+    def test_gives_up_when_throttled_beyond_wait_budget(self):
+        self.responses = [throttling_error()] * 3
+        client = self.budget(max_wait_seconds=0.3, base_delay=0.2).wrap("emr", self)
+        with self.assertRaises(BudgetExhausted):
+            client.list_instance_groups(ClusterId="j-1")
+
+    def test_limits_calls_per_evaluation(self):
+        self.responses = [{}, {}]
+        client = self.budget(max_calls=1).wrap("emr", self)
+        client.list_instance_groups(ClusterId="j-1")
+        with self.assertRaises(BudgetExhausted):
+            client.list_instance_groups(ClusterId="j-1")
+        self.assertEqual(self.responses, [{}])
+
+    def test_calls_refused_a_token_are_not_counted(self):
+        self.bucket.throttled()
+        budget = self.budget(max_wait_seconds=0.1)
+        with self.assertRaises(BudgetExhausted):
+            budget.wrap("emr", self).list_instance_groups(ClusterId="j-1")
+        self.assertEqual(budget.calls["emr"], 0)
+
+    @patch("app.emr_autoscaling.clients.boto3.client")
+    def test_budgeted_clients_leave_retries_to_the_budget(self, mock_client):
+        clients.clear_clients()
+        emr.Emr(job_flow_id="j-1", region="eu-west-1", budget=self.budget())
+        for service in ("emr", "cloudwatch"):
+            mock_client.assert_any_call(service, region_name="eu-west-1", config=clients.SINGLE_ATTEMPT_CONFIG)
+        clients.clear_clients()
+
+    def test_other_errors_are_not_retried(self):
+        self.responses = [ClientError({"Error": {"Code": "ValidationException"}}, "ListInstanceGroups")]
+        with self.assertRaises(ClientError):
+            self.budget().wrap("emr", self).list_instance_groups(ClusterId="j-1")
+
+
+class DeferredEvaluationTest(TestCase):
+
+    def setUp(self):
+        clients.clear_clients()
+        clear_buckets()
+        emr.CLUSTER_DESCRIPTIONS.clear()
+        self.aws = LocalAws()
+        for job_flow_id in ("j-1", "j-2"):
+            self.aws.emr.add_cluster(job_flow_id)
+            self.aws.emr.add_instance_group(job_flow_id, instance_count=2)
+            self.aws.cloudwatch.put_datapoint(job_flow_id, "ContainerPending", 3.0)
+            self.aws.cloudwatch.put_datapoint(job_flow_id, "MemoryAllocatedMB", 90.0)
+            self.aws.cloudwatch.put_datapoint(job_flow_id, "MemoryTotalMB", 100.0)
+        self.aws.register()
+
+    def tearDown(self):
+        clients.clear_clients()
+        clear_buckets()
+
+    def test_cluster_over_budget_is_deferred(self):
+        results = scaler_lambda.lambda_handler({
+            "Threshold": "0.7",
+            "MinInstances": "0",
+            "MaxInstances": "20",
+            "OfficeHoursStart": "7",
+            "OfficeHoursEnd": "18",
+            "ShutdownTime": "23",
+            "Clusters": [{"JobFlowId": "j-1"}, {"JobFlowId": "j-2", "MaxApiCalls": "1"}]
+        }, None)["Results"]
+        self.assertEqual([result["Status"] for result in results], ["OK", "DEFERRED"])
+        self.assertIn("1 API calls made", results[1]["Reason"])
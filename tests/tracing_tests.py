@@ -0,0 +1,95 @@
+import io
+import json
+
+from app import scaler_lambda
+from app.emr_autoscaling import clients, emr
+from app.emr_autoscaling.throttling import ApiBudget, TokenBucket
+from app.emr_autoscaling.tracing import MAX_VALUES, TRACER, Span, TracedClient, Tracer
+from botocore.exceptions import ClientError
+from mock import MagicMock, patch
+from tests.local import LocalAws
+from unittest import TestCase
+
+
+def span(operation="ListInstanceGroups", seconds=0.01):
+    return Span("emr", operation, seconds, 0, 100, False)
+
+
+class TracedClientTest(TestCase):
+
+    def setUp(self):
+        self.tracer = Tracer(stream=io.StringIO())
+        self.client = MagicMock()
+        self.traced = TracedClient("emr", self.client, self.tracer)
+
+    def recorded_spans(self):
+        spans = []
+        with patch.object(self.tracer, "emit", spans.extend), self.tracer.invocation():
+            self.traced.list_instance_groups(ClusterId="j-1")
+            self.client.modify_instance_groups.side_effect = ClientError(
+                {"Error": {"Code": "ThrottlingException"}, "ResponseMetadata": {"RetryAttempts": 3}},
+                "ModifyInstanceGroups"
+            )
+            with self.assertRaises(ClientError):
+                self.traced.modify_instance_groups(InstanceGroups=[])
+        return spans
+
+    def test_records_operation_retries_and_response_size(self):
+        self.client.list_instance_groups.return_value = {
+            "InstanceGroups": [],
+            "ResponseMetadata": {"RetryAttempts": 1, "HTTPHeaders": {"content-length": "512"}}
+        }
+        first, second = self.recorded_spans()
+        self.assertEqual(first._replace(seconds=0), Span("emr", "ListInstanceGroups", 0, 1, 512, False))
+        self.assertEqual(second._replace(seconds=0), Span("emr", "ModifyInstanceGroups", 0, 3, 0, True))
+        self.client.list_instance_groups.assert_called_once_with(ClusterId="j-1")
+
+    def test_records_retries_of_the_api_budget(self):
+        self.client.list_instance_groups.side_effect = [
+            ClientError({"Error": {"Code": "ThrottlingException"}}, "ListInstanceGroups"),
+            {"InstanceGroups": []}
+        ]
+        budget = ApiBudget(buckets=lambda service: TokenBucket(100.0, sleep=lambda seconds: None),
+                           sleep=lambda seconds: None)
+        spans = []
+        with patch.object(self.tracer, "emit", spans.extend), self.tracer.invocation():
+            budget.wrap("emr", self.traced).list_instance_groups(ClusterId="j-1")
+        self.assertEqual([(span.retries, span.failed) for span in spans], [(0, True), (1, False)])
+
+    def test_calls_straight_through_outside_of_invocations(self):
+        self.assertIs(self.traced.list_instance_groups, self.client.list_instance_groups)
+
+
+class TracerTest(TestCase):
+
+    def test_one_document_per_hundred_calls_of_an_operation(self):
+        spans = [span() for _ in range(MAX_VALUES + 1)] + [span("DescribeCluster", 0.002)]
+        first, second = Tracer().documents(spans, timestamp=1.5)
+        directive = first["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual(first["_aws"]["Timestamp"], 1500)
+        self.assertEqual(directive["Dimensions"], [[]])
+        self.assertIn({"Name": "emr.ListInstanceGroups.Latency", "Unit": "Milliseconds"}, directive["Metrics"])
+        self.assertEqual(first["emr.ListInstanceGroups.Latency"], [10.0] * MAX_VALUES)
+        self.assertEqual(first["emr.DescribeCluster.Latency"], [2.0])
+        self.assertEqual(second["emr.ListInstanceGroups.ResponseBytes"], [100])
+        self.assertNotIn("emr.DescribeCluster.Latency", second)
+
+    def test_lambda_handler_writes_one_line_per_invocation(self):
+        aws = LocalAws()
+        aws.emr.add_cluster("j-1")
+        aws.emr.add_instance_group("j-1", instance_count=2, running_instance_count=1)
+        clients.clear_clients()
+        emr.CLUSTER_DESCRIPTIONS.clear()
+        aws.register()
+        stream = io.StringIO()
+        event = {"JobFlowId": "j-1", "Threshold": "0.7", "MinInstances": "0", "MaxInstances": "20",
+                 "OfficeHoursStart": "7", "OfficeHoursEnd": "18", "ShutdownTime": "23"}
+        try:
+            with patch.object(TRACER, "stream", stream):
+                scaler_lambda.lambda_handler(event, None)
+        finally:
+            clients.clear_clients()
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["emr.ListInstanceGroups.Errors"], [0])
+        self.assertFalse(TRACER.active)
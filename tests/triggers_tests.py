@@ -0,0 +1,76 @@
+import json
+
+from app.emr_autoscaling.triggers import Deduplicator, is_trigger_event, triggered_job_flow_ids
+from unittest import TestCase
+
+
+def alarm_event(state, job_flow_id="j-1"):
+    return {
+        "source": "aws.cloudwatch",
+        "detail-type": "CloudWatch Alarm State Change",
+        "detail": {
+            "alarmName": "pending-containers",
+            "state": {"value": state},
+            "configuration": {
+                "metrics": [
+                    {
+                        "id": "m1",
+                        "metricStat": {
+                            "metric": {
+                                "namespace": "AWS/ElasticMapReduce",
+                                "name": "ContainerPending",
+                                "dimensions": {"JobFlowId": job_flow_id}
+                            }
+                        }
+                    }
+                ]
+            }
+        }
+    }
+
+
+def emr_event(state, instance_group_type="TASK"):
+    return {
+        "source": "aws.emr",
+        "detail-type": "EMR Instance Group State Change",
+        "detail": {
+            "clusterId": "j-2",
+            "instanceGroupId": "ig-1",
+            "instanceGroupType": instance_group_type,
+            "state": state
+        }
+    }
+
+
+class TriggersTest(TestCase):
+
+    def test_alarm_entering_alarm_state_triggers_its_cluster(self):
+        self.assertEqual(triggered_job_flow_ids(alarm_event("ALARM")), ["j-1"])
+        self.assertEqual(triggered_job_flow_ids(alarm_event("OK")), [])
+
+    def test_finished_task_group_resize_triggers_its_cluster(self):
+        self.assertEqual(triggered_job_flow_ids(emr_event("RUNNING")), ["j-2"])
+        self.assertEqual(triggered_job_flow_ids(emr_event("RESIZING")), [])
+        self.assertEqual(triggered_job_flow_ids(emr_event("RUNNING", instance_group_type="CORE")), [])
+
+    def test_sns_alarm_notifications_trigger_each_cluster_once(self):
+        message = {
+            "AlarmName": "pending-containers",
+            "NewStateValue": "ALARM",
+            "Trigger": {"Dimensions": [{"name": "JobFlowId", "value": "j-3"}]}
+        }
+        event = {"Records": [{"Sns": {"Message": json.dumps(message)}}, {"Sns": {"Message": json.dumps(message)}}]}
+        self.assertTrue(is_trigger_event(event))
+        self.assertEqual(triggered_job_flow_ids(event), ["j-3"])
+
+    def test_scheduled_events_are_no_triggers(self):
+        self.assertFalse(is_trigger_event({"JobFlowId": "j-1", "Threshold": "0.7"}))
+
+    def test_deduplicates_within_window(self):
+        now = [0.0]
+        deduplicator = Deduplicator(60, clock=lambda: now[0])
+        self.assertTrue(deduplicator.claim("j-1"))
+        self.assertFalse(deduplicator.claim("j-1"))
+        self.assertTrue(deduplicator.claim("j-2"))
+        now[0] = 60.0
+        self.assertTrue(deduplicator.claim("j-1"))
@@ -0,0 +1,24 @@
+from app.emr_autoscaling.utils import TtlCache
+from unittest import TestCase
+
+
+class TtlCacheTest(TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.loads = 0
+        self.cache = TtlCache(ttl_seconds=60, clock=lambda: self.now)
+
+    def load(self):
+        self.loads += 1
+        return self.loads
+
+    def test_returns_cached_value_within_ttl(self):
+        self.assertEqual(self.cache.get("key", self.load), 1)
+        self.now = 59.0
+        self.assertEqual(self.cache.get("key", self.load), 1)
+
+    def test_reloads_after_ttl(self):
+        self.cache.get("key", self.load)
+        self.now = 60.0
+        self.assertEqual(self.cache.get("key", self.load), 2)